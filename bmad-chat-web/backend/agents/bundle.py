@@ -0,0 +1,99 @@
+"""预编译角色包：把角色目录下的全部 .md 文件解析结果和渲染好的 system prompt 前缀写入一个 JSON 文件
+
+    python -m agents.bundle [--agents-path DIR] [-o FILE]      （在 backend 目录下运行）
+
+启动时 AgentRegistry 只需读取这一个文件，不再逐个解析 markdown + YAML（也不必导入 yaml）。
+文件第一行是其余内容的 sha256，读取时校验；每个角色文件记录内容的 sha1，
+角色文件的 mtime/size 与包内记录不一致时按内容指纹判断是否真的变化，变化的文件照常重新解析。
+"""
+import argparse
+import hashlib
+import json
+import os
+from config import BMAD_AGENTS_PATH, AGENTS_BUNDLE_FILE
+
+BUNDLE_VERSION = 1
+
+
+def content_hash(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def build_bundle(agents_path=BMAD_AGENTS_PATH, tools=None):
+    """解析角色目录，返回包内容（dict）"""
+    from agents.loader import parse_agent
+    from agents.prompts import get_prompt_prefix
+
+    files = {}
+    prompts = []
+    for entry in sorted(os.scandir(agents_path), key=lambda e: e.name):
+        if not entry.name.endswith('.md') or not entry.is_file():
+            continue
+        stat = entry.stat()
+        with open(entry.path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        agent = parse_agent(content, entry.path)
+        files[entry.name] = {
+            'sha1': content_hash(content),
+            'mtimeNs': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'agent': agent
+        }
+        if agent:
+            prompts.append({'id': agent['id'], 'version': agent['version'],
+                            'prefix': get_prompt_prefix(agent, tools)})
+
+    return {
+        'version': BUNDLE_VERSION,
+        'agentsPath': os.path.abspath(agents_path),
+        'toolsKey': [[tool['name'], tool.get('description', '')] for tool in tools or []],
+        'files': files,
+        'prompts': prompts
+    }
+
+
+def write_bundle(bundle, path=AGENTS_BUNDLE_FILE):
+    from file_edit import atomic_write
+
+    body = json.dumps(bundle, ensure_ascii=False, sort_keys=True)
+    digest = hashlib.sha256(body.encode('utf-8')).hexdigest()
+    atomic_write(path, f"{digest}\n{body}")
+
+
+def load_bundle(path=AGENTS_BUNDLE_FILE, agents_path=BMAD_AGENTS_PATH):
+    """读取并校验角色包；文件不存在、损坏或不属于该角色目录时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+    except OSError:
+        return None
+
+    digest, _, body = raw.partition(b'\n')
+    if hashlib.sha256(body).hexdigest().encode('ascii') != digest:
+        print(f"角色包校验失败，忽略: {path}")
+        return None
+    try:
+        bundle = json.loads(body)
+    except ValueError:
+        return None
+    if bundle.get('version') != BUNDLE_VERSION or bundle.get('agentsPath') != os.path.abspath(agents_path):
+        return None
+    return bundle
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='把角色定义预编译为一个角色包')
+    parser.add_argument('--agents-path', default=BMAD_AGENTS_PATH)
+    parser.add_argument('-o', '--output', default=AGENTS_BUNDLE_FILE)
+    args = parser.parse_args(argv)
+
+    from tools import TOOLS
+
+    bundle = build_bundle(args.agents_path, TOOLS)
+    write_bundle(bundle, args.output)
+    loaded = sum(1 for item in bundle['files'].values() if item['agent'])
+    print(f"已写入 {args.output}：{len(bundle['files'])} 个文件，{loaded} 个角色")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,172 @@
+import hashlib
 import os
 import re
-import yaml
-from config import BMAD_AGENTS_PATH
+import threading
+import time
+from config import BMAD_AGENTS_PATH, AGENTS_RELOAD_INTERVAL, AGENTS_WATCH, AGENTS_BUNDLE_FILE
+from agents.bundle import load_bundle, content_hash
 
-def load_agents():
-    """加载所有 BMad 角色"""
-    agents = []
+YAML_BLOCK_RE = re.compile(r'```yaml\n(.*?)```', re.DOTALL)
 
-    if not os.path.exists(BMAD_AGENTS_PATH):
-        return agents
 
-    for filename in os.listdir(BMAD_AGENTS_PATH):
-        if filename.endswith('.md'):
-            filepath = os.path.join(BMAD_AGENTS_PATH, filename)
-            agent = load_agent(filepath)
-            if agent:
-                agents.append(agent)
+class AgentRegistry:
+    """角色注册表：解析一次、按 ID 索引，文件 mtime/size 变化时按文件重新加载
 
-    return agents
+    存在有效的预编译角色包（见 agents.bundle）时先用包内的解析结果，
+    mtime/size 对不上的文件再比较内容指纹，只有内容确实变化才重新解析。
+    """
 
-def load_agent(filepath):
-    """加载单个角色文件"""
+    def __init__(self, agents_path, reload_interval=AGENTS_RELOAD_INTERVAL, watch=AGENTS_WATCH,
+                 bundle_path=AGENTS_BUNDLE_FILE):
+        self.agents_path = agents_path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        # filename -> (mtime_ns, size, agent)
+        self._files = {}
+        # filename -> 角色包中记录的内容 sha1
+        self._bundled = {}
+        self._by_id = {}
+        self._agents = []
+        self._checked_at = None
+        self._dirty = True
+        self._observer = None
+        if bundle_path:
+            self._load_bundle(bundle_path)
+        if watch:
+            self.start_watching()
+
+    def _load_bundle(self, bundle_path):
+        bundle = load_bundle(bundle_path, self.agents_path)
+        if bundle is None:
+            return
+        from agents.prompts import seed_prefixes
+
+        self._set_files({name: (item['mtimeNs'], item['size'], item['agent'])
+                         for name, item in bundle['files'].items()})
+        self._bundled = {name: item['sha1'] for name, item in bundle['files'].items()}
+        tools_key = tuple(tuple(tool) for tool in bundle['toolsKey'])
+        seed_prefixes((item['id'], item['version'], tools_key, item['prefix']) for item in bundle['prompts'])
+
+    def refresh(self, force=False):
+        """按需检查角色目录，只重新解析发生变化的文件"""
+        if not force and not self._needs_check():
+            return
+        with self._lock:
+            if not force and not self._needs_check():
+                return
+            self._dirty = False
+            self._scan()
+            self._checked_at = time.monotonic()
+
+    def _needs_check(self):
+        if self._dirty or self._checked_at is None:
+            return True
+        if self._observer is not None:
+            return False
+        return time.monotonic() - self._checked_at >= self.reload_interval
+
+    def _scan(self):
+        try:
+            entries = list(os.scandir(self.agents_path))
+        except (FileNotFoundError, NotADirectoryError):
+            entries = []
+
+        files = {}
+        changed = False
+        for entry in entries:
+            if not entry.name.endswith('.md') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            cached = self._files.get(entry.name)
+            if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                files[entry.name] = cached
+                continue
+            # 例如部署时重新检出导致 mtime 变化：内容与角色包一致就沿用包内的结果
+            bundled = self._bundled.pop(entry.name, None)
+            content = read_agent_file(entry.path)
+            if cached and bundled and content is not None and content_hash(content) == bundled:
+                files[entry.name] = (stat.st_mtime_ns, stat.st_size, cached[2])
+            else:
+                files[entry.name] = (stat.st_mtime_ns, stat.st_size, parse_agent(content, entry.path))
+                changed = True
+
+        if not changed and files.keys() == self._files.keys():
+            self._files = files
+            return
+        self._set_files(files)
+
+    def _set_files(self, files):
+        agents = [files[name][2] for name in sorted(files) if files[name][2]]
+        self._files = files
+        self._agents = agents
+        self._by_id = {agent['id']: agent for agent in agents}
+
+    def all(self):
+        """获取全部角色"""
+        self.refresh()
+        return list(self._agents)
+
+    def get(self, agent_id):
+        """根据 ID 获取角色"""
+        self.refresh()
+        return self._by_id.get(agent_id)
+
+    def start_watching(self):
+        """开启文件系统监听模式，未安装 watchdog 时退回按间隔检查"""
+        if self._observer is not None:
+            return True
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            print("watchdog 未安装，角色注册表退回按间隔检查文件变化")
+            return False
+        if not os.path.isdir(self.agents_path):
+            return False
+
+        registry = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                registry._dirty = True
+
+        observer = Observer()
+        observer.schedule(_Handler(), self.agents_path, recursive=False)
+        observer.daemon = True
+        observer.start()
+        self._observer = observer
+        return True
+
+    def stop_watching(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+
+def read_agent_file(filepath):
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
+            return f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Error loading agent from {filepath}: {e}")
+        return None
+
 
+def load_agent(filepath):
+    """加载单个角色文件"""
+    content = read_agent_file(filepath)
+    return parse_agent(content, filepath) if content is not None else None
+
+
+def parse_agent(content, filepath=''):
+    """解析角色文件内容（yaml 只在确实需要解析角色文件时才导入）"""
+    if content is None:
+        return None
+    import yaml
+
+    try:
         # 提取 YAML 块
-        yaml_match = re.search(r'```yaml\n(.*?)```', content, re.DOTALL)
+        yaml_match = YAML_BLOCK_RE.search(content)
         if not yaml_match:
             return None
 
@@ -48,16 +188,23 @@ def load_agent(filepath):
             'style': data.get('persona', {}).get('style', ''),
             'role': data.get('persona', {}).get('role', ''),
             'focus': data.get('persona', {}).get('focus', ''),
+            # 角色文件内容的指纹，文件变化后随之改变
+            'version': hashlib.sha1(content.encode('utf-8')).hexdigest()[:12],
         }
 
     except Exception as e:
         print(f"Error loading agent from {filepath}: {e}")
         return None
 
+
+registry = AgentRegistry(BMAD_AGENTS_PATH)
+
+
+def load_agents():
+    """加载所有 BMad 角色"""
+    return registry.all()
+
+
 def get_agent_by_id(agent_id):
     """根据 ID 获取角色"""
-    agents = load_agents()
-    for agent in agents:
-        if agent['id'] == agent_id:
-            return agent
-    return None
+    return registry.get(agent_id)
@@ -1,3 +1,10 @@
+import threading
+
+# (agent id, agent version, 工具签名) -> 稳定前缀
+_prefix_cache = {}
+_prefix_lock = threading.Lock()
+
+
 def build_system_prompt(agent):
     """根据角色定义构建 system prompt"""
 
@@ -5,7 +12,7 @@ def build_system_prompt(agent):
     core_principles = agent.get('core_principles', [])
     commands = agent.get('commands', [])
 
-    prompt = f"""你是 {agent['name']}，{agent['title']}。
+    parts = [f"""你是 {agent['name']}，{agent['title']}。
 
 ## 角色定义
 {persona.get('role', '')}
@@ -20,25 +27,77 @@ def build_system_prompt(agent):
 {persona.get('focus', '')}
 
 ## 核心原则
-"""
+"""]
     for i, principle in enumerate(core_principles, 1):
-        prompt += f"{i}. {principle}\n"
+        parts.append(f"{i}. {principle}\n")
 
-    prompt += """
+    parts.append("""
 ## 可用命令
-"""
+""")
     for cmd in commands:
         if isinstance(cmd, dict):
             for key, value in cmd.items():
-                prompt += f"- *{key}: {value}\n"
+                parts.append(f"- *{key}: {value}\n")
         else:
-            prompt += f"- *{cmd}\n"
+            parts.append(f"- *{cmd}\n")
 
-    prompt += f"""
+    parts.append(f"""
 ## 使用场景
 {agent.get('whenToUse', '')}
 
 请以 {agent['name']} 的身份与用户交流。回答问题，执行命令，并在适当时候提供专业建议。
-"""
+""")
+
+    return "".join(parts)
+
+
+def build_tools_prompt(tools):
+    """构建工具使用说明"""
+    lines = ["\n\n你可以使用以下工具来帮助用户：\n"]
+    for tool in tools:
+        lines.append(f"- {tool['name']}: {tool.get('description', '')}\n")
+    return "".join(lines)
+
+
+def get_prompt_prefix(agent, tools=None):
+    """获取角色的稳定前缀（角色定义 + 工具说明），按角色版本缓存"""
+    tools = tools or []
+    tools_key = tuple((tool['name'], tool.get('description', '')) for tool in tools)
+    key = (agent['id'], agent.get('version'), tools_key)
+
+    prefix = _prefix_cache.get(key)
+    if prefix is not None:
+        return prefix
+
+    prefix = build_system_prompt(agent)
+    if tools:
+        prefix += build_tools_prompt(tools)
+
+    with _prefix_lock:
+        # 角色文件更新后丢弃旧版本的前缀
+        for stale in [k for k in _prefix_cache if k[0] == key[0] and k[1] != key[1]]:
+            del _prefix_cache[stale]
+        _prefix_cache[key] = prefix
+    return prefix
+
+
+def seed_prefixes(entries):
+    """用预编译角色包中渲染好的前缀预热缓存，entries 为 (agent id, version, 工具签名, 前缀)"""
+    with _prefix_lock:
+        for agent_id, version, tools_key, prefix in entries:
+            _prefix_cache[(agent_id, version, tools_key)] = prefix
+
 
-    return prompt
+def build_system_blocks(agent, tools=None, project_path=None):
+    """构建 system 块：可缓存的稳定前缀 + 与项目相关的小后缀"""
+    blocks = [{
+        'type': 'text',
+        'text': get_prompt_prefix(agent, tools),
+        'cache_control': {'type': 'ephemeral'}
+    }]
+    if project_path:
+        blocks.append({
+            'type': 'text',
+            'text': f"当前工作目录: {project_path}\n"
+        })
+    return blocks
@@ -1,190 +1,122 @@
 import os
 import json
 import time
-import subprocess
-from datetime import datetime
-from flask import Flask, request, jsonify
+import uuid
+from flask import Flask, request, jsonify, send_file, g
 from flask_cors import CORS
-from anthropic import Anthropic
-from anthropic.types import ToolUseBlock
 from agents.loader import load_agents, get_agent_by_id
-from agents.prompts import build_system_prompt
+from agents.prompts import build_system_blocks
 from store import store
-from config import ANTHROPIC_BASE_URL, ANTHROPIC_API_KEY, MODEL_NAME
-from claude.cli_discovery import get_claude_cli_path
+from conversation_writer import conversation_writer
+from context import build_context
+from tools import TOOLS
+from chat_engine import engine
+from upstream import upstream
+from file_index import get_index
+from file_reader import read_text, file_etag
+from search_index import search_index
+from health import run_checks
+from responses import FastJSONProvider, compress_response
+from scheduler import scheduler, SchedulerBusyError
+from transfer import export_stream, import_records, open_import_stream, parse_time, COMPRESSIONS, TransferError
+import metrics
+from metrics import span, start_trace, server_timing
+from config import (
+    SERVER_PORT, SERVER_DEBUG, MODEL_NAME, CONTEXT_DIGEST_MAX_TOKENS,
+    FILE_LIST_PAGE_SIZE, FILE_LIST_MAX_PAGE_SIZE, CLAUDE_STREAM_HEARTBEAT, TRACE_SLOW_MS,
+    SEARCH_RESULT_LIMIT, SEARCH_MAX_RESULT_LIMIT, SSE_BATCH_WINDOW
+)
+from claude.worker_pool import pool as claude_pool, PoolBusyError, WorkerExitedError
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
-# 初始化 Anthropic 客户端
-client = Anthropic(
-    base_url=ANTHROPIC_BASE_URL,
-    api_key=ANTHROPIC_API_KEY
-)
-
-# Claude CLI 会话管理器
-claude_session_id = None
-
-# 定义工具列表
-TOOLS = [
-    {
-        "name": "write_file",
-        "description": "写入内容到指定文件。如果文件不存在则创建，如果文件已存在则覆盖内容。",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "file_path": {"type": "string", "description": "文件路径，例如: /Users/apple/project/test.md"},
-                "content": {"type": "string", "description": "要写入的文件内容"}
-            },
-            "required": ["file_path", "content"]
-        }
-    },
-    {
-        "name": "read_file",
-        "description": "读取指定文件的内容并返回。",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "file_path": {"type": "string", "description": "文件路径，例如: /Users/apple/project/test.md"}
-            },
-            "required": ["file_path"]
-        }
-    },
-    {
-        "name": "list_directory",
-        "description": "列出指定目录下的所有文件和子目录。",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "directory_path": {"type": "string", "description": "目录路径"}
-            },
-            "required": ["directory_path"]
-        }
-    },
-    {
-        "name": "get_working_directory",
-        "description": "获取当前工作目录的路径。",
-        "input_schema": {
-            "type": "object",
-            "properties": {},
-            "required": []
-        }
-    }
-]
-
-
-def execute_tool(tool_name, tool_input, project_path=None):
-    """执行工具调用"""
-    try:
-        if tool_name == "write_file":
-            file_path = tool_input.get("file_path")
-            content = tool_input.get("content", "")
-
-            # 安全检查：防止路径遍历
-            if ".." in file_path:
-                return {"error": "无效的路径"}
-
-            # 确保目录存在
-            dir_path = os.path.dirname(file_path)
-            if dir_path:
-                os.makedirs(dir_path, exist_ok=True)
+metrics.registry.gauge(
+    'bmad_upstream_requests', '进行中与排队等待的上游请求数',
+    lambda: {(state,): upstream.stats()[state] for state in ('active', 'waiting')}, ('state',))
+metrics.registry.gauge(
+    'bmad_claude_workers', 'Claude CLI 工作进程数',
+    lambda: {(state,): claude_pool.stats()[key] for state, key in (('total', 'workers'), ('busy', 'busy'))},
+    ('state',))
+metrics.registry.gauge(
+    'bmad_scheduler_requests', '调度器中处理中与排队的对话请求数',
+    lambda: {(state,): scheduler.stats()[state] for state in ('active', 'queued')}, ('state',))
 
-            # 写入文件
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(content)
 
-            return {"success": True, "message": f"文件已写入: {file_path}"}
+@app.errorhandler(SchedulerBusyError)
+def scheduler_busy(e):
+    return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
 
-        elif tool_name == "read_file":
-            file_path = tool_input.get("file_path")
 
-            # 安全检查
-            if ".." in file_path:
-                return {"error": "无效的路径"}
+@app.before_request
+def begin_request_trace():
+    g.started = time.perf_counter()
+    g.trace = start_trace()
 
-            if not os.path.exists(file_path):
-                return {"error": "文件不存在"}
 
-            if os.path.isdir(file_path):
-                return {"error": "不能读取目录"}
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.http_requests.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+    metrics.http_duration.observe(elapsed, method=request.method, endpoint=endpoint)
 
-            # 限制文件大小
-            file_size = os.path.getsize(file_path)
-            if file_size > 500 * 1024:
-                return {"error": "文件太大，无法读取"}
+    timing = server_timing(g.trace)
+    if timing:
+        response.headers['Server-Timing'] = timing
+    if TRACE_SLOW_MS and elapsed * 1000 >= TRACE_SLOW_MS:
+        print(f"Slow request {request.method} {request.path} {elapsed * 1000:.0f}ms: {timing or '-'}")
+    return response
 
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
 
-            return {"content": content, "size": file_size}
+@app.after_request
+def compress(response):
+    # after_request 按注册的逆序执行：压缩耗时计入上面的 Server-Timing
+    with span('compress'):
+        return compress_response(response, request.headers.get('Accept-Encoding'))
 
-        elif tool_name == "list_directory":
-            dir_path = tool_input.get("directory_path")
 
-            if not os.path.exists(dir_path):
-                return {"error": "目录不存在"}
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 格式的运行指标"""
+    return metrics.registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
-            if not os.path.isdir(dir_path):
-                return {"error": "不是有效的目录"}
-
-            items = []
-            for item in os.listdir(dir_path):
-                item_path = os.path.join(dir_path, item)
-                items.append({
-                    "name": item,
-                    "type": "directory" if os.path.isdir(item_path) else "file"
-                })
 
-            return {"items": items}
+@app.route('/api/scheduler', methods=['GET'])
+def scheduler_status():
+    """对话调度器状态：处理中与排队的请求数、各项目队列深度与最长等待时间"""
+    return jsonify(scheduler.stats())
 
-        elif tool_name == "get_working_directory":
-            return {"path": project_path or os.getcwd()}
 
-        else:
-            return {"error": f"未知工具: {tool_name}"}
-
-    except Exception as e:
-        return {"error": str(e)}
-
-def get_file_info(path):
-    """获取文件详细信息"""
-    try:
-        stat = os.stat(path)
-        return {
-            'size': stat.st_size,
-            'modified': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M'),
-            'created': datetime.fromtimestamp(stat.st_ctime).strftime('%Y-%m-%d %H:%M')
-        }
-    except:
-        return {'size': 0, 'modified': '', 'created': ''}
-
-def get_file_tree(path, recursive=False, depth=0, max_depth=3):
-    """获取目录的文件树结构"""
-    items = []
-    try:
-        for item in sorted(os.listdir(path)):
-            item_path = os.path.join(path, item)
-            if os.path.isdir(item_path):
-                children = []
-                if recursive and depth < max_depth:
-                    children = get_file_tree(item_path, recursive, depth + 1, max_depth)
-                items.append({
-                    'name': item,
-                    'type': 'directory',
-                    'path': item_path,
-                    'children': children,
-                    **get_file_info(item_path)
-                })
-            else:
-                items.append({
-                    'name': item,
-                    'type': 'file',
-                    'path': item_path,
-                    **get_file_info(item_path)
-                })
-    except PermissionError:
-        pass
-    return items
+@app.route('/api/health', methods=['GET'])
+def health():
+    """健康检查：数据库与角色目录均可用时返回 200，否则返回 503"""
+    healthy, checks = run_checks()
+    return jsonify({
+        'status': 'ok' if healthy else 'error',
+        'pid': os.getpid(),
+        'checks': checks
+    }), 200 if healthy else 503
+
+
+def summarize_history(previous_digest, messages):
+    """将超出上下文预算的早期对话压缩为摘要"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = "请将以下对话压缩为简洁的摘要，保留关键事实、决定、文件路径和未完成的事项。\n\n"
+    if previous_digest:
+        prompt += f"已有摘要：\n{previous_digest}\n\n"
+    prompt += f"新增对话：\n{transcript}"
+
+    response = upstream.create(
+        model=MODEL_NAME,
+        max_tokens=CONTEXT_DIGEST_MAX_TOKENS,
+        messages=[{'role': 'user', 'content': prompt}]
+    )
+    return "".join(block.text for block in response.content if hasattr(block, 'text'))
 
 @app.route('/api/agents', methods=['GET'])
 def get_agents():
@@ -194,7 +126,7 @@ def get_agents():
 
 @app.route('/api/projects', methods=['GET'])
 def get_projects():
-    """获取项目列表"""
+    """获取项目列表（仅摘要）"""
     projects = store.get_projects()
     return jsonify(projects)
 
@@ -227,21 +159,75 @@ def create_project():
 
 @app.route('/api/projects/<project_id>', methods=['GET'])
 def get_project(project_id):
-    """获取项目详情"""
+    """获取项目详情（仅摘要，对话历史通过分页接口获取）"""
     project = store.get_project(project_id)
     if not project:
         return jsonify({'error': '项目不存在'}), 404
     return jsonify(project)
 
+@app.route('/api/projects/<project_id>/conversations', methods=['GET'])
+def get_project_conversations(project_id):
+    """分页获取项目对话历史（游标为上一页返回的 nextCursor）"""
+    if not store.get_project(project_id):
+        return jsonify({'error': '项目不存在'}), 404
+
+    conversation_writer.sync(project_id)
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        before = request.args.get('before')
+        before = int(before) if before else None
+    except ValueError:
+        return jsonify({'error': '无效的分页参数'}), 400
+
+    return jsonify(store.get_conversations_page(project_id, before=before, limit=limit))
+
 @app.route('/api/projects/<project_id>', methods=['DELETE'])
 def delete_project(project_id):
     """删除项目"""
     store.delete_project(project_id)
     return jsonify({'success': True})
 
+def transfer_filters(args):
+    """导出/导入的过滤参数：project（可重复）、since、until"""
+    return args.getlist('project') or None, parse_time(args.get('since')), parse_time(args.get('until'))
+
+@app.route('/api/export', methods=['GET'])
+def export_data():
+    """流式导出项目与对话（NDJSON，compress=gzip|zstd 时压缩）"""
+    try:
+        project_ids, since, until = transfer_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    compression = request.args.get('compress') or None
+    if compression and compression not in COMPRESSIONS:
+        return jsonify({'error': '不支持的压缩格式'}), 400
+
+    filename = time.strftime('bmad-export-%Y%m%d-%H%M%S.ndjson')
+    filename += {'gzip': '.gz', 'zstd': '.zst'}.get(compression, '')
+    return app.response_class(export_stream(project_ids, since, until, compression), headers={
+        'Content-Type': 'application/x-ndjson' if not compression else f'application/{compression}',
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/import', methods=['POST'])
+def import_data():
+    """流式导入 NDJSON（可为 gzip/zstd 压缩）；importId 相同的重复请求从上次中断处继续"""
+    try:
+        project_ids, since, until = transfer_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    import_id = request.args.get('importId') or str(uuid.uuid4())
+
+    try:
+        stats = import_records(open_import_stream(request.stream), import_id, project_ids, since, until)
+    except TransferError as e:
+        return jsonify({'error': str(e), 'importId': import_id}), 400
+    return jsonify(stats)
+
 @app.route('/api/projects/<project_id>/files', methods=['GET'])
 def get_project_files(project_id):
-    """获取项目的文件列表"""
+    """获取项目的文件列表（支持 ETag 协商缓存）"""
     project = store.get_project(project_id)
     if not project:
         return jsonify({'error': '项目不存在'}), 404
@@ -252,13 +238,96 @@ def get_project_files(project_id):
 
     # 支持递归获取文件树
     recursive = request.args.get('recursive', 'false').lower() == 'true'
-    files = get_file_tree(path, recursive=recursive)
-    return jsonify(files)
+    force = request.args.get('refresh', 'false').lower() == 'true'
+    index = get_index(path)
+    with span('file_tree'):
+        # 先更新索引再计算 ETag，否则根目录的新变化会被旧 ETag 的 304 掩盖
+        if recursive or force:
+            index.refresh(force=force)
+        else:
+            index.refresh_root()
 
-@app.route('/api/files/read', methods=['GET'])
-def read_file():
-    """读取文件内容"""
-    file_path = request.args.get('path')
+        etag = index.etag(recursive)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'X-Tree-Version': index.cursor()}
+        if etag in request.headers.get('If-None-Match', ''):
+            return '', 304, headers
+
+        tree = index.tree(recursive=recursive)
+    return jsonify(tree), 200, headers
+
+@app.route('/api/projects/<project_id>/files/list', methods=['GET'])
+def list_project_files(project_id):
+    """懒加载：分页列出项目中的单个目录（默认为项目根目录）"""
+    project = store.get_project(project_id)
+    if not project:
+        return jsonify({'error': '项目不存在'}), 404
+
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', FILE_LIST_PAGE_SIZE)), 1), FILE_LIST_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': '无效的分页参数'}), 400
+
+    root = project.get('path')
+    with span('file_tree'):
+        listing = get_index(root).list_dir(request.args.get('path') or root, offset, limit)
+    if listing is None:
+        return jsonify({'error': '目录不存在'}), 404
+    return jsonify(listing)
+
+@app.route('/api/projects/<project_id>/files/changes', methods=['GET'])
+def get_project_file_changes(project_id):
+    """获取文件树在指定版本（since=epoch:version，取自列表或上次变更响应的 version）之后的变更"""
+    project = store.get_project(project_id)
+    if not project:
+        return jsonify({'error': '项目不存在'}), 404
+
+    index = get_index(project.get('path'))
+    index.refresh(known_only=True)
+    # 版本号只在处理该请求的工作进程内有效，epoch 不符时要求客户端重新获取
+    changes = index.changes_since(request.args.get('since', ''))
+    if changes is None:
+        return jsonify({'version': index.cursor(), 'reset': True, 'changes': []})
+    return jsonify({'version': index.cursor(), 'reset': False, 'changes': changes})
+
+@app.route('/api/projects/<project_id>/search', methods=['GET'])
+def search_project(project_id):
+    """全文搜索项目文件与对话历史（scope 为 all、files 或 conversations）"""
+    project = store.get_project(project_id)
+    if not project:
+        return jsonify({'error': '项目不存在'}), 404
+
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': '搜索词不能为空'}), 400
+    scope = request.args.get('scope', 'all')
+    if scope not in ('all', 'files', 'conversations'):
+        return jsonify({'error': '无效的搜索范围'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_RESULT_LIMIT)), 1), SEARCH_MAX_RESULT_LIMIT)
+    except ValueError:
+        return jsonify({'error': '无效的分页参数'}), 400
+
+    result = {'query': query}
+    if scope in ('all', 'files'):
+        path = project.get('path')
+        with span('search_files'):
+            result['files'] = search_index.search_files(path, query, limit=limit) if os.path.isdir(path) else []
+    if scope in ('all', 'conversations'):
+        conversation_writer.sync(project_id)
+        with span('search_conversations'):
+            result['conversations'] = search_index.search_conversations(project_id, query, limit)
+    return jsonify(result)
+
+def parse_line_range(args):
+    """解析 offset/limit 行范围参数，返回 (offset, limit)"""
+    offset = max(int(args.get('offset', 0)), 0)
+    limit = args.get('limit')
+    limit = max(int(limit), 1) if limit else None
+    return offset, limit
+
+def check_file_path(file_path):
+    """校验要读取的文件路径，返回错误响应或 None"""
     if not file_path:
         return jsonify({'error': '文件路径不能为空'}), 400
 
@@ -273,230 +342,193 @@ def read_file():
     if os.path.isdir(file_path):
         return jsonify({'error': '不能读取目录'}), 400
 
-    # 限制文件大小（最大 500KB）
-    file_size = os.path.getsize(file_path)
-    if file_size > 500 * 1024:
-        return jsonify({'error': '文件太大，无法预览'}), 400
+    return None
+
+@app.route('/api/files/read', methods=['GET'])
+def read_file():
+    """读取文件内容（支持 offset/limit 行范围与 ETag；大文件只返回指定的行）"""
+    file_path = request.args.get('path')
+    error = check_file_path(file_path)
+    if error:
+        return error
+
+    try:
+        offset, limit = parse_line_range(request.args)
+    except ValueError:
+        return jsonify({'error': '无效的行范围'}), 400
+
+    etag = file_etag(os.stat(file_path))
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return '', 304, headers
 
     # 读取文件内容
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        result = read_text(file_path, offset, limit)
 
         # 获取文件扩展名
         ext = os.path.splitext(file_path)[1].lstrip('.')
 
-        return jsonify({
+        result.update({
             'path': file_path,
             'name': os.path.basename(file_path),
-            'ext': ext,
-            'size': file_size,
-            'content': content
+            'ext': ext
         })
+        headers['ETag'] = result.pop('etag')
+        return jsonify(result), 200, headers
     except UnicodeDecodeError:
         return jsonify({'error': '无法读取二进制文件'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    """发送聊天消息（支持工具调用）"""
-    data = request.json
+@app.route('/api/files/raw', methods=['GET'])
+def read_file_raw():
+    """以流的方式返回原始文件（支持 Range 与 If-None-Match）"""
+    file_path = request.args.get('path')
+    error = check_file_path(file_path)
+    if error:
+        return error
+
+    stat = os.stat(file_path)
+    response = send_file(file_path, conditional=True, etag=file_etag(stat).strip('"'), max_age=0)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def prepare_chat(data):
+    """校验聊天请求并准备 system prompt 与消息列表，返回 (chat, error)"""
     project_id = data.get('projectId')
     agent_id = data.get('agentId')
     message = data.get('message')
-    history = data.get('history', [])
 
     if not project_id or not agent_id or not message:
-        return jsonify({'error': '缺少必要参数'}), 400
+        return None, (jsonify({'error': '缺少必要参数'}), 400)
 
     # 获取角色信息
-    agent = get_agent_by_id(agent_id)
+    with span('get_agent_by_id'):
+        agent = get_agent_by_id(agent_id)
     if not agent:
-        return jsonify({'error': '角色不存在'}), 404
+        return None, (jsonify({'error': '角色不存在'}), 404)
 
     # 获取项目路径
     project = store.get_project(project_id)
     project_path = project.get('path') if project else None
 
-    # 构建 system prompt
-    system_prompt = build_system_prompt(agent)
-    # 添加工具使用说明
-    system_prompt += "\n\n你可以使用以下工具来帮助用户：\n"
-    system_prompt += "- write_file: 写入文件\n"
-    system_prompt += "- read_file: 读取文件\n"
-    system_prompt += "- list_directory: 列出目录\n"
-    system_prompt += "- get_working_directory: 获取当前工作目录\n"
-    if project_path:
-        system_prompt += f"\n当前工作目录: {project_path}\n"
-
-    # 构建消息列表
-    messages = []
-    for msg in history:
-        messages.append({
-            'role': msg.get('role', 'user'),
-            'content': msg.get('content', '')
-        })
-    messages.append({
-        'role': 'user',
-        'content': message
-    })
+    # 构建 system prompt：角色与工具说明为缓存前缀，工作目录为后缀
+    with span('build_system_prompt'):
+        system_prompt = build_system_blocks(agent, TOOLS, project_path)
+
+    # 构建消息列表：从已保存的对话历史按 token 预算组装（项目不存在时使用请求中的 history）
+    history = None if project else data.get('history', [])
+    if project:
+        conversation_writer.sync(project_id)
+    with span('build_context'):
+        messages, digest = build_context(project_id, message, history, summarize=summarize_history,
+                                         system=system_prompt)
+    if digest:
+        system_prompt.append({'type': 'text', 'text': f"\n## 之前对话摘要\n{digest}\n"})
+
+    return {
+        'project_id': project_id,
+        'project_path': project_path,
+        'cache_scope': [agent['id'], agent.get('version')],
+        'message': message,
+        'system': system_prompt,
+        'messages': messages
+    }, None
+
+def request_priority(data):
+    """请求的调度优先级：interactive（默认）或 batch，取自请求体 priority 字段或 X-BMad-Priority 头"""
+    return data.get('priority') or request.headers.get('X-BMad-Priority') or 'interactive'
+
+def streaming_response(generate, ticket, headers):
+    """返回 SSE 响应，响应关闭（含客户端断开、生成器未启动）时归还调度名额"""
+    response = app.response_class(generate(), headers=headers)
+    response.call_on_close(lambda: scheduler.release(ticket))
+    return response
+
+def save_turn(chat, reply):
+    """保存一轮对话到项目（由后台线程写入数据库，不阻塞请求）"""
+    conversation_writer.append(chat['project_id'], [
+        {'role': 'user', 'content': chat['message']},
+        {'role': 'assistant', 'content': reply}
+    ])
 
-    try:
-        # 最多进行 5 轮工具调用
-        max_iterations = 5
-        for iteration in range(max_iterations):
-            response = client.messages.create(
-                model=MODEL_NAME,
-                max_tokens=4096,
-                system=system_prompt,
-                messages=messages,
-                tools=TOOLS
-            )
-
-            # 检查是否有工具调用
-            tool_uses = []
-            text_content = []
-
-            for block in response.content:
-                if hasattr(block, 'type') and block.type == 'tool_use':
-                    tool_uses.append(block)
-                elif hasattr(block, 'text'):
-                    text_content.append(block.text)
-
-            # 如果没有工具调用，处理文本回复并结束
-            if not tool_uses:
-                reply = "".join(text_content)
-                break
-
-            # 处理工具调用
-            for tool_use in tool_uses:
-                tool_name = tool_use.name
-                tool_input = tool_use.input
-                tool_id = tool_use.id
-
-                # 首先，将 AI 的工具调用作为助手消息添加到历史
-                messages.append({
-                    'role': 'assistant',
-                    'content': [tool_use.model_dump()]
-                })
-
-                # 执行工具
-                result = execute_tool(tool_name, tool_input, project_path)
-
-                # 将工具结果添加到消息列表
-                messages.append({
-                    'role': 'user',
-                    'content': [
-                        {
-                            'type': 'tool_result',
-                            'tool_use_id': tool_id,
-                            'content': json.dumps(result)
-                        }
-                    ]
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """发送聊天消息（支持工具调用）"""
+    data = request.json
+    with scheduler.slot(data.get('projectId'), request_priority(data)):
+        chat, error = prepare_chat(data)
+        if error:
+            return error
+
+        for event in engine.stream(chat['system'], chat['messages'], chat['project_path'],
+                                   cache_scope=chat['cache_scope']):
+            if event['type'] == 'error':
+                headers = {'Retry-After': str(event['retryAfter'])} if event['retryAfter'] else {}
+                return jsonify({'error': event['error']}), event['status'], headers
+            if event['type'] == 'done':
+                save_turn(chat, event['reply'])
+                return jsonify({
+                    'reply': event['reply'],
+                    'usage': event['usage']
                 })
 
-            # 继续循环，让 AI 根据工具结果生成回复
-
-        # 保存对话到项目
-        conversation = {
-            'role': 'user',
-            'content': message
-        }
-        store.add_conversation(project_id, conversation)
-        conversation = {
-            'role': 'assistant',
-            'content': reply
-        }
-        store.add_conversation(project_id, conversation)
-
-        return jsonify({
-            'reply': reply,
-            'usage': {
-                'input_tokens': response.usage.input_tokens,
-                'output_tokens': response.usage.output_tokens
-            }
-        })
-
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return jsonify({'error': '对话意外中断'}), 500
 
 @app.route('/api/chat/stream', methods=['POST'])
 def chat_stream():
-    """流式聊天"""
+    """流式聊天：逐条推送文本增量、工具调用与工具结果事件"""
     data = request.json
-    project_id = data.get('projectId')
-    agent_id = data.get('agentId')
-    message = data.get('message')
-    history = data.get('history', [])
-
-    if not project_id or not agent_id or not message:
-        return jsonify({'error': '缺少必要参数'}), 400
-
-    agent = get_agent_by_id(agent_id)
-    if not agent:
-        return jsonify({'error': '角色不存在'}), 404
-
-    system_prompt = build_system_prompt(agent)
-
-    messages = []
-    for msg in history:
-        messages.append({
-            'role': msg.get('role', 'user'),
-            'content': msg.get('content', '')
-        })
-    messages.append({
-        'role': 'user',
-        'content': message
-    })
-
-    def generate():
-        try:
-            with client.messages.stream(
-                model=MODEL_NAME,
-                max_tokens=4096,
-                system=system_prompt,
-                messages=messages
-            ) as stream:
-                for event in stream:
-                    if hasattr(event, 'text') and event.text:
-                        yield f"data: {json.dumps({'text': event.text})}\n\n"
-                    elif hasattr(event, 'type'):
-                        if event.type == 'message_stop':
-                            # 保存对话
-                            conversation = {'role': 'user', 'content': message}
-                            store.add_conversation(project_id, conversation)
-        except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
-
-    return generate(), {'Content-Type': 'text/event-stream'}
+    ticket = scheduler.acquire(data.get('projectId'), request_priority(data))
+    try:
+        chat, error = prepare_chat(data)
+        if error:
+            scheduler.release(ticket)
+            return error
+
+        started = g.started
+
+        def generate():
+            first_token = True
+            # 每批事件合并为一次写出
+            for batch in engine.stream(chat['system'], chat['messages'], chat['project_path'],
+                                       cache_scope=chat['cache_scope'], batch_window=SSE_BATCH_WINDOW):
+                frames = []
+                for event in batch:
+                    if first_token and event['type'] == 'text':
+                        metrics.chat_ttft.observe(time.perf_counter() - started)
+                        first_token = False
+                    if event['type'] == 'done':
+                        save_turn(chat, event['reply'])
+                    frames.append(f"data: {app.json.dumps(event)}\n\n")
+                yield ''.join(frames)
+
+        return streaming_response(generate, ticket, {'Content-Type': 'text/event-stream'})
+    except BaseException:
+        # 响应交出之前出错（例如数据库被锁）时归还名额，否则该项目的名额会一直被占用
+        scheduler.release(ticket)
+        raise
 
 
 @app.route('/api/claude/start', methods=['POST'])
 def start_claude():
-    """启动 Claude CLI 会话（验证 CLI 可用性）"""
-    from claude.cli_discovery import get_claude_cli_path
-
-    cli_path = get_claude_cli_path()
+    """创建 Claude CLI 会话（验证 CLI 可用性），工作进程在第一条消息时启动"""
+    cli_path = claude_pool.cli_path()
     if not cli_path:
         return jsonify({'error': '未找到 Claude CLI'}), 404
 
-    global claude_session_id
-    claude_session_id = str(time.time())
-
     return jsonify({
-        'sessionId': claude_session_id,
+        'sessionId': str(uuid.uuid4()),
         'status': 'ready',
-        'mode': 'print'
+        'mode': 'stream-json'
     })
 
 
 @app.route('/api/claude/chat', methods=['POST'])
 def claude_chat():
-    """发送消息到 Claude CLI（使用 -p 模式）"""
-    from claude.cli_discovery import get_claude_cli_path
-
-    cli_path = get_claude_cli_path()
+    """发送消息到 Claude CLI（由会话对应的长驻工作进程处理）"""
+    cli_path = claude_pool.cli_path()
     if not cli_path:
         return jsonify({'error': '未找到 Claude CLI'}), 404
 
@@ -506,51 +538,121 @@ def claude_chat():
     if not message:
         return jsonify({'error': '消息不能为空'}), 400
 
+    session_id = data.get('sessionId') or 'default'
     working_dir = data.get('workingDir')
 
     try:
-        # 使用 -p 模式进行非交互式对话
-        cmd = [str(cli_path), '-p', message]
-
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=120,
-            cwd=working_dir
-        )
-
-        reply = result.stdout if result.stdout else result.stderr
+        # 按工作目录（即项目）公平排队，没有工作目录时按会话
+        with scheduler.slot(working_dir or session_id, request_priority(data)):
+            result = claude_pool.chat(session_id, message, working_dir)
 
         return jsonify({
-            'reply': reply,
-            'sessionId': claude_session_id
+            'reply': result.get('result', ''),
+            'isError': result.get('is_error', False),
+            'sessionId': session_id
         })
 
-    except subprocess.TimeoutExpired:
+    except SchedulerBusyError as e:
+        return scheduler_busy(e)
+    except PoolBusyError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    except TimeoutError:
         return jsonify({'error': '请求超时'}), 504
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/claude/chat/stream', methods=['POST'])
+def claude_chat_stream():
+    """流式发送消息到 Claude CLI：逐行转发 CLI 输出，结束时推送 exit 事件
+
+    exit 事件的 status 为 success、error、timeout、crashed 或 busy，任何结束方式都以 exit 事件收尾。
+    客户端断开时生成器被关闭，对应的 CLI 进程会被终止。
+    """
+    cli_path = claude_pool.cli_path()
+    if not cli_path:
+        return jsonify({'error': '未找到 Claude CLI'}), 404
+
+    data = request.json
+    message = data.get('message', '')
+
+    if not message:
+        return jsonify({'error': '消息不能为空'}), 400
+
+    session_id = data.get('sessionId') or 'default'
+    working_dir = data.get('workingDir')
+
+    ticket = scheduler.acquire(working_dir or session_id, request_priority(data))
+
+    try:
+        def sse(payload):
+            return f"data: {json.dumps(payload)}\n\n"
+
+        def generate():
+            started = time.monotonic()
+            try:
+                with claude_pool.worker(session_id, working_dir) as worker:
+                    worker.send(message)
+                    for event in worker.events(poll=CLAUDE_STREAM_HEARTBEAT):
+                        if event is None:
+                            # 心跳：向已断开的连接写入会触发生成器关闭
+                            yield ": keep-alive\n\n"
+                            continue
+                        if event.get('type') == 'assistant':
+                            for block in event.get('message', {}).get('content', []):
+                                if block.get('type') == 'text' and block.get('text'):
+                                    yield sse({'type': 'text', 'text': block['text']})
+                                elif block.get('type') == 'tool_use':
+                                    yield sse({'type': 'tool_use', 'name': block.get('name'), 'input': block.get('input')})
+                        elif event.get('type') == 'result':
+                            is_error = event.get('is_error', False)
+                            yield sse({
+                                'type': 'exit',
+                                'status': 'error' if is_error else 'success',
+                                'exitCode': 1 if is_error else 0,
+                                'reply': event.get('result', ''),
+                                'durationMs': int((time.monotonic() - started) * 1000),
+                                'sessionId': session_id
+                            })
+            except PoolBusyError as e:
+                yield sse({'type': 'exit', 'status': 'busy', 'exitCode': None, 'error': str(e)})
+            except TimeoutError:
+                yield sse({'type': 'exit', 'status': 'timeout', 'exitCode': None, 'error': '请求超时'})
+            except WorkerExitedError as e:
+                yield sse({'type': 'exit', 'status': 'crashed', 'exitCode': e.returncode, 'error': str(e)})
+            except Exception as e:
+                yield sse({'type': 'exit', 'status': 'error', 'exitCode': None, 'error': str(e)})
+
+        return streaming_response(generate, ticket, {
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+    except BaseException:
+        scheduler.release(ticket)
+        raise
+
+
 @app.route('/api/claude/stop', methods=['POST'])
 def stop_claude():
-    """停止 Claude CLI 会话（无状态，直接返回）"""
-    return jsonify({'status': 'stopped'})
+    """停止 Claude CLI 会话，关闭其工作进程"""
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('sessionId')
+    closed = claude_pool.close_session(session_id) if session_id else 0
+    return jsonify({'status': 'stopped', 'closedWorkers': closed})
 
 
 @app.route('/api/claude/status', methods=['GET'])
 def claude_status():
     """获取 Claude CLI 状态"""
-    from claude.cli_discovery import get_claude_cli_path
-
-    cli_path = get_claude_cli_path()
+    cli_path = claude_pool.cli_path()
     if cli_path:
         return jsonify({
             'status': 'ready',
-            'mode': 'print',
-            'sessionId': claude_session_id,
-            'cliPath': str(cli_path)
+            'mode': 'stream-json',
+            'sessionId': request.args.get('sessionId'),
+            'cliPath': str(cli_path),
+            'pool': claude_pool.stats()
         })
     else:
         return jsonify({
@@ -561,4 +663,5 @@ def claude_status():
 
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
+    # 开发服务器（单进程）；生产环境使用 gunicorn -c gunicorn.conf.py wsgi:app
+    app.run(debug=SERVER_DEBUG, port=SERVER_PORT, threaded=True)
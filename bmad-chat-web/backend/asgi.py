@@ -0,0 +1,184 @@
+"""ASGI 入口：聊天接口在事件循环中处理，其余接口交给 Flask 应用
+
+    gunicorn -c gunicorn.conf.py          （默认 BMAD_SERVER_MODE=asgi，使用 uvicorn 工作进程）
+    uvicorn asgi:app --port 5001
+
+WSGI 下每个进行中的对话在 ChatEngine.stream() 中占用一个请求线程，同时进行的对话数受线程数限制；
+这里的 /api/chat 与 /api/chat/stream 用 ChatEngine.astream() 在事件循环中等待模型与工具，
+进行中的对话不占用线程，同时进行的对话数只受调度器上限约束。
+排队（scheduler.acquire）与准备上下文（读数据库、组装历史）是阻塞操作，在线程中执行，完成后即归还线程。
+其余接口经 a2wsgi 在 SERVER_THREADS 个线程中运行 Flask 应用。
+"""
+import asyncio
+import time
+from a2wsgi import WSGIMiddleware
+import metrics
+from metrics import start_trace, server_timing
+from app import app as flask_app, prepare_chat, save_turn
+from chat_engine import engine
+from scheduler import scheduler, SchedulerBusyError
+from config import SERVER_THREADS, SSE_BATCH_WINDOW, TRACE_SLOW_MS
+
+wsgi = WSGIMiddleware(flask_app, workers=SERVER_THREADS)
+# 与 Flask 应用的 CORS(app) 一致
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_response(send, status, body, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), *CORS_HEADERS, *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def error_body(message):
+    return flask_app.json.dumps({'error': message}).encode('utf-8')
+
+
+def prepare(data):
+    """在线程中调用 app.prepare_chat，出错时返回 (None, (状态码, 响应体))"""
+    with flask_app.app_context():
+        chat, error = prepare_chat(data)
+        if error:
+            response, status = error
+            return None, (status, response.get_data())
+        return chat, None
+
+
+class ChatRequest:
+    """单个聊天请求：排队、准备上下文、按调度名额运行对话，结束（含客户端断开）时归还名额"""
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.started = time.perf_counter()
+        self.trace = start_trace()
+        self.status = 500
+
+    async def __call__(self, streaming):
+        try:
+            await self.handle(streaming)
+        finally:
+            elapsed = time.perf_counter() - self.started
+            endpoint = self.scope['path']
+            metrics.http_requests.inc(method='POST', endpoint=endpoint, status=self.status)
+            metrics.http_duration.observe(elapsed, method='POST', endpoint=endpoint)
+            if TRACE_SLOW_MS and elapsed * 1000 >= TRACE_SLOW_MS:
+                print(f"Slow request POST {endpoint} {elapsed * 1000:.0f}ms: {server_timing(self.trace) or '-'}")
+
+    async def respond(self, status, body, headers=()):
+        self.status = status
+        await send_response(self.send, status, body, headers)
+
+    async def handle(self, streaming):
+        body = await read_body(self.receive)
+        if body is None:
+            return
+        try:
+            data = flask_app.json.loads(body) if body else None
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return await self.respond(400, error_body('请求体不是有效的 JSON'))
+
+        headers = dict(self.scope['headers'])
+        priority = data.get('priority') or headers.get(b'x-bmad-priority', b'').decode('latin1') or 'interactive'
+        try:
+            ticket = await asyncio.to_thread(scheduler.acquire, data.get('projectId'), priority)
+        except SchedulerBusyError as e:
+            return await self.respond(503, error_body(str(e)),
+                                      [(b'retry-after', str(e.retry_after).encode('ascii'))])
+        try:
+            chat, error = await asyncio.to_thread(prepare, data)
+            if error:
+                return await self.respond(*error)
+            if streaming:
+                await self.stream(chat)
+            else:
+                await self.reply(chat)
+        finally:
+            scheduler.release(ticket)
+
+    async def reply(self, chat):
+        async for event in engine.astream(chat['system'], chat['messages'], chat['project_path'],
+                                          cache_scope=chat['cache_scope']):
+            if event['type'] == 'error':
+                headers = [(b'retry-after', str(event['retryAfter']).encode('ascii'))] if event['retryAfter'] else []
+                return await self.respond(event['status'], error_body(event['error']), headers)
+            if event['type'] == 'done':
+                save_turn(chat, event['reply'])
+                return await self.respond(200, flask_app.json.dumps({
+                    'reply': event['reply'],
+                    'usage': event['usage']
+                }).encode('utf-8'))
+        await self.respond(500, error_body('对话意外中断'))
+
+    async def stream(self, chat):
+        """推送 SSE 事件；客户端断开时取消进行中的对话"""
+        headers = [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), *CORS_HEADERS]
+        timing = server_timing(self.trace)
+        if timing:
+            headers.append((b'server-timing', timing.encode('latin1')))
+        self.status = 200
+        await self.send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+        async def generate():
+            first_token = True
+            # 每批事件合并为一次写出
+            async for batch in engine.astream(chat['system'], chat['messages'], chat['project_path'],
+                                              cache_scope=chat['cache_scope'], batch_window=SSE_BATCH_WINDOW):
+                frames = []
+                for event in batch:
+                    if first_token and event['type'] == 'text':
+                        metrics.chat_ttft.observe(time.perf_counter() - self.started)
+                        first_token = False
+                    if event['type'] == 'done':
+                        save_turn(chat, event['reply'])
+                    frames.append(f"data: {flask_app.json.dumps(event)}\n\n")
+                await self.send({'type': 'http.response.body', 'body': ''.join(frames).encode('utf-8'),
+                                 'more_body': True})
+            await self.send({'type': 'http.response.body', 'body': b''})
+
+        async def disconnected():
+            while (await self.receive())['type'] != 'http.disconnect':
+                pass
+
+        generating = asyncio.ensure_future(generate())
+        watching = asyncio.ensure_future(disconnected())
+        try:
+            await asyncio.wait({generating, watching}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # 取消后等待结束，astream() 随之取消上游的对话
+            watching.cancel()
+            generating.cancel()
+            await asyncio.gather(generating, watching, return_exceptions=True)
+        if not generating.cancelled():
+            generating.result()
+
+
+CHAT_PATHS = {'/api/chat': False, '/api/chat/stream': True}
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] in CHAT_PATHS:
+        return await ChatRequest(scope, receive, send)(CHAT_PATHS[scope['path']])
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    await wsgi(scope, receive, send)
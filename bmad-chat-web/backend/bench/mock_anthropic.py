@@ -0,0 +1,159 @@
+"""本地模拟的 Anthropic Messages API，供基准测试使用
+
+    python bench/mock_anthropic.py --port 8900 --latency 0.2 --token-delay 0.01
+
+支持流式（SSE）与非流式回复。用户消息中包含 [read:路径] 或 [list:路径] 且请求带有 tools 时，
+第一轮回复对应的 read_file / list_directory 工具调用，工具结果返回后再给出文本回复。
+"""
+import argparse
+import json
+import random
+import re
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+TOOL_RE = re.compile(r'\[(read|list):([^\]]+)\]')
+
+WORDS = ('story epic backlog sprint review checklist acceptance criteria architecture '
+         'prd persona workflow template task dependency risk milestone').split()
+
+
+def last_user_text(messages):
+    """最后一条用户消息为纯文本时返回文本；为工具结果时返回 None"""
+    content = messages[-1].get('content') if messages else ''
+    if isinstance(content, str):
+        return content
+    if any(block.get('type') == 'tool_result' for block in content):
+        return None
+    return "".join(block.get('text', '') for block in content if block.get('type') == 'text')
+
+
+def build_content(body, reply_words):
+    text = last_user_text(body.get('messages', []))
+    if body.get('tools') and text:
+        calls = TOOL_RE.findall(text)
+        if calls:
+            content = [{'type': 'text', 'text': '先查看一下相关文件。'}]
+            for i, (kind, path) in enumerate(calls):
+                if kind == 'read':
+                    name, tool_input = 'read_file', {'file_path': path}
+                else:
+                    name, tool_input = 'list_directory', {'directory_path': path}
+                content.append({'type': 'tool_use', 'id': f'toolu_{i}_{random.getrandbits(32):08x}',
+                                'name': name, 'input': tool_input})
+            return content
+    return [{'type': 'text', 'text': " ".join(random.choice(WORDS) for _ in range(reply_words))}]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    options = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.startswith('/v1/messages'):
+            self.send_json(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': self.path}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        options = self.options
+
+        time.sleep(options.latency)
+        if options.error_rate and random.random() < options.error_rate:
+            self.send_json(529, {'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'Overloaded'}},
+                           {'Retry-After': '0'})
+            return
+
+        content = build_content(body, options.reply_words)
+        has_tools = any(block['type'] == 'tool_use' for block in content)
+        output_tokens = sum(len(block.get('text', '')) // 4 + 1 for block in content)
+        message = {
+            'id': f'msg_{random.getrandbits(48):012x}',
+            'type': 'message',
+            'role': 'assistant',
+            'model': body.get('model', 'mock'),
+            'content': content,
+            'stop_reason': 'tool_use' if has_tools else 'end_turn',
+            'stop_sequence': None,
+            'usage': {'input_tokens': len(json.dumps(body)) // 4, 'output_tokens': output_tokens}
+        }
+        if body.get('stream'):
+            self.send_stream(message)
+        else:
+            self.send_json(200, message)
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, name, payload):
+        chunk = f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode('utf-8')
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.wfile.flush()
+
+    def send_stream(self, message):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        start = dict(message, content=[], stop_reason=None, usage=dict(message['usage'], output_tokens=0))
+        self.send_event('message_start', {'type': 'message_start', 'message': start})
+        for index, block in enumerate(message['content']):
+            if block['type'] == 'text':
+                self.send_event('content_block_start', {
+                    'type': 'content_block_start', 'index': index, 'content_block': {'type': 'text', 'text': ''}})
+                for word in block['text'].split(' '):
+                    time.sleep(self.options.token_delay)
+                    self.send_event('content_block_delta', {
+                        'type': 'content_block_delta', 'index': index,
+                        'delta': {'type': 'text_delta', 'text': word + ' '}})
+            else:
+                self.send_event('content_block_start', {
+                    'type': 'content_block_start', 'index': index,
+                    'content_block': {'type': 'tool_use', 'id': block['id'], 'name': block['name'], 'input': {}}})
+                self.send_event('content_block_delta', {
+                    'type': 'content_block_delta', 'index': index,
+                    'delta': {'type': 'input_json_delta', 'partial_json': json.dumps(block['input'])}})
+            self.send_event('content_block_stop', {'type': 'content_block_stop', 'index': index})
+        self.send_event('message_delta', {
+            'type': 'message_delta',
+            'delta': {'stop_reason': message['stop_reason'], 'stop_sequence': None},
+            'usage': {'output_tokens': message['usage']['output_tokens']}})
+        self.send_event('message_stop', {'type': 'message_stop'})
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='模拟的 Anthropic Messages API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.2, help='每个请求返回前的延迟（秒）')
+    parser.add_argument('--token-delay', type=float, default=0.005, help='流式输出时每个词之间的延迟（秒）')
+    parser.add_argument('--reply-words', type=int, default=60, help='文本回复的词数')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 529 过载错误的比例')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    MockHandler.options = options
+    server = ThreadingHTTPServer((options.host, options.port), MockHandler)
+    server.daemon_threads = True
+    print(f"Mock Anthropic API listening on http://{options.host}:{options.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+"""端到端基准测试
+
+    python bench/run.py --concurrency 8 --requests 200 --files 500 --turns 100
+
+在临时目录中生成角色、项目文件与对话历史，启动本地模拟的模型服务（bench/mock_anthropic.py）
+和 Flask 应用，按指定并发压测各个接口，输出延迟分位数（p50/p95/p99）、吞吐量，
+以及每个接口单请求的内存分配情况（tracemalloc，串行执行）。
+结果可用 --json 保存，便于对比两次运行。
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ENDPOINTS = ['chat', 'chat_stream', 'files', 'read', 'agents']
+
+AGENT_TEMPLATE = """# {id}
+
+```yaml
+agent:
+  id: {id}
+  name: Bench {index}
+  title: Benchmark Agent {index}
+  icon: 🧪
+  whenToUse: 基准测试
+persona:
+  role: 测试角色
+  style: 简洁
+  identity: 用于基准测试的角色
+  focus: 性能
+  core_principles:
+{principles}
+commands:
+  - help: 显示帮助
+  - review: 审查文档
+  - exit: 退出
+```
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"port {port} did not open")
+
+
+def make_fixtures(root, options):
+    """生成角色文件与项目文件，返回 (agents_path, [项目目录], [文件路径])"""
+    agents_path = os.path.join(root, 'agents')
+    os.makedirs(agents_path)
+    for i in range(options.agents):
+        principles = "\n".join(f"    - 原则 {i}-{n}：保持文档与代码一致" for n in range(8))
+        with open(os.path.join(agents_path, f'bench{i}.md'), 'w', encoding='utf-8') as f:
+            f.write(AGENT_TEMPLATE.format(id=f'bench{i}', index=i, principles=principles))
+
+    project_dirs, files = [], []
+    for p in range(options.projects):
+        project_dir = os.path.join(root, 'projects', f'project{p}')
+        for n in range(options.files):
+            # 每个目录 20 个文件，目录嵌套两层
+            sub = os.path.join(project_dir, f'docs{n // 200}', f'part{n // 20 % 10}')
+            os.makedirs(sub, exist_ok=True)
+            path = os.path.join(sub, f'doc{n}.md')
+            with open(path, 'w', encoding='utf-8') as f:
+                for line in range(options.file_lines):
+                    f.write(f"{line}: 用户故事 {n} 的验收标准与实现说明，story {n} acceptance criteria\n")
+            files.append(path)
+        project_dirs.append(project_dir)
+    return agents_path, project_dirs, files
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Bench:
+    def __init__(self, options, port, project_ids, files):
+        self.options = options
+        self.port = port
+        self.project_ids = project_ids
+        self.files = files
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def next_index(self):
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def build_request(self, endpoint):
+        """返回 (method, url, body)"""
+        i = self.next_index()
+        project_id = random.choice(self.project_ids)
+        if endpoint in ('chat', 'chat_stream'):
+            message = f"基准测试消息 {i}：请审查当前的用户故事"
+            if random.random() < self.options.tool_ratio:
+                message += f" [read:{random.choice(self.files)}]"
+            body = {'projectId': project_id, 'agentId': f'bench{i % self.options.agents}', 'message': message}
+            url = '/api/chat' if endpoint == 'chat' else '/api/chat/stream'
+            return 'POST', url, body
+        if endpoint == 'files':
+            return 'GET', f'/api/projects/{project_id}/files?recursive=true', None
+        if endpoint == 'read':
+            return 'GET', '/api/files/read?' + urlencode({'path': random.choice(self.files)}), None
+        if endpoint == 'agents':
+            return 'GET', '/api/agents', None
+        raise ValueError(endpoint)
+
+    def http_request(self, endpoint):
+        """通过 HTTP 发送一个请求，返回 (耗时, 状态码, 首字节耗时)"""
+        method, url, body = self.build_request(endpoint)
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data else {}
+        start = time.perf_counter()
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.options.timeout)
+        try:
+            conn.request(method, url, body=data, headers=headers)
+            response = conn.getresponse()
+            first = response.read(1)
+            first_byte = time.perf_counter() - start
+            if first:
+                response.read()
+            return time.perf_counter() - start, response.status, first_byte
+        except (OSError, http.client.HTTPException):
+            return time.perf_counter() - start, 0, None
+        finally:
+            conn.close()
+
+    def load(self, endpoint):
+        """按并发压测一个接口"""
+        for _ in range(min(self.options.warmup, self.options.requests)):
+            self.http_request(endpoint)
+
+        results = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.options.concurrency) as pool:
+            for result in pool.map(lambda _: self.http_request(endpoint), range(self.options.requests)):
+                results.append(result)
+        elapsed = time.perf_counter() - start
+
+        ok = sorted(r[0] for r in results if 200 <= r[1] < 400)
+        first_bytes = sorted(r[2] for r in results if 200 <= r[1] < 400 and r[2] is not None)
+        return {
+            'requests': len(results),
+            'errors': len(results) - len(ok),
+            'throughput': len(ok) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(ok, 50) * 1000,
+            'p95_ms': percentile(ok, 95) * 1000,
+            'p99_ms': percentile(ok, 99) * 1000,
+            'ttfb_p50_ms': percentile(first_bytes, 50) * 1000,
+        }
+
+    def allocations(self, client, endpoint):
+        """串行执行请求并用 tracemalloc 统计每个请求的内存分配"""
+        count = self.options.alloc_requests
+        if not count:
+            return {}
+        for _ in range(min(2, count)):
+            self.test_request(client, endpoint)
+
+        tracemalloc.start(1)
+        try:
+            before = tracemalloc.take_snapshot()
+            blocks_before = sys.getallocatedblocks()
+            peaks = []
+            for _ in range(count):
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                self.test_request(client, endpoint)
+                peaks.append(tracemalloc.get_traced_memory()[1] - base)
+            blocks_after = sys.getallocatedblocks()
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+
+        backend_filter = tracemalloc.Filter(True, os.path.join(BACKEND_DIR, '*'))
+        bench_filter = tracemalloc.Filter(False, os.path.join(BENCH_DIR, '*'))
+        diff = after.filter_traces([backend_filter, bench_filter]).compare_to(
+            before.filter_traces([backend_filter, bench_filter]), 'lineno')
+        top = [
+            {
+                'site': f"{os.path.relpath(stat.traceback[0].filename, BACKEND_DIR)}:{stat.traceback[0].lineno}",
+                'count': stat.count_diff,
+                'kib': round(stat.size_diff / 1024, 1),
+            }
+            for stat in sorted(diff, key=lambda s: abs(s.count_diff), reverse=True)[:self.options.alloc_top]
+            if stat.count_diff
+        ]
+        return {
+            'alloc_peak_kib': sum(peaks) / len(peaks) / 1024,
+            'alloc_blocks': (blocks_after - blocks_before) / count,
+            'alloc_top': top,
+        }
+
+    def test_request(self, client, endpoint):
+        method, url, body = self.build_request(endpoint)
+        if method == 'POST':
+            response = client.post(url, json=body)
+        else:
+            response = client.get(url)
+        response.get_data()
+        response.close()
+
+
+def print_report(results):
+    header = f"{'endpoint':<12}{'reqs':>6}{'errs':>6}{'req/s':>9}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}" \
+             f"{'ttfb50':>9}{'peakKiB':>10}{'blocks':>9}"
+    print(header)
+    print('-' * len(header))
+    for endpoint, r in results.items():
+        print(f"{endpoint:<12}{r['requests']:>6}{r['errors']:>6}{r['throughput']:>9.1f}{r['p50_ms']:>9.1f}"
+              f"{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['ttfb_p50_ms']:>9.1f}"
+              f"{r.get('alloc_peak_kib', 0):>10.1f}{r.get('alloc_blocks', 0):>9.1f}")
+    for endpoint, r in results.items():
+        if r.get('alloc_top'):
+            print(f"\n{endpoint}: 保留的分配（按块数）")
+            for item in r['alloc_top']:
+                print(f"  {item['count']:>+8} blocks {item['kib']:>+10.1f} KiB  {item['site']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='BMad Chat 后端基准测试')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help=f"逗号分隔，可选 {','.join(ENDPOINTS)}")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100, help='每个接口的请求数')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--projects', type=int, default=2)
+    parser.add_argument('--files', type=int, default=200, help='每个项目的文件数')
+    parser.add_argument('--file-lines', type=int, default=50)
+    parser.add_argument('--turns', type=int, default=50, help='每个项目预置的对话轮数')
+    parser.add_argument('--agents', type=int, default=4)
+    parser.add_argument('--tool-ratio', type=float, default=0.3, help='聊天请求中触发 read_file 工具调用的比例')
+    parser.add_argument('--latency', type=float, default=0.2, help='模拟模型每次请求的延迟（秒）')
+    parser.add_argument('--token-delay', type=float, default=0.005, help='模拟流式输出每个词的间隔（秒）')
+    parser.add_argument('--reply-words', type=int, default=60)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟模型返回 529 的比例')
+    parser.add_argument('--alloc-requests', type=int, default=20, help='内存分配统计的串行请求数（0 为跳过）')
+    parser.add_argument('--alloc-top', type=int, default=5)
+    parser.add_argument('--keep', action='store_true', help='保留临时目录')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='把结果写入 JSON 文件')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    endpoints = [e.strip() for e in options.endpoints.split(',') if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        sys.exit(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    random.seed(options.seed)
+
+    root = tempfile.mkdtemp(prefix='bmad-bench-')
+    mock = None
+    server = None
+    try:
+        agents_path, project_dirs, files = make_fixtures(root, options)
+        mock_port = free_port()
+        mock = subprocess.Popen([
+            sys.executable, os.path.join(BENCH_DIR, 'mock_anthropic.py'),
+            '--port', str(mock_port),
+            '--latency', str(options.latency),
+            '--token-delay', str(options.token_delay),
+            '--reply-words', str(options.reply_words),
+            '--error-rate', str(options.error_rate),
+        ], stdout=subprocess.DEVNULL)
+        wait_for_port(mock_port)
+
+        # 配置在导入时读取，必须在导入应用之前设置
+        os.environ.update({
+            'BMAD_DATA_DIR': os.path.join(root, 'data'),
+            'BMAD_AGENTS_PATH': agents_path,
+            'ANTHROPIC_BASE_URL': f'http://127.0.0.1:{mock_port}',
+            'ANTHROPIC_API_KEY': 'bench',
+        })
+        sys.path.insert(0, BACKEND_DIR)
+        from werkzeug.serving import make_server
+        from app import app
+        from store import store
+
+        project_ids = []
+        for i, project_dir in enumerate(project_dirs):
+            project = store.create_project(f'bench{i}', project_dir)
+            for turn in range(options.turns):
+                store.add_conversation(project['id'], {'role': 'user', 'content': f"第 {turn} 轮的问题：请检查文档"})
+                store.add_conversation(project['id'], {'role': 'assistant', 'content': "回复内容 " * 40})
+            project_ids.append(project['id'])
+
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        bench = Bench(options, server.server_port, project_ids, files)
+
+        print(f"projects={options.projects} files={options.files} turns={options.turns} "
+              f"concurrency={options.concurrency} requests={options.requests} latency={options.latency}s\n")
+        results = {}
+        client = app.test_client()
+        for endpoint in endpoints:
+            results[endpoint] = bench.load(endpoint)
+            results[endpoint].update(bench.allocations(client, endpoint))
+
+        print_report(results)
+        if options.json:
+            with open(options.json, 'w', encoding='utf-8') as f:
+                json.dump({'options': vars(options), 'results': results}, f, ensure_ascii=False, indent=2)
+    finally:
+        if server is not None:
+            server.shutdown()
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+        if options.keep:
+            print(f"\nfixtures kept in {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
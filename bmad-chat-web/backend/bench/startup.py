@@ -0,0 +1,127 @@
+"""冷启动基准测试
+
+    python bench/startup.py --runs 10 --agents 10 --target-ms 400
+
+每次在新的 Python 进程中导入应用并处理第一个请求（GET /api/agents），分别记录
+解释器启动、import app、第一个请求的耗时，输出多次运行的中位数与最大值。
+默认分别测量有/无预编译角色包（python -m agents.bundle）两种情况；
+有角色包时“导入 + 第一个请求”的中位数超过 --target-ms 则以非零状态退出，可用于 CI。
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run import AGENT_TEMPLATE  # noqa: E402
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+response = app.test_client().get('/api/agents')
+assert response.status_code == 200, response.status_code
+done = time.perf_counter()
+print(json.dumps({'import': imported - started, 'firstRequest': done - imported,
+                  'agents': len(response.get_json()), 'yaml': 'yaml' in sys.modules,
+                  'anthropic': 'anthropic' in sys.modules}))
+"""
+
+
+def make_agents(root, count):
+    agents_path = os.path.join(root, 'agents')
+    os.makedirs(agents_path)
+    for i in range(count):
+        principles = "\n".join(f"    - 原则 {i}-{n}：保持文档与代码一致" for n in range(8))
+        with open(os.path.join(agents_path, f'bench{i}.md'), 'w', encoding='utf-8') as f:
+            f.write(AGENT_TEMPLATE.format(id=f'bench{i}', index=i, principles=principles))
+    return agents_path
+
+
+def measure(env, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', CHILD], cwd=BACKEND_DIR, env=env,
+                                check=True, capture_output=True, text=True).stdout
+        total = time.perf_counter() - started
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample['process'] = total
+        samples.append(sample)
+    return samples
+
+
+def summarize(samples):
+    result = {}
+    for field in ('process', 'import', 'firstRequest'):
+        values = [sample[field] * 1000 for sample in samples]
+        result[field] = {'median': statistics.median(values), 'max': max(values)}
+    values = [(sample['import'] + sample['firstRequest']) * 1000 for sample in samples]
+    result['ready'] = {'median': statistics.median(values), 'max': max(values)}
+    result['yamlImported'] = any(sample['yaml'] for sample in samples)
+    result['anthropicImported'] = any(sample['anthropic'] for sample in samples)
+    return result
+
+
+def print_report(name, result):
+    print(f"{name}")
+    for field, label in (('process', '进程总耗时'), ('import', 'import app'),
+                         ('firstRequest', '第一个请求'), ('ready', '导入 + 第一个请求')):
+        print(f"  {label:<12} median={result[field]['median']:8.1f}ms  max={result[field]['max']:8.1f}ms")
+    print(f"  yaml={'已导入' if result['yamlImported'] else '未导入'}  "
+          f"anthropic={'已导入' if result['anthropicImported'] else '未导入'}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='BMad Chat 后端冷启动基准测试')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--agents', type=int, default=10)
+    parser.add_argument('--target-ms', type=float, default=400, help='有角色包时“导入 + 第一个请求”的中位数上限')
+    parser.add_argument('--agents-path', help='使用已有的角色目录（默认生成临时角色文件）')
+    parser.add_argument('--skip-unbundled', action='store_true', help='只测量有角色包的情况')
+    parser.add_argument('--json', help='把结果写入 JSON 文件')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    root = tempfile.mkdtemp(prefix='bmad-startup-')
+    try:
+        agents_path = options.agents_path or make_agents(root, options.agents)
+        env = dict(os.environ, BMAD_AGENTS_PATH=agents_path, BMAD_AGENTS_WATCH='0')
+        bundle_file = os.path.join(root, 'agents.bundle.json')
+
+        results = {}
+        if not options.skip_unbundled:
+            env_plain = dict(env, BMAD_DATA_DIR=os.path.join(root, 'data-plain'),
+                             BMAD_AGENTS_BUNDLE_FILE=os.path.join(root, 'missing.bundle.json'))
+            results['unbundled'] = summarize(measure(env_plain, options.runs))
+            print_report('无角色包', results['unbundled'])
+
+        env_bundle = dict(env, BMAD_DATA_DIR=os.path.join(root, 'data-bundle'), BMAD_AGENTS_BUNDLE_FILE=bundle_file)
+        subprocess.run([sys.executable, '-m', 'agents.bundle', '-o', bundle_file], cwd=BACKEND_DIR,
+                       env=env_bundle, check=True, stdout=subprocess.DEVNULL)
+        results['bundled'] = summarize(measure(env_bundle, options.runs))
+        print_report('有角色包', results['bundled'])
+
+        if options.json:
+            with open(options.json, 'w', encoding='utf-8') as f:
+                json.dump({'options': vars(options), 'results': results}, f, ensure_ascii=False, indent=2)
+
+        ready = results['bundled']['ready']['median']
+        if ready > options.target_ms:
+            sys.exit(f"\n启动耗时 {ready:.1f}ms 超过目标 {options.target_ms:.0f}ms")
+        print(f"\n启动耗时 {ready:.1f}ms，目标 {options.target_ms:.0f}ms 以内")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+import asyncio
+import json
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import MODEL_NAME, MAX_TOKENS, MAX_TOOL_ITERATIONS, TOOL_MAX_WORKERS, TOOL_TIMEOUT
+from tools import TOOLS, WRITE_TOOLS
+from tool_cache import tool_cache
+from upstream import upstream, error_status
+from response_cache import response_cache
+from metrics import (
+    span, current_trace, use_trace, upstream_tokens, tool_iterations, tool_calls, response_cache_lookups
+)
+
+
+class ChatEngine:
+    """异步工具调用对话引擎
+
+    所有对话的模型请求都在上游客户端的后台事件循环中进行，不另占线程。
+    调用方有两种方式取事件：stream() 在 WSGI 请求线程中同步等待（每个进行中的对话占用一个请求线程，
+    同时进行的对话数最多为工作进程数 × SERVER_THREADS）；astream() 供 ASGI 接口（asgi.py）使用，
+    等待期间不占用线程，同时进行的对话数只受调度器与上游并发上限约束。
+    同一轮返回的工具调用按顺序执行：连续的只读调用在有界线程池中并发执行，写入调用作为屏障单独执行，
+    每个工具从开始执行时单独计算超时；
+    只读工具的结果按项目缓存，本轮已在上下文中的相同文件内容以引用代替（见 tool_cache.TurnTools）。
+    传入 cache_scope（角色 id 与版本）且开启回复缓存时，每次模型调用先查缓存。
+    run() 逐个产出事件：
+      {'type': 'text', 'text': ...}                          文本增量
+      {'type': 'tool_use', 'id', 'name', 'input'}            模型发起工具调用
+      {'type': 'tool_result', 'id', 'name', 'result'}        工具执行结果
+      {'type': 'done', 'reply', 'usage', 'iterations'}       本轮结束
+      {'type': 'error', 'error', 'status', 'retryAfter'}     出错（仅 stream() 产出）
+    """
+
+    def __init__(self):
+        self._tool_pool = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix='chat-tool')
+
+    async def run(self, system, messages, project_path=None, tools=TOOLS, cache_scope=None):
+        """执行一轮对话（含最多 MAX_TOOL_ITERATIONS 次工具调用）"""
+        usage = {'input_tokens': 0, 'output_tokens': 0}
+        use_cache = response_cache.enabled and cache_scope is not None
+        if use_cache:
+            usage.update({'response_cache_hits': 0, 'response_cache_misses': 0})
+        reply = ""
+        iterations = 0
+        turn_tools = tool_cache.turn(project_path)
+
+        for iteration in range(MAX_TOOL_ITERATIONS):
+            iterations = iteration + 1
+            params = {
+                'model': MODEL_NAME,
+                'max_tokens': MAX_TOKENS,
+                'system': system,
+                'messages': messages,
+            }
+            if tools:
+                params['tools'] = tools
+
+            cache_key = response_cache.key(cache_scope, params) if use_cache else None
+            response = response_cache.get(cache_key) if cache_key else None
+            if response is not None:
+                usage['response_cache_hits'] += 1
+                response_cache_lookups.inc(result='hit')
+                text = "".join(block.text for block in response.content if block.type == 'text')
+                if text:
+                    yield {'type': 'text', 'text': text}
+            else:
+                if cache_key:
+                    usage['response_cache_misses'] += 1
+                    response_cache_lookups.inc(result='miss')
+                with span('model_request'):
+                    async with upstream.stream(**params) as stream:
+                        async for event in stream:
+                            if event.type == 'text' and event.text:
+                                yield {'type': 'text', 'text': event.text}
+                        response = await stream.get_final_message()
+
+                usage['input_tokens'] += response.usage.input_tokens
+                usage['output_tokens'] += response.usage.output_tokens
+                upstream_tokens.inc(response.usage.input_tokens, type='input')
+                upstream_tokens.inc(response.usage.output_tokens, type='output')
+
+                # 要写文件的回复不缓存
+                if cache_key and not any(block.type == 'tool_use' and block.name in WRITE_TOOLS
+                                         for block in response.content):
+                    response_cache.put(cache_key, response)
+
+            tool_uses = [block for block in response.content if block.type == 'tool_use']
+            reply = "".join(block.text for block in response.content if block.type == 'text')
+
+            # 本轮有工具写入文件后，之后的迭代不再读写缓存
+            if any(tool_use.name in WRITE_TOOLS for tool_use in tool_uses):
+                use_cache = False
+
+            # 如果没有工具调用，本轮结束
+            if not tool_uses:
+                break
+
+            for tool_use in tool_uses:
+                yield {'type': 'tool_use', 'id': tool_use.id, 'name': tool_use.name, 'input': tool_use.input}
+
+            # 按调用顺序分段执行：连续的只读工具并发执行、按完成顺序推送结果；
+            # 写入工具是屏障，等之前的调用全部完成后单独执行，之后的调用再开始，读写按模型给出的顺序生效
+            results = {}
+            for group in self._tool_groups(tool_uses):
+                tasks = [asyncio.ensure_future(self._run_tool(turn_tools, tool_use, project_path))
+                         for tool_use in group]
+                for next_done in asyncio.as_completed(tasks):
+                    tool_use, result = await next_done
+                    if tool_use.name not in WRITE_TOOLS:
+                        result = turn_tools.dedupe(tool_use.id, result)
+                    results[tool_use.id] = result
+                    yield {'type': 'tool_result', 'id': tool_use.id, 'name': tool_use.name, 'result': result}
+
+            # 整个回复作为一条助手消息，全部工具结果作为一条用户消息
+            messages.append({
+                'role': 'assistant',
+                'content': [block.model_dump(exclude_none=True) for block in response.content]
+            })
+            messages.append({
+                'role': 'user',
+                'content': [
+                    {
+                        'type': 'tool_result',
+                        'tool_use_id': tool_use.id,
+                        'content': json.dumps(results[tool_use.id])
+                    }
+                    for tool_use in tool_uses
+                ]
+            })
+
+            # 继续循环，让 AI 根据工具结果生成回复
+
+        tool_iterations.observe(iterations)
+        yield {'type': 'done', 'reply': reply, 'usage': usage, 'iterations': iterations}
+
+    @staticmethod
+    def _tool_groups(tool_uses):
+        """把工具调用按顺序分组：连续的只读调用为一组，每个写入调用单独一组"""
+        groups = []
+        for tool_use in tool_uses:
+            if tool_use.name in WRITE_TOOLS or not groups or groups[-1][-1].name in WRITE_TOOLS:
+                groups.append([tool_use])
+            else:
+                groups[-1].append(tool_use)
+        return groups
+
+    async def _run_tool(self, turn_tools, tool_use, project_path):
+        """在线程池中执行单个工具，超时返回错误结果
+
+        超时从工具在线程中开始执行时计算，不含在线程池中排队的时间；排队也最多等待 TOOL_TIMEOUT 秒，
+        届时仍未开始的调用被取消。超时的线程无法中止，会在后台自行结束。
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.create_future()
+
+        def execute():
+            loop.call_soon_threadsafe(lambda: started.done() or started.set_result(None))
+            return turn_tools.execute(tool_use.name, tool_use.input, project_path)
+
+        status = 'ok'
+        with span('execute_tool'):
+            task = loop.run_in_executor(self._tool_pool, execute)
+            await asyncio.wait({started, task}, timeout=TOOL_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+            if not started.done() and not task.done():
+                task.cancel()
+                result = {'error': f'工具排队超时（{TOOL_TIMEOUT:g} 秒）'}
+                status = 'timeout'
+            else:
+                try:
+                    result = await asyncio.wait_for(task, TOOL_TIMEOUT)
+                    if isinstance(result, dict) and 'error' in result:
+                        status = 'error'
+                except asyncio.TimeoutError:
+                    result = {'error': f'工具执行超时（{TOOL_TIMEOUT:g} 秒）'}
+                    status = 'timeout'
+        tool_calls.inc(tool=tool_use.name, status=status)
+        return tool_use, result
+
+    def _pump(self, emit, system, messages, project_path, tools, cache_scope):
+        """在上游事件循环中运行 run()，逐个 emit(event)，结束时 emit(None)"""
+        trace = current_trace()
+
+        async def pump():
+            use_trace(trace)
+            try:
+                async for event in self.run(system, messages, project_path, tools, cache_scope):
+                    emit(event)
+            except Exception as e:
+                status, retry_after = error_status(e)
+                emit({'type': 'error', 'error': str(e), 'status': status, 'retryAfter': retry_after})
+            finally:
+                emit(None)
+
+        return asyncio.run_coroutine_threadsafe(pump(), upstream.loop())
+
+    @staticmethod
+    def _merge(batch, event):
+        if event['type'] == 'text' and batch[-1]['type'] == 'text':
+            batch[-1] = {'type': 'text', 'text': batch[-1]['text'] + event['text']}
+        else:
+            batch.append(event)
+
+    def stream(self, system, messages, project_path=None, tools=TOOLS, cache_scope=None, batch_window=None):
+        """在请求线程中同步迭代 run() 的事件（阻塞该线程直到本轮结束）；迭代器关闭时取消进行中的对话
+
+        WSGI 接口使用；ASGI 接口用 astream()，等待期间不占用线程。
+        batch_window 不为 None 时逐批产出事件列表：除第一批外，取到事件后最多再等 batch_window 秒
+        收集随后到达的事件，连续的文本增量合并为一个事件。
+        """
+        events = queue.Queue()
+        future = self._pump(events.put, system, messages, project_path, tools, cache_scope)
+        try:
+            first = True
+            while True:
+                event = events.get()
+                if event is None:
+                    return
+                if batch_window is None:
+                    yield event
+                    continue
+
+                batch = [event]
+                finished = False
+                deadline = time.monotonic() + (0 if first else batch_window)
+                first = False
+                while True:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        event = events.get(timeout=remaining) if remaining > 0 else events.get_nowait()
+                    except queue.Empty:
+                        break
+                    if event is None:
+                        finished = True
+                        break
+                    self._merge(batch, event)
+                yield batch
+                if finished:
+                    return
+        finally:
+            future.cancel()
+
+    async def astream(self, system, messages, project_path=None, tools=TOOLS, cache_scope=None, batch_window=None):
+        """与 stream() 相同，但在调用方的事件循环中异步迭代：等待模型与工具时不占用任何线程
+
+        对话仍在上游客户端的事件循环中运行，事件通过 call_soon_threadsafe 交给调用方的循环；
+        迭代器关闭（客户端断开）时取消进行中的对话。
+        """
+        caller = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        future = self._pump(lambda event: caller.call_soon_threadsafe(events.put_nowait, event),
+                            system, messages, project_path, tools, cache_scope)
+        try:
+            first = True
+            while True:
+                event = await events.get()
+                if event is None:
+                    return
+                if batch_window is None:
+                    yield event
+                    continue
+
+                batch = [event]
+                finished = False
+                deadline = time.monotonic() + (0 if first else batch_window)
+                first = False
+                while True:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        event = await asyncio.wait_for(events.get(), remaining) if remaining > 0 \
+                            else events.get_nowait()
+                    except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                        break
+                    if event is None:
+                        finished = True
+                        break
+                    self._merge(batch, event)
+                yield batch
+                if finished:
+                    return
+        finally:
+            future.cancel()
+
+
+engine = ChatEngine()
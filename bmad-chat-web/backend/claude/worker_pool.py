@@ -0,0 +1,272 @@
+import json
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from config import CLAUDE_POOL_MAX_WORKERS, CLAUDE_POOL_IDLE_TIMEOUT, CLAUDE_POOL_QUEUE_TIMEOUT, CLAUDE_CHAT_TIMEOUT
+from metrics import cli_duration
+from store import store
+
+
+class PoolBusyError(Exception):
+    """所有 CLI 工作进程都在忙且已达到上限"""
+
+
+class WorkerExitedError(Exception):
+    """CLI 工作进程意外退出"""
+
+    def __init__(self, message, returncode=None):
+        super().__init__(message)
+        self.returncode = returncode
+
+
+class ClaudeWorker:
+    """长驻的 Claude CLI 进程，通过 stream-json 输入输出逐条处理消息"""
+
+    def __init__(self, cli_path, working_dir=None, resume_session=None):
+        cmd = [
+            str(cli_path), '-p',
+            '--input-format', 'stream-json',
+            '--output-format', 'stream-json',
+            '--verbose'
+        ]
+        if resume_session:
+            cmd += ['--resume', resume_session]
+
+        self.working_dir = working_dir
+        self.proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            bufsize=1,
+            cwd=working_dir
+        )
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.sent_at = None
+        # CLI 自己的会话 ID（来自输出事件）
+        self.cli_session_id = resume_session
+        self._lines = queue.Queue()
+        self._stderr = deque(maxlen=50)
+        threading.Thread(target=self._read_stdout, daemon=True).start()
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+
+    def _read_stdout(self):
+        for line in self.proc.stdout:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def _read_stderr(self):
+        for line in self.proc.stderr:
+            self._stderr.append(line)
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def stderr(self):
+        return "".join(self._stderr)
+
+    def send(self, message):
+        payload = {
+            'type': 'user',
+            'message': {'role': 'user', 'content': [{'type': 'text', 'text': message}]}
+        }
+        self.proc.stdin.write(json.dumps(payload, ensure_ascii=False) + '\n')
+        self.proc.stdin.flush()
+        self.sent_at = time.monotonic()
+
+    def _observe(self, status):
+        if self.sent_at is not None:
+            cli_duration.observe(time.monotonic() - self.sent_at, status=status)
+            self.sent_at = None
+
+    def events(self, timeout=CLAUDE_CHAT_TIMEOUT, poll=None):
+        """逐条产出本条消息的输出事件，直到 result 事件
+
+        timeout 是空闲超时：连续 timeout 秒没有任何输出才抛出 TimeoutError，持续输出的长任务不受限制。
+        poll 不为 None 时，每等待 poll 秒没有输出就产出一次 None，方便调用方检查连接状态。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._observe('timeout')
+                raise TimeoutError
+            try:
+                line = self._lines.get(timeout=min(remaining, poll) if poll else remaining)
+            except queue.Empty:
+                if poll:
+                    yield None
+                continue
+            if line is None:
+                self.proc.wait()
+                self._observe('crashed')
+                raise WorkerExitedError(self.stderr() or f"CLI 进程已退出（{self.proc.returncode}）", self.proc.returncode)
+            deadline = time.monotonic() + timeout
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get('session_id'):
+                self.cli_session_id = event['session_id']
+            if event.get('type') == 'result':
+                self._observe('error' if event.get('is_error') else 'success')
+            yield event
+            if event.get('type') == 'result':
+                return
+
+    def ask(self, message, timeout=CLAUDE_CHAT_TIMEOUT):
+        """发送消息并等待完整结果，返回 result 事件"""
+        self.send(message)
+        for event in self.events(timeout):
+            if event.get('type') == 'result':
+                return event
+        raise WorkerExitedError("CLI 未返回结果")
+
+    def close(self):
+        if self.alive():
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+class ClaudeWorkerPool:
+    """按 (会话, 工作目录) 路由的 CLI 工作进程池
+
+    每个会话一个长驻进程，一次只处理一条消息；进程总数受 max_workers 限制，
+    空闲超过 idle_timeout 的进程会被回收，满载时请求最多排队 queue_timeout 秒。
+    CLI 会话 ID 保存在 sessions（Store）中：多进程部署时同一会话的请求落到其他进程，
+    会以 --resume 接续；本进程的旧工作进程落后于保存的会话时会被替换。
+    """
+
+    def __init__(self, max_workers=CLAUDE_POOL_MAX_WORKERS, idle_timeout=CLAUDE_POOL_IDLE_TIMEOUT,
+                 queue_timeout=CLAUDE_POOL_QUEUE_TIMEOUT, sessions=store):
+        self.max_workers = max_workers
+        self.sessions = sessions
+        self.idle_timeout = idle_timeout
+        self.queue_timeout = queue_timeout
+        self._workers = {}
+        self._cond = threading.Condition()
+        self._cli_path = None
+        self._reaper = None
+
+    def cli_path(self):
+        """解析一次 CLI 路径并缓存（未找到时下次再试）"""
+        if self._cli_path is None:
+            from claude.cli_discovery import get_claude_cli_path
+            self._cli_path = get_claude_cli_path()
+        return self._cli_path
+
+    @contextmanager
+    def worker(self, session_id, working_dir=None):
+        """获取会话对应的工作进程（独占），必要时启动新进程"""
+        key = (session_id, working_dir)
+        deadline = time.monotonic() + self.queue_timeout
+        resume = self.sessions.get_claude_session(session_id, working_dir)
+        with self._cond:
+            self._start_reaper()
+            while True:
+                worker = self._workers.get(key)
+                if worker is not None and not worker.alive():
+                    del self._workers[key]
+                    worker = None
+                if worker is not None and worker.lock.acquire(blocking=False):
+                    if worker.cli_session_id == resume:
+                        break
+                    # 会话已在其他进程中继续或被停止，本进程的进程状态已过期
+                    del self._workers[key]
+                    worker.lock.release()
+                    worker.close()
+                    worker = None
+                if worker is None and (len(self._workers) < self.max_workers or self._evict_idle()):
+                    worker = ClaudeWorker(self.cli_path(), working_dir, resume_session=resume)
+                    worker.lock.acquire()
+                    self._workers[key] = worker
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolBusyError("Claude CLI 繁忙，请稍后重试")
+                self._cond.wait(remaining)
+
+        try:
+            yield worker
+            if worker.cli_session_id and worker.cli_session_id != resume:
+                self.sessions.set_claude_session(session_id, working_dir, worker.cli_session_id)
+        except BaseException:
+            # 出错或中途取消时进程状态未知，直接回收
+            self.discard(key, worker)
+            raise
+        finally:
+            worker.last_used = time.monotonic()
+            worker.lock.release()
+            with self._cond:
+                self._cond.notify_all()
+
+    def chat(self, session_id, message, working_dir=None, timeout=CLAUDE_CHAT_TIMEOUT):
+        """发送一条消息并返回 result 事件"""
+        with self.worker(session_id, working_dir) as worker:
+            return worker.ask(message, timeout)
+
+    def discard(self, key, worker):
+        with self._cond:
+            if self._workers.get(key) is worker:
+                del self._workers[key]
+        worker.close()
+
+    def close_session(self, session_id):
+        """关闭会话的所有工作进程，并清除保存的 CLI 会话（其他进程中的工作进程随后会被替换）"""
+        self.sessions.delete_claude_sessions(session_id)
+        with self._cond:
+            keys = [key for key in self._workers if key[0] == session_id]
+            workers = [self._workers.pop(key) for key in keys]
+        for worker in workers:
+            worker.close()
+        return len(workers)
+
+    def _evict_idle(self):
+        """回收最久未使用的空闲进程，成功返回 True（调用方需持有 _cond）"""
+        idle = [(w.last_used, key) for key, w in self._workers.items() if not w.lock.locked()]
+        if not idle:
+            return False
+        _, key = min(idle)
+        self._workers.pop(key).close()
+        return True
+
+    def _start_reaper(self):
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap_loop, name='claude-pool-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(min(30, self.idle_timeout))
+            now = time.monotonic()
+            with self._cond:
+                expired = [key for key, w in self._workers.items()
+                           if not w.lock.locked() and (now - w.last_used > self.idle_timeout or not w.alive())]
+                workers = [self._workers.pop(key) for key in expired]
+                if workers:
+                    self._cond.notify_all()
+            for worker in workers:
+                worker.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': len(self._workers),
+                'busy': sum(1 for w in self._workers.values() if w.lock.locked()),
+                'maxWorkers': self.max_workers
+            }
+
+
+pool = ClaudeWorkerPool()
@@ -1,14 +1,174 @@
 import os
 
+# 服务进程：python app.py 启动单进程开发服务器；生产环境由 gunicorn 按 gunicorn.conf.py 启动
+SERVER_PORT = int(os.environ.get('BMAD_PORT', '5001'))
+SERVER_DEBUG = os.environ.get('BMAD_DEBUG', '1') == '1'
+# gunicorn 监听地址、工作进程数（默认为 CPU 核数）与每个进程的线程数
+# SERVER_MODE=asgi（默认）：uvicorn 工作进程加载 asgi.py，聊天接口在事件循环中处理，进行中的对话不占用线程，
+#   其余接口在 SERVER_THREADS 个线程中运行；
+# SERVER_MODE=wsgi：gthread 工作进程加载 wsgi.py，每个进行中的对话（含 SSE 长连接）在整轮期间占用一个线程，
+#   同时进行的对话数最多为 SERVER_WORKERS × SERVER_THREADS
+SERVER_MODE = os.environ.get('BMAD_SERVER_MODE', 'asgi')
+SERVER_BIND = os.environ.get('BMAD_BIND', f"0.0.0.0:{SERVER_PORT}")
+SERVER_WORKERS = int(os.environ.get('BMAD_WORKERS', '0')) or os.cpu_count() or 1
+SERVER_THREADS = int(os.environ.get('BMAD_WORKER_THREADS', '32'))
+
 # API 配置
-ANTHROPIC_BASE_URL = "https://api.minimaxi.com/anthropic"
-ANTHROPIC_API_KEY = "sk-cp-Mu2tAGd_P5c8JhIAsUOXa1X5ADePAp1emZXv9HQphv2XyxrMBYtYU1YbAaSm4GEJGyQilrKeqGPzWWW5pUmehULvvz1x4UfIthDKZlOIneerRFWXpEbaCUI"
-MODEL_NAME = "MiniMax-M2.5"
+ANTHROPIC_BASE_URL = os.environ.get('ANTHROPIC_BASE_URL', "https://api.minimaxi.com/anthropic")
+ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY', "sk-cp-Mu2tAGd_P5c8JhIAsUOXa1X5ADePAp1emZXv9HQphv2XyxrMBYtYU1YbAaSm4GEJGyQilrKeqGPzWWW5pUmehULvvz1x4UfIthDKZlOIneerRFWXpEbaCUI")
+MODEL_NAME = os.environ.get('BMAD_MODEL_NAME', "MiniMax-M2.5")
+# 主模型重试后仍失败时改用的备用模型（留空则不启用）
+FALLBACK_MODEL = os.environ.get('BMAD_FALLBACK_MODEL', '')
+# 上游连接池：最大连接数、保持的空闲连接数与空闲连接的过期时间（秒）
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get('BMAD_UPSTREAM_MAX_CONNECTIONS', '32'))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get('BMAD_UPSTREAM_MAX_KEEPALIVE', '16'))
+UPSTREAM_KEEPALIVE_EXPIRY = 30
+# 单次请求超时（秒）：建立连接 / 读取（流式输出时为两段数据之间的最长间隔）
+UPSTREAM_CONNECT_TIMEOUT = 10
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('BMAD_UPSTREAM_READ_TIMEOUT', '120'))
+# 429/5xx/连接错误的重试次数与退避时间（秒），响应带 Retry-After 时以其为准
+UPSTREAM_MAX_RETRIES = int(os.environ.get('BMAD_UPSTREAM_MAX_RETRIES', '3'))
+UPSTREAM_RETRY_BASE_DELAY = 0.5
+UPSTREAM_RETRY_MAX_DELAY = 20
+# 同时进行的上游请求上限，超出的请求排队；排队数或等待时间（秒）超限时返回 503
+UPSTREAM_MAX_CONCURRENCY = int(os.environ.get('BMAD_UPSTREAM_MAX_CONCURRENCY', '16'))
+UPSTREAM_MAX_QUEUE = int(os.environ.get('BMAD_UPSTREAM_MAX_QUEUE', '64'))
+UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get('BMAD_UPSTREAM_QUEUE_TIMEOUT', '30'))
+# 对话请求调度（/api/chat、/api/chat/stream 与 Claude CLI 接口）：全局与单个项目同时处理的对话数上限
+# 以下上限与排队数均为整个服务的总数：gunicorn 下每个工作进程各有一个调度器，全局上限与排队数按 SERVER_WORKERS 平分
+# （向上取整、至少为 1）；单个项目的上限不平分，由各进程通过 SCHEDULER_LEASE_DIR 下的锁文件共同遵守
+SCHEDULER_MAX_ACTIVE = int(os.environ.get('BMAD_SCHEDULER_MAX_ACTIVE', '16'))
+SCHEDULER_PROJECT_MAX_ACTIVE = int(os.environ.get('BMAD_SCHEDULER_PROJECT_MAX_ACTIVE', '4'))
+# 排队总数 / 单个项目排队数上限与最长排队时间（秒），超出时返回 503 与 Retry-After
+SCHEDULER_MAX_QUEUE = int(os.environ.get('BMAD_SCHEDULER_MAX_QUEUE', '64'))
+SCHEDULER_PROJECT_MAX_QUEUE = int(os.environ.get('BMAD_SCHEDULER_PROJECT_MAX_QUEUE', '16'))
+SCHEDULER_QUEUE_TIMEOUT = float(os.environ.get('BMAD_SCHEDULER_QUEUE_TIMEOUT', '30'))
+# 加权公平排队中各优先级的权重：权重越大，排队时越靠前（请求的 priority 字段或 X-BMad-Priority 头）
+SCHEDULER_WEIGHTS = {'interactive': 4.0, 'batch': 1.0}
+
+# 单次回复的最大输出 token 数
+MAX_TOKENS = 4096
+# 每轮对话最多的工具调用次数
+MAX_TOOL_ITERATIONS = 5
+# 同一轮内连续的只读工具调用并发执行：线程池大小与单个工具的超时（秒，从开始执行时计算；排队也最多等待这么久）
+TOOL_MAX_WORKERS = int(os.environ.get('BMAD_TOOL_MAX_WORKERS', '8'))
+TOOL_TIMEOUT = float(os.environ.get('BMAD_TOOL_TIMEOUT', '30'))
+# read_files / write_files 一次最多处理的文件数
+TOOL_MAX_BATCH_FILES = 20
+# 单个工具结果的大小上限：文件内容超过该字符数时截断到整行并提示用 offset 继续读取；列表最多保留的条目数
+TOOL_RESULT_MAX_CHARS = int(os.environ.get('BMAD_TOOL_RESULT_MAX_CHARS', '100000'))
+TOOL_RESULT_MAX_ITEMS = 1000
+# 只读工具（read_file、read_files、list_directory）结果缓存的总大小（字节），按项目与文件 mtime/size 区分
+TOOL_CACHE_MAX_BYTES = int(os.environ.get('BMAD_TOOL_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+# 模型上下文窗口大小（token）
+MODEL_CONTEXT_WINDOW = int(os.environ.get('BMAD_MODEL_CONTEXT_WINDOW', '200000'))
+
+# 对话上下文：从存储的历史中按 token 预算组装，最近的消息优先
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('BMAD_CONTEXT_TOKEN_BUDGET', '32000'))
+# 开启后将超出预算的早期对话压缩为摘要（会额外调用一次模型，结果按项目缓存）
+CONTEXT_SUMMARIZE = os.environ.get('BMAD_CONTEXT_SUMMARIZE', '0') == '1'
+# 摘要最大 token 数
+CONTEXT_DIGEST_MAX_TOKENS = 1024
+
+# 超过该大小（字节）的 JSON/文本响应按 Accept-Encoding 压缩（zstd/br 需安装 zstandard/brotli，否则用 gzip），0 为不压缩
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('BMAD_COMPRESS_MIN_BYTES', '1024'))
+# 流式聊天：取到事件后最多再等待该时间（秒）收集随后的事件，合并为一次写出（连续的文本增量合并为一个事件）
+SSE_BATCH_WINDOW = float(os.environ.get('BMAD_SSE_BATCH_WINDOW', '0.03'))
+
+# 请求耗时超过该值（毫秒）时打印各阶段耗时，0 为不打印
+TRACE_SLOW_MS = float(os.environ.get('BMAD_TRACE_SLOW_MS', '0'))
 
 # 数据存储路径
-DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+DATA_DIR = os.environ.get('BMAD_DATA_DIR') or os.path.join(os.path.dirname(__file__), 'data')
 os.makedirs(DATA_DIR, exist_ok=True)
 PROJECTS_FILE = os.path.join(DATA_DIR, 'projects.json')
+# SQLite 数据库（首次启动时自动从 projects.json 迁移）
+DATABASE_FILE = os.path.join(DATA_DIR, 'bmad.db')
+
+# 对话写入：先追加到本进程的日志文件（journal），由后台线程按间隔（秒）或条数批量写入数据库
+# 默认 append() 写入日志后立即返回，不在请求线程上等待磁盘：后台线程写库前 fsync 日志，
+# 进程异常退出后下次启动时从遗留的日志补写，但断电或系统崩溃可能丢失最近约一个写入间隔内的消息。
+# BMAD_PERSIST_FSYNC=1 时 append() 返回前日志已 fdatasync（同时到达的追加合并为一次，即组提交），
+# 已确认的消息在断电后也不会丢失，代价是每轮对话的保存多一次磁盘同步
+PERSIST_JOURNAL_DIR = os.path.join(DATA_DIR, 'journal')
+PERSIST_FLUSH_INTERVAL = float(os.environ.get('BMAD_PERSIST_FLUSH_INTERVAL', '0.2'))
+PERSIST_FLUSH_MAX_MESSAGES = int(os.environ.get('BMAD_PERSIST_FLUSH_MAX_MESSAGES', '200'))
+PERSIST_FSYNC = os.environ.get('BMAD_PERSIST_FSYNC', '0') == '1'
+# 读取对话历史前等待本进程中该项目未写入的消息落库的最长时间（秒）
+PERSIST_SYNC_TIMEOUT = 5
+
+# 对话调度器跨进程的单项目名额：每个项目 SCHEDULER_PROJECT_MAX_ACTIVE 个锁文件，
+# 名额被其他进程占满时，每隔 SCHEDULER_LEASE_RETRY 秒重试
+SCHEDULER_LEASE_DIR = os.path.join(DATA_DIR, 'scheduler')
+SCHEDULER_LEASE_RETRY = 0.2
+
+# 导入时每个事务提交的记录数（断点续传的粒度）
+TRANSFER_BATCH_SIZE = 1000
+
+# 模型回复缓存：相同角色、system 与消息（含工具结果）的请求直接返回上次的回复
+# 默认关闭；本轮有工具写入文件后不再读写缓存
+RESPONSE_CACHE = os.environ.get('BMAD_RESPONSE_CACHE', '0') == '1'
+# 缓存有效期（秒）与内存层总大小（字节）
+RESPONSE_CACHE_TTL = float(os.environ.get('BMAD_RESPONSE_CACHE_TTL', '3600'))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('BMAD_RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+# 开启后缓存同时写入磁盘，重启后仍可命中
+RESPONSE_CACHE_DISK = os.environ.get('BMAD_RESPONSE_CACHE_DISK', '0') == '1'
+RESPONSE_CACHE_DIR = os.path.join(DATA_DIR, 'response_cache')
+RESPONSE_CACHE_DISK_MAX_BYTES = int(os.environ.get('BMAD_RESPONSE_CACHE_DISK_MAX_BYTES', str(256 * 1024 * 1024)))
 
 # BMad agents 路径
-BMAD_AGENTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.bmad-core', 'agents')
+BMAD_AGENTS_PATH = os.environ.get('BMAD_AGENTS_PATH') or os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.bmad-core', 'agents')
+
+# 预编译角色包（python -m agents.bundle 生成），存在且校验通过时启动时直接加载
+AGENTS_BUNDLE_FILE = os.environ.get('BMAD_AGENTS_BUNDLE_FILE') or os.path.join(DATA_DIR, 'agents.bundle.json')
+
+# 角色注册表：两次检查角色文件 mtime/size 的最小间隔（秒）
+AGENTS_RELOAD_INTERVAL = float(os.environ.get('BMAD_AGENTS_RELOAD_INTERVAL', '2'))
+# 开启后通过文件系统事件（需安装 watchdog）感知角色文件变化，不再按间隔检查
+AGENTS_WATCH = os.environ.get('BMAD_AGENTS_WATCH', '0') == '1'
+
+# 项目文件树索引：两次检查目录 mtime 的最小间隔（秒）
+FILE_INDEX_REFRESH_INTERVAL = float(os.environ.get('BMAD_FILE_INDEX_REFRESH_INTERVAL', '1'))
+# 开启后通过文件系统事件（需安装 watchdog）感知项目文件变化
+FILE_INDEX_WATCH = os.environ.get('BMAD_FILE_INDEX_WATCH', '0') == '1'
+# 扫描文件树时忽略的文件/目录名（glob，逗号分隔），另外还会应用项目根目录的 .gitignore
+FILE_IGNORE_GLOBS = [g.strip() for g in os.environ.get(
+    'BMAD_FILE_IGNORE_GLOBS',
+    '.git,node_modules,__pycache__,.venv,venv,dist,build,.next,.cache,.DS_Store,*.pyc'
+).split(',') if g.strip()]
+# 懒加载目录列表的默认/最大分页大小
+FILE_LIST_PAGE_SIZE = 200
+FILE_LIST_MAX_PAGE_SIZE = 1000
+# 同时保留索引的项目数
+FILE_INDEX_MAX_PROJECTS = 32
+# 每个项目保留的变更记录条数，超出后客户端需重新获取完整文件树
+FILE_INDEX_CHANGE_LOG = 2000
+
+# 文件读取：超过该大小的文件只能按行范围读取（字节）
+FILE_READ_MAX_SIZE = 500 * 1024
+# 大文件未指定行范围时默认返回的行数
+FILE_READ_DEFAULT_LINES = 2000
+# 小文件内容缓存的总大小（字节，按解码后字符串占用的内存计）
+FILE_CACHE_MAX_BYTES = int(os.environ.get('BMAD_FILE_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+# 全文搜索：同一项目两次检查文件变化的最小间隔（秒）
+SEARCH_REINDEX_INTERVAL = float(os.environ.get('BMAD_SEARCH_REINDEX_INTERVAL', '5'))
+# 超过该大小（字节）的文件不建索引；每个项目最多索引的文件数
+SEARCH_MAX_FILE_SIZE = 1024 * 1024
+SEARCH_MAX_FILES = int(os.environ.get('BMAD_SEARCH_MAX_FILES', '20000'))
+# 重新索引时每个写事务提交的文件数与内容总大小（字节）上限，文件在事务之外读取
+SEARCH_INDEX_BATCH_FILES = 200
+SEARCH_INDEX_BATCH_BYTES = 8 * 1024 * 1024
+# 每次搜索的默认/最大结果数，以及同一文件最多返回的匹配行数
+SEARCH_RESULT_LIMIT = 20
+SEARCH_MAX_RESULT_LIMIT = 100
+SEARCH_MAX_HITS_PER_FILE = 5
+
+# Claude CLI 工作进程池：进程上限、空闲回收时间（秒）、满载时的排队等待（秒）
+CLAUDE_POOL_MAX_WORKERS = int(os.environ.get('BMAD_CLAUDE_POOL_MAX_WORKERS', '8'))
+CLAUDE_POOL_IDLE_TIMEOUT = float(os.environ.get('BMAD_CLAUDE_POOL_IDLE_TIMEOUT', '600'))
+CLAUDE_POOL_QUEUE_TIMEOUT = float(os.environ.get('BMAD_CLAUDE_POOL_QUEUE_TIMEOUT', '30'))
+# 单条消息的空闲超时（秒）：CLI 连续这么久没有任何输出才算超时
+CLAUDE_CHAT_TIMEOUT = 120
+# 流式输出时，CLI 无输出超过该时间（秒）就发送一次心跳，以便及时发现客户端断开
+CLAUDE_STREAM_HEARTBEAT = 5
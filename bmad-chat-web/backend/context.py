@@ -0,0 +1,127 @@
+from config import (
+    CONTEXT_TOKEN_BUDGET, CONTEXT_SUMMARIZE, CONTEXT_DIGEST_MAX_TOKENS,
+    MAX_TOKENS, MODEL_CONTEXT_WINDOW
+)
+from store import store
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：按 UTF-8 字节数 / 3（中文约 1 token/字，英文约 4 字符/token）
+
+    text 也可以是内容块列表（消息内容或 system prompt），文本块按文本估算，其他块按序列化后的长度估算。
+    """
+    if isinstance(text, list):
+        return sum(estimate_tokens(block.get('text', block) if isinstance(block, dict) else block)
+                   for block in text)
+    if not isinstance(text, str):
+        text = str(text)
+    return len(text.encode('utf-8')) // 3 + 1
+
+
+def context_budget(budget=None):
+    """上下文 token 预算，硬上限为模型窗口减去输出预留"""
+    budget = budget or CONTEXT_TOKEN_BUDGET
+    return max(0, min(budget, MODEL_CONTEXT_WINDOW - MAX_TOKENS))
+
+
+def build_context(project_id, message, history=None, summarize=None, budget=None, system=None):
+    """组装发送给模型的消息列表，返回 (messages, digest)
+
+    history 为 None 时从存储中读取项目历史；否则对传入的历史做同样的窗口裁剪。
+    system 为本轮的 system prompt（字符串或内容块列表），先从预算中扣除，剩余部分再用于历史消息。
+    """
+    budget = context_budget(budget)
+    use_digest = CONTEXT_SUMMARIZE and summarize is not None and history is None
+    remaining = budget - estimate_tokens(message)
+    if system:
+        remaining -= estimate_tokens(system)
+    if use_digest:
+        remaining -= CONTEXT_DIGEST_MAX_TOKENS
+
+    if history is None:
+        source = store.iter_recent_messages(project_id)
+    else:
+        source = reversed(history)
+
+    # 从最近的消息向前累加，超出预算即停止
+    selected = []
+    last_dropped_id = None
+    for msg in source:
+        cost = estimate_tokens(msg.get('content', ''))
+        if cost > remaining:
+            last_dropped_id = msg.get('id')
+            break
+        remaining -= cost
+        selected.append(msg)
+    selected.reverse()
+
+    digest = None
+    if use_digest and last_dropped_id is not None:
+        digest = get_digest(project_id, last_dropped_id, summarize, budget)
+        if digest:
+            # 摘要已覆盖的消息不再重复发送
+            selected = [m for m in selected if m['id'] > digest['upto_id']]
+
+    messages = normalize_messages(selected + [{'role': 'user', 'content': message}])
+    return messages, digest['content'] if digest else None
+
+
+def get_digest(project_id, upto_id, summarize, budget):
+    """获取覆盖到 upto_id 的摘要，只对新增的早期消息做增量摘要"""
+    cached = store.get_digest(project_id)
+    if cached and cached['upto_id'] >= upto_id:
+        return cached
+
+    content = cached['content'] if cached else ''
+    after_id = cached['upto_id'] if cached else 0
+    pending = store.get_messages_range(project_id, after_id, upto_id)
+
+    # 按预算分块，逐块把新消息合并进摘要
+    try:
+        chunk, chunk_tokens = [], 0
+        for msg in pending:
+            cost = estimate_tokens(msg['content'])
+            if chunk and chunk_tokens + cost > budget:
+                content = summarize(content, chunk)
+                after_id = chunk[-1]['id']
+                chunk, chunk_tokens = [], 0
+            chunk.append(msg)
+            chunk_tokens += cost
+        if chunk:
+            content = summarize(content, chunk)
+            after_id = chunk[-1]['id']
+    except Exception as e:
+        print(f"Error summarizing history for {project_id}: {e}")
+        if after_id == (cached['upto_id'] if cached else 0):
+            return cached
+
+    store.set_digest(project_id, after_id, content)
+    return {'upto_id': after_id, 'content': content}
+
+
+def normalize_messages(items):
+    """保证消息以 user 开头且角色交替，相邻同角色消息合并"""
+    messages = []
+    for item in items:
+        role = 'assistant' if item.get('role') == 'assistant' else 'user'
+        content = item.get('content', '')
+        if not messages and role == 'assistant':
+            continue
+        if messages and messages[-1]['role'] == role:
+            messages[-1]['content'] = merge_content(messages[-1]['content'], content)
+        else:
+            messages.append({'role': role, 'content': content})
+    return messages
+
+
+def merge_content(first, second):
+    """合并两条消息的内容：都是字符串时以空行连接，否则按内容块列表拼接（字符串转为文本块）"""
+    if isinstance(first, str) and isinstance(second, str):
+        return first + '\n\n' + second
+
+    def blocks(content):
+        if isinstance(content, str):
+            return [{'type': 'text', 'text': content}] if content else []
+        return list(content)
+
+    return blocks(first) + blocks(second)
@@ -0,0 +1,236 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from config import (
+    PERSIST_JOURNAL_DIR, PERSIST_FLUSH_INTERVAL, PERSIST_FLUSH_MAX_MESSAGES, PERSIST_FSYNC, PERSIST_SYNC_TIMEOUT
+)
+from store import store
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 flock，只能单进程运行
+    fcntl = None
+
+# macOS 没有 fdatasync
+_datasync = getattr(os, 'fdatasync', os.fsync)
+
+
+class ConversationWriter:
+    """对话消息的后台批量写入
+
+    append() 把消息追加到本进程的日志文件并放入按项目分组的队列后返回，不等待写入数据库；
+    durable 为 True 时返回前先 fdatasync 日志（组提交：等待落盘期间到达的追加由下一次 fdatasync 一并完成），
+    否则由后台线程在写库前 fsync，请求线程上没有磁盘同步。
+    后台线程每隔 interval 秒或积压达到 max_pending 条时在一个事务中写入数据库，
+    并在同一事务中记录已写入的序号，日志中的消息全部落库后清空日志。
+    日志文件由所属进程 flock 加锁；启动时补写锁已释放（进程已退出）的日志中尚未落库的消息。
+    队列与日志都属于单个进程：sync() 只能等待本进程追加的消息，多个工作进程时，
+    其他进程最多在一个写入间隔后才能读到这些消息（同一工作进程内先写后读总能读到）。
+    """
+
+    def __init__(self, store=store, journal_dir=PERSIST_JOURNAL_DIR, interval=PERSIST_FLUSH_INTERVAL,
+                 max_pending=PERSIST_FLUSH_MAX_MESSAGES, durable=PERSIST_FSYNC):
+        self.store = store
+        self.durable = durable
+        self.journal_dir = journal_dir
+        self.interval = interval
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        # project_id -> [(seq, role, content, created_at)]
+        self._pending = OrderedDict()
+        self._count = 0
+        self._seq = 0
+        self._flushed = 0
+        # 已确认落盘的最大序号；同一时刻只有一个线程执行 fdatasync
+        self._synced = 0
+        self._sync_lock = threading.Lock()
+        # 各项目最后一条未落库消息的序号
+        self._last_seq = {}
+        self._flush_now = False
+        self._closed = False
+        self._fd = None
+        self._journal_name = None
+        self._thread = None
+        os.makedirs(journal_dir, exist_ok=True)
+        self.recover()
+        atexit.register(self.close)
+
+    def _meta_key(self, name):
+        return f'journal:{name}'
+
+    def append(self, project_id, messages):
+        """追加一组消息（按顺序写入），不等待写入数据库；durable 时等待日志落盘后返回"""
+        now = time.time()
+        with self._cond:
+            self._start()
+            entries = self._pending.setdefault(project_id, [])
+            lines = []
+            for message in messages:
+                self._seq += 1
+                role, content = message.get('role', 'user'), message.get('content', '')
+                entries.append((self._seq, role, content, now))
+                lines.append(json.dumps({
+                    'seq': self._seq, 'project_id': project_id, 'role': role,
+                    'content': content, 'created_at': now
+                }, ensure_ascii=False))
+            self._count += len(lines)
+            self._last_seq[project_id] = self._seq
+            os.write(self._fd, ('\n'.join(lines) + '\n').encode('utf-8'))
+            target = self._seq
+            if self._count >= self.max_pending:
+                self._cond.notify_all()
+        if self.durable:
+            self._sync_journal(target)
+
+    def _sync_journal(self, target):
+        """确保序号不超过 target 的消息已落盘（组提交）"""
+        with self._sync_lock:
+            if self._synced >= target:
+                return  # 已被其他线程的 fdatasync 覆盖
+            with self._cond:
+                upto = self._seq
+            _datasync(self._fd)
+            self._synced = upto
+
+    def sync(self, project_id, timeout=PERSIST_SYNC_TIMEOUT):
+        """等待本进程中该项目已追加的消息全部落库（没有未写入的消息时立即返回）
+
+        只覆盖本进程的 append()：其他工作进程追加、尚未落库的消息不会被等待。
+        """
+        with self._cond:
+            target = self._last_seq.get(project_id)
+            if target is None or target <= self._flushed:
+                return True
+            self._flush_now = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._flushed >= target, timeout)
+
+    def _start(self):
+        """首次追加时打开日志并启动后台线程（调用方需持有 _cond）"""
+        if self._thread is not None:
+            return
+        self._journal_name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl"
+        self._fd = os.open(os.path.join(self.journal_dir, self._journal_name),
+                           os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if self.durable and fcntl:
+            # 新建的日志文件本身（目录项）也要落盘（Windows 不能打开目录，跳过）
+            dir_fd = os.open(self.journal_dir, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        self._thread = threading.Thread(target=self._run, name='conversation-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or self._flush_now or self._count >= self.max_pending, self.interval)
+                closed = self._closed
+                self._flush_now = False
+                batch, upto = self._pending, self._seq
+                self._pending, self._count = OrderedDict(), 0
+            if batch:
+                self._flush(batch, upto)
+            if closed:
+                return
+
+    def _flush(self, batch, upto):
+        rows = [(project_id, role, content, created_at)
+                for project_id, entries in batch.items()
+                for _, role, content, created_at in entries]
+        try:
+            os.fsync(self._fd)
+            self.store.add_conversations(rows, meta={self._meta_key(self._journal_name): str(upto)})
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error persisting conversations (will retry): {e}")
+            with self._cond:
+                for project_id, entries in batch.items():
+                    self._pending[project_id] = entries + self._pending.get(project_id, [])
+                self._count += len(rows)
+            return
+
+        with self._cond:
+            self._flushed = upto
+            self._last_seq = {p: seq for p, seq in self._last_seq.items() if seq > upto}
+            if self._seq == upto:
+                # 日志中的消息已全部落库；O_APPEND 保证之后的追加从文件开头写起
+                os.ftruncate(self._fd, 0)
+            self._cond.notify_all()
+
+    def recover(self):
+        """补写已退出进程遗留的日志，返回补写的消息数"""
+        recovered = 0
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not name.endswith('.jsonl') or name == self._journal_name:
+                continue
+            path = os.path.join(self.journal_dir, name)
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except OSError:
+                continue
+            try:
+                if fcntl:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # 所属进程仍在运行
+                # 加锁前已被其他进程补写并删除
+                if os.fstat(fd).st_nlink == 0:
+                    continue
+                recovered += self._replay(fd, name)
+                os.unlink(path)
+                self.store.delete_meta(self._meta_key(name))
+            finally:
+                os.close(fd)
+        if recovered:
+            print(f"已从日志补写 {recovered} 条对话消息")
+        return recovered
+
+    def _replay(self, fd, name):
+        key = self._meta_key(name)
+        flushed = int(self.store.get_meta(key) or 0)
+        with os.fdopen(os.dup(fd), 'r', encoding='utf-8') as f:
+            entries = []
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 写到一半的最后一行
+                if entry['seq'] > flushed:
+                    entries.append(entry)
+        if entries:
+            self.store.add_conversations(
+                [(e['project_id'], e['role'], e['content'], e['created_at']) for e in entries],
+                meta={key: str(entries[-1]['seq'])}
+            )
+        return len(entries)
+
+    def close(self):
+        """写入剩余消息；全部落库后删除本进程的日志"""
+        with self._cond:
+            if self._thread is None or self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=PERSIST_SYNC_TIMEOUT)
+        with self._cond:
+            if self._flushed != self._seq:
+                return  # 留给下次启动时补写
+            os.close(self._fd)
+        try:
+            os.unlink(os.path.join(self.journal_dir, self._journal_name))
+            self.store.delete_meta(self._meta_key(self._journal_name))
+        except (OSError, sqlite3.Error):
+            pass
+
+
+conversation_writer = ConversationWriter()
@@ -0,0 +1,179 @@
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+
+HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+# 新建文件的权限与 open() 一致（mkstemp 默认只有 0600）
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+NEW_FILE_MODE = 0o666 & ~_UMASK
+
+
+class PatchError(ValueError):
+    """补丁或替换无法应用到当前文件内容"""
+
+
+# realpath -> [RLock, 持有/等待的线程数]
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path):
+    """同一文件（按 realpath）的读-改-写在进程内串行执行；同一线程可重入"""
+    key = os.path.realpath(path)
+    with _file_locks_guard:
+        entry = _file_locks.setdefault(key, [threading.RLock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _file_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _file_locks[key]
+
+
+def atomic_write(path, content, newline=None):
+    """先写入同目录下的临时文件再重命名，写入过程中出错不会留下半个文件"""
+    dir_path = os.path.dirname(path) or '.'
+    os.makedirs(dir_path, exist_ok=True)
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = NEW_FILE_MODE
+
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline=newline) as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_for_edit(path):
+    """读取文件原始内容（保留换行符），返回 (content, 换行符)"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        content = f.read()
+    return content, '\r\n' if '\r\n' in content else '\n'
+
+
+def apply_replacements(content, edits, newline='\n'):
+    """依次应用 [{old_string, new_string, replace_all}]，返回 (新内容, 替换次数)
+
+    old_string 必须在文件中出现且只出现一次（replace_all 为 true 时替换全部）。
+    """
+    total = 0
+    for index, edit in enumerate(edits, 1):
+        old = edit.get('old_string') or ''
+        new = edit.get('new_string') or ''
+        if not old:
+            raise PatchError(f"第 {index} 处修改的 old_string 为空")
+        count = content.count(old)
+        if count == 0 and newline != '\n' and '\n' in old:
+            # 模型给出的文本通常是 \n 换行，按文件的换行符再试一次
+            old, new = old.replace('\n', newline), new.replace('\n', newline)
+            count = content.count(old)
+        if count == 0:
+            raise PatchError(f"第 {index} 处修改的 old_string 在文件中不存在")
+        if count > 1 and not edit.get('replace_all'):
+            raise PatchError(f"第 {index} 处修改的 old_string 出现了 {count} 次，请提供更多上下文或设置 replace_all")
+        content = content.replace(old, new)
+        total += count
+    return content, total
+
+
+def parse_unified_diff(patch):
+    """解析 unified diff，返回 [(old_start, old_count, [(op, text)])]，op 为 ' '、'-'、'+' 或 '\\'"""
+    hunks = []
+    current = None
+    for line in patch.splitlines():
+        match = HUNK_RE.match(line)
+        if match:
+            old_count = int(match.group(2)) if match.group(2) is not None else 1
+            current = (int(match.group(1)), old_count, [])
+            hunks.append(current)
+            continue
+        if current is None:
+            # 跳过 ---/+++ 等文件头
+            continue
+        if line.startswith('\\'):
+            current[2].append(('\\', ''))
+        elif line[:1] in (' ', '-', '+'):
+            current[2].append((line[0], line[1:]))
+        elif line == '':
+            # 有些工具会去掉空白上下文行开头的空格
+            current[2].append((' ', ''))
+        else:
+            raise PatchError(f"无法识别的补丁行: {line[:80]}")
+    if not hunks:
+        raise PatchError("补丁中没有 @@ 块")
+    return hunks
+
+
+def _find(lines, target, expected, start):
+    """在 lines[start:] 中查找与 target 相同的连续行，优先离 expected 最近的位置"""
+    if not target:
+        return max(expected, start)
+    last = len(lines) - len(target)
+    candidates = range(start, last + 1)
+    for i in sorted(candidates, key=lambda i: abs(i - expected)):
+        if lines[i:i + len(target)] == target:
+            return i
+    return None
+
+
+def apply_unified_diff(content, patch, newline='\n'):
+    """应用 unified diff，返回 (新内容, 应用的块数)；上下文行对不上时抛出 PatchError"""
+    # 只按 \n / \r\n 分行，避免 splitlines() 把 \f、\u2028 等字符也当作换行
+    lines = re.split(r'\r?\n', content)
+    final_newline = content.endswith('\n') or not content
+    if lines[-1] == '':
+        lines.pop()
+
+    result = []
+    pos = 0
+    hunks = parse_unified_diff(patch)
+    for index, (old_start, old_count, body) in enumerate(hunks, 1):
+        old, new = [], []
+        previous = None
+        for op, text in body:
+            if op == '\\':
+                # "\ No newline at end of file" 说明前一行是文件的最后一行且没有换行
+                if previous in (' ', '+'):
+                    final_newline = False
+                elif previous == '-':
+                    final_newline = True
+                continue
+            if op in (' ', '-'):
+                old.append(text)
+            if op in (' ', '+'):
+                new.append(text)
+            previous = op
+
+        # 纯插入的块中，old_start 指向插入位置的前一行
+        expected = old_start if not old and old_count == 0 else old_start - 1
+        start = _find(lines, old, expected, pos)
+        if start is None:
+            raise PatchError(f"第 {index} 个补丁块（@@ -{old_start}）与文件当前内容不匹配")
+        result.extend(lines[pos:start])
+        result.extend(new)
+        pos = start + len(old)
+    result.extend(lines[pos:])
+
+    text = newline.join(result)
+    if result and final_newline:
+        text += newline
+    return text, len(hunks)
@@ -0,0 +1,380 @@
+import fnmatch
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from config import (
+    FILE_INDEX_REFRESH_INTERVAL, FILE_INDEX_WATCH, FILE_INDEX_MAX_PROJECTS, FILE_INDEX_CHANGE_LOG,
+    FILE_IGNORE_GLOBS
+)
+
+MAX_DEPTH = 3
+
+
+class IgnoreRules:
+    """扫描时的忽略规则：配置的 glob 列表 + 项目根目录的 .gitignore"""
+
+    def __init__(self, root, globs=FILE_IGNORE_GLOBS):
+        self.root = root
+        self.globs = list(globs)
+        self.gitignore_path = os.path.join(root, '.gitignore')
+        self._gitignore_mtime = None
+        # (negate, dir_only, anchored, pattern)
+        self._patterns = []
+
+    def reload_if_changed(self):
+        """.gitignore 变化时重新加载，返回是否发生了变化"""
+        try:
+            mtime = os.stat(self.gitignore_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._gitignore_mtime:
+            return False
+        self._gitignore_mtime = mtime
+        self._patterns = self._parse() if mtime is not None else []
+        return True
+
+    def _parse(self):
+        patterns = []
+        try:
+            with open(self.gitignore_path, 'r', encoding='utf-8', errors='ignore') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return patterns
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            # 含有 / 的模式相对根目录匹配，否则匹配任意层级的文件名
+            anchored = '/' in line
+            line = line.lstrip('/')
+            if line:
+                patterns.append((negate, dir_only, anchored, line))
+        return patterns
+
+    def is_ignored(self, path, name, is_dir):
+        for glob in self.globs:
+            if fnmatch.fnmatchcase(name, glob):
+                return True
+        if not self._patterns:
+            return False
+
+        rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+        ignored = False
+        for negate, dir_only, anchored, pattern in self._patterns:
+            if dir_only and not is_dir:
+                continue
+            target = rel if anchored else name
+            if fnmatch.fnmatchcase(target, pattern):
+                ignored = not negate
+        return ignored
+
+
+class FileTreeIndex:
+    """单个项目的文件树索引
+
+    目录按需用 os.scandir 扫描（完整文件树或逐个目录展开），之后只重新扫描
+    mtime 变化或被标记为脏的目录；忽略规则在扫描时生效，被忽略的目录不会进入。
+    原地修改文件不改变目录的 mtime：未开启监听时，每隔 FILE_INDEX_REFRESH_INTERVAL 重新 stat 目录中已索引的文件。
+    每次有变化时版本号加一，并记录变更日志供客户端增量同步。
+    版本号与变更日志只在本进程内有效：客户端用 cursor()（epoch:version）同步，
+    请求落到其他工作进程或进程重启后 epoch 不同，changes_since() 要求客户端重新获取文件树。
+    """
+
+    def __init__(self, root, max_depth=MAX_DEPTH):
+        self.root = os.path.abspath(root)
+        self.max_depth = max_depth
+        # 每次构建索引时生成，用于区分重启前后相同的版本号
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.ignore = IgnoreRules(self.root)
+        # 目录路径 -> {'mtime_ns', 'entries': {name: node}}
+        self._dirs = {}
+        self._dirty = set()
+        self._changes = deque(maxlen=FILE_INDEX_CHANGE_LOG)
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._observer = None
+
+    def refresh(self, force=False, known_only=False):
+        """检查目录变化并更新索引
+
+        默认遍历到 max_depth 的完整文件树；known_only 为 True 时只检查已扫描过的目录。
+        force 为 True 时重新读取所有条目的元数据。
+        """
+        if not force and not self._needs_check():
+            return self.version
+        with self._lock:
+            if not force and not self._needs_check():
+                return self.version
+            with self._recording() as changes:
+                self._reload_ignore()
+                dirty, self._dirty = self._dirty, set()
+                if known_only:
+                    for path in sorted(self._dirs):
+                        if path in self._dirs:
+                            self._check_dir(path, force, dirty, changes)
+                else:
+                    self._walk(self.root, 0, force, dirty, changes)
+            self._checked_at = time.monotonic()
+            return self.version
+
+    def _needs_check(self):
+        if self._dirty or self._checked_at is None:
+            return True
+        if self._observer is not None:
+            return False
+        return time.monotonic() - self._checked_at >= FILE_INDEX_REFRESH_INTERVAL
+
+    def _reload_ignore(self):
+        """.gitignore 变化后，所有已扫描的目录都需要重新扫描"""
+        if self.ignore.reload_if_changed():
+            self._dirty.update(self._dirs)
+
+    @contextmanager
+    def _recording(self):
+        changes = []
+        yield changes
+        if changes:
+            self.version += 1
+            for op, path, node in changes:
+                self._changes.append({'version': self.version, 'op': op, 'path': path, 'item': node})
+
+    def _check_dir(self, path, force, dirty, changes):
+        """必要时重新扫描单个目录，目录已不存在时返回 False"""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            self._drop(path)
+            return False
+
+        cached = self._dirs.get(path)
+        if force or cached is None or cached['mtime_ns'] != mtime_ns or path in dirty:
+            self._scan_dir(path, mtime_ns, changes)
+        elif self._observer is None and time.monotonic() - cached['stat_at'] >= FILE_INDEX_REFRESH_INTERVAL:
+            self._restat_files(cached, changes)
+        return True
+
+    def _restat_files(self, cached, changes):
+        """重新读取目录中已索引文件的元数据（文件被删除会改变目录 mtime，由下次扫描处理）"""
+        entries = cached['entries']
+        for name, node in list(entries.items()):
+            if node['type'] != 'file':
+                continue
+            try:
+                stat = os.stat(node['path'])
+            except OSError:
+                continue
+            if stat.st_size != node['size'] or stat.st_mtime != node['modified']:
+                node = dict(node, size=stat.st_size, modified=stat.st_mtime, created=stat.st_ctime)
+                entries[name] = node
+                changes.append(('update', node['path'], node))
+        cached['stat_at'] = time.monotonic()
+
+    def _walk(self, path, depth, force, dirty, changes):
+        if not self._check_dir(path, force, dirty, changes):
+            return
+        if depth < self.max_depth:
+            for node in list(self._dirs[path]['entries'].values()):
+                if node['type'] == 'directory':
+                    self._walk(node['path'], depth + 1, force, dirty, changes)
+
+    def _scan_dir(self, path, mtime_ns, changes):
+        # 目录首次扫描属于发现而非变更，不记录到变更日志
+        known = path in self._dirs
+        old_entries = self._dirs[path]['entries'] if known else {}
+        entries = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    node = self._make_node(entry)
+                    if node:
+                        entries[entry.name] = node
+        except PermissionError:
+            pass
+
+        self._dirs[path] = {'mtime_ns': mtime_ns, 'stat_at': time.monotonic(), 'entries': entries}
+        if not known:
+            return
+
+        for name, node in entries.items():
+            old = old_entries.get(name)
+            if old is None:
+                changes.append(('add', node['path'], node))
+            elif old['type'] != node['type'] or old['size'] != node['size'] or old['modified'] != node['modified']:
+                changes.append(('update', node['path'], node))
+                if old['type'] == 'directory' and node['type'] != 'directory':
+                    self._drop(old['path'])
+        for name, old in old_entries.items():
+            if name not in entries:
+                changes.append(('remove', old['path'], None))
+                if old['type'] == 'directory':
+                    self._drop(old['path'])
+
+    def _make_node(self, entry):
+        try:
+            is_dir = entry.is_dir()
+            if self.ignore.is_ignored(entry.path, entry.name, is_dir):
+                return None
+            stat = entry.stat()
+        except OSError:
+            return None
+        return {
+            'name': entry.name,
+            'type': 'directory' if is_dir else 'file',
+            'path': entry.path,
+            'size': stat.st_size,
+            # 时间戳为 epoch 秒，由前端负责格式化
+            'modified': stat.st_mtime,
+            'created': stat.st_ctime,
+        }
+
+    def _drop(self, path):
+        """移除目录及其子目录的索引"""
+        prefix = path + os.sep
+        for key in [k for k in self._dirs if k == path or k.startswith(prefix)]:
+            del self._dirs[key]
+
+    def invalidate(self, path):
+        """标记路径所在目录需要重新扫描"""
+        path = os.path.abspath(path)
+        self._dirty.add(path if os.path.isdir(path) else os.path.dirname(path))
+
+    def refresh_root(self):
+        """只检查根目录这一层（非递归获取文件树之前调用，之后的 etag() 反映根目录的最新状态）"""
+        with self._lock:
+            self._ensure_dir(self.root)
+            return self.version
+
+    def tree(self, recursive=False):
+        """获取当前索引中的文件树（recursive 为 False 时只返回根目录这一层），调用前先 refresh()/refresh_root()"""
+        with self._lock:
+            return self._serialize(self.root, recursive)
+
+    def _serialize(self, path, recursive):
+        cached = self._dirs.get(path)
+        if not cached:
+            return []
+        items = []
+        for name in sorted(cached['entries']):
+            item = dict(cached['entries'][name])
+            if item['type'] == 'directory':
+                item['children'] = self._serialize(item['path'], recursive) if recursive else []
+            items.append(item)
+        return items
+
+    def _ensure_dir(self, path):
+        """只检查单个目录，不遍历子目录（调用方持有 _lock）"""
+        with self._recording() as changes:
+            self._reload_ignore()
+            dirty = {path} if path in self._dirty else set()
+            self._dirty.discard(path)
+            return self._check_dir(path, False, dirty, changes)
+
+    def list_dir(self, path, offset=0, limit=200):
+        """分页列出单个目录（懒加载模式），目录不在项目内或不存在时返回 None"""
+        path = os.path.abspath(path)
+        if path != self.root and not path.startswith(self.root + os.sep):
+            return None
+        # 检查与读取在同一次加锁中完成，期间其他线程的扫描不会移除该目录
+        with self._lock:
+            if not self._ensure_dir(path):
+                return None
+            entries = self._dirs[path]['entries']
+            names = sorted(entries)
+            return {
+                'path': path,
+                'items': [dict(entries[name]) for name in names[offset:offset + limit]],
+                'total': len(names),
+                'offset': offset,
+                'hasMore': offset + limit < len(names),
+                'version': self.cursor()
+            }
+
+    def etag(self, recursive=False):
+        return f'"{self.epoch}-{self.version}-{"r" if recursive else "f"}"'
+
+    def cursor(self):
+        """客户端增量同步用的版本标识 epoch:version"""
+        return f"{self.epoch}:{self.version}"
+
+    def changes_since(self, cursor):
+        """获取 cursor（epoch:version）之后的变更
+
+        cursor 不属于本索引（其他工作进程、重启前）或日志已不完整时返回 None，客户端需重新获取文件树。
+        """
+        epoch, _, version = str(cursor).partition(':')
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        version = int(version)
+        if version >= self.version:
+            return []
+        if not self._changes or self._changes[0]['version'] > version + 1:
+            return None
+        return [c for c in self._changes if c['version'] > version]
+
+    def start_watching(self):
+        """开启文件系统监听（需安装 watchdog），事件所在目录会在下次访问时重新扫描"""
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            print("watchdog 未安装，文件树索引退回按间隔检查目录变化")
+            return False
+
+        index = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                for path in (event.src_path, getattr(event, 'dest_path', '')):
+                    if path:
+                        index.invalidate(path)
+
+        observer = Observer()
+        observer.schedule(_Handler(), self.root, recursive=True)
+        observer.daemon = True
+        observer.start()
+        self._observer = observer
+        return True
+
+    def stop_watching(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(root):
+    """获取项目根目录的文件树索引，最多保留 FILE_INDEX_MAX_PROJECTS 个"""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = FileTreeIndex(root)
+            if FILE_INDEX_WATCH:
+                index.start_watching()
+            _indexes[root] = index
+            while len(_indexes) > FILE_INDEX_MAX_PROJECTS:
+                _, evicted = _indexes.popitem(last=False)
+                evicted.stop_watching()
+        else:
+            _indexes.move_to_end(root)
+        return index
+
+
+def invalidate(path):
+    """通知包含该路径的索引（例如工具写入文件后）"""
+    path = os.path.abspath(path)
+    for root, index in list(_indexes.items()):
+        if path == root or path.startswith(root + os.sep):
+            index.invalidate(path)
@@ -0,0 +1,127 @@
+import mmap
+import os
+import sys
+import threading
+from collections import OrderedDict
+from config import FILE_READ_MAX_SIZE, FILE_READ_DEFAULT_LINES, FILE_CACHE_MAX_BYTES
+
+
+class ContentCache:
+    """小文件内容的 LRU 缓存，键为 (path, mtime_ns, size)，文件变化后旧条目自然失效
+
+    按解码后字符串实际占用的内存（sys.getsizeof）计入上限：非 ASCII 文本解码后可能是文件大小的数倍。
+    """
+
+    def __init__(self, max_bytes=FILE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, content):
+        size = sys.getsizeof(content)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = (content, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old_size) = self._items.popitem(last=False)
+                self._bytes -= old_size
+
+
+content_cache = ContentCache()
+
+
+def file_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _load_text(path, stat):
+    """读取整个小文件（经过缓存）"""
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    content = content_cache.get(key)
+    if content is None:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        content_cache.put(key, content)
+    return content
+
+
+def split_lines(text):
+    """按 \n 分行并保留换行符，与 mmap 路径的分行一致（\r、\f、\u2028 等不算换行）"""
+    parts = text.split('\n')
+    lines = [part + '\n' for part in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    return lines
+
+
+def _read_lines_mmap(path, size, offset, limit):
+    """通过 mmap 定位行范围，只解码需要的部分，不把整个文件读入内存"""
+    if size == 0:
+        return '', 0, False
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            for _ in range(offset):
+                newline = mm.find(b'\n', pos)
+                if newline == -1:
+                    return '', 0, False
+                pos = newline + 1
+            start = pos
+            count = 0
+            while count < limit and pos < size:
+                newline = mm.find(b'\n', pos)
+                pos = size if newline == -1 else newline + 1
+                count += 1
+            data = mm[start:pos]
+            has_more = pos < size
+    return data.decode('utf-8'), count, has_more
+
+
+def read_text(path, offset=0, limit=None):
+    """读取文本文件
+
+    小文件（不超过 FILE_READ_MAX_SIZE）走内容缓存，未指定 limit 时返回全文；
+    大文件只按行范围读取，未指定 limit 时返回前 FILE_READ_DEFAULT_LINES 行。
+    编码错误时抛出 UnicodeDecodeError。
+    """
+    stat = os.stat(path)
+    result = {'size': stat.st_size, 'etag': file_etag(stat), 'offset': offset}
+
+    if stat.st_size <= FILE_READ_MAX_SIZE:
+        content = _load_text(path, stat)
+        if not offset and limit is None:
+            result.update({'content': content, 'partial': False, 'hasMore': False})
+            return result
+        lines = split_lines(content)
+        end = len(lines) if limit is None else offset + limit
+        selected = lines[offset:end]
+        result.update({
+            'content': ''.join(selected),
+            'lines': len(selected),
+            'totalLines': len(lines),
+            'partial': True,
+            'hasMore': end < len(lines)
+        })
+        return result
+
+    content, count, has_more = _read_lines_mmap(path, stat.st_size, offset, limit or FILE_READ_DEFAULT_LINES)
+    result.update({
+        'content': content,
+        'lines': count,
+        'partial': True,
+        'hasMore': has_more
+    })
+    return result
@@ -0,0 +1,61 @@
+"""gunicorn 配置（在 backend 目录下运行）
+
+    pip install -r requirements.txt
+    gunicorn -c gunicorn.conf.py
+
+多个工作进程共享同一个 SQLite（WAL）数据库：项目、对话、全文索引与 Claude CLI 会话都保存在其中；
+回复缓存默认改用磁盘层，以便各进程共享；对话调度器的全局上限按工作进程数平分，单个项目的上限跨进程共享。
+默认（BMAD_SERVER_MODE=asgi）使用 uvicorn 工作进程加载 asgi:app：聊天接口在事件循环中处理，
+进行中的对话（含 SSE 长连接）不占用线程，其余接口在每个进程的 threads 个线程中运行。
+BMAD_SERVER_MODE=wsgi 时使用 gthread 工作进程加载 wsgi:app，每个进行中的对话在整轮期间占用一个线程，
+同时进行的对话数最多为 workers × threads。
+各进程启动后先执行健康检查（health.py），失败时进程以启动错误退出，gunicorn 随之停止。
+部署时先运行 python -m agents.bundle 生成预编译角色包，缩短工作进程的启动时间。
+"""
+import importlib
+import os
+import threading
+
+# 须在导入 config 之前设置：工作进程从主进程 fork，会沿用主进程已加载的配置
+os.environ.setdefault('BMAD_RESPONSE_CACHE_DISK', '1')
+
+from config import SERVER_MODE, SERVER_BIND, SERVER_WORKERS, SERVER_THREADS  # noqa: E402
+
+bind = SERVER_BIND
+workers = SERVER_WORKERS
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'asgi:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'wsgi:app'
+    worker_class = 'gthread'
+threads = SERVER_THREADS
+# 应用在各工作进程中分别加载：上游事件循环、线程池与数据库连接不跨 fork 共享
+preload_app = False
+# 两种工作进程的心跳都不受长请求影响，timeout 只用于发现卡死的进程
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    from health import run_checks
+
+    healthy, checks = run_checks()
+    if not healthy:
+        failed = {name: check['error'] for name, check in checks.items() if check['status'] != 'ok'}
+        raise RuntimeError(f"健康检查失败: {failed}")
+    # 每个工作进程各有一个调度器，全局并发与排队上限按工作进程数平分，单个项目的上限跨进程共享
+    from scheduler import scheduler
+
+    for name, (actual, configured) in scheduler.share(workers).items():
+        worker.log.warning("调度器 %s 配置为 %s，按 %s 个工作进程平分后实际总数为 %s",
+                           name, configured, workers, actual)
+    if SERVER_MODE != 'asgi' and scheduler.max_active >= threads:
+        worker.log.warning("调度器上限 %s 不小于线程数 %s：对话占满线程后其他请求将无法处理",
+                           scheduler.max_active, threads)
+    worker.log.info("Worker %s ready: %s (scheduler max_active=%s, project_max_active=%s)", worker.pid,
+                    ', '.join(checks), scheduler.max_active, scheduler.project_max_active)
+    # anthropic 在首次调用上游时才导入；在后台提前导入，第一个对话请求不必等待
+    threading.Thread(target=importlib.import_module, args=('anthropic',), name='warmup', daemon=True).start()
@@ -0,0 +1,48 @@
+import os
+import time
+from agents.loader import registry as agent_registry
+from store import store, SCHEMA_VERSION
+from config import DATA_DIR
+
+
+def check_database():
+    """数据库可读写且表结构为当前版本"""
+    conn = store.connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version != SCHEMA_VERSION:
+        raise RuntimeError(f"数据库版本为 {version}，应为 {SCHEMA_VERSION}")
+    if conn.execute('PRAGMA journal_mode').fetchone()[0].lower() != 'wal':
+        raise RuntimeError("数据库未处于 WAL 模式，多进程部署需要 WAL")
+    if not os.access(DATA_DIR, os.W_OK):
+        raise RuntimeError(f"数据目录不可写: {DATA_DIR}")
+    return {'path': store.db_path, 'schemaVersion': version}
+
+
+def check_agents():
+    """角色目录存在且至少能加载一个角色"""
+    agents = agent_registry.all()
+    if not agents:
+        raise RuntimeError(f"未从 {agent_registry.agents_path} 加载到角色")
+    return {'count': len(agents)}
+
+
+CHECKS = {
+    'database': check_database,
+    'agents': check_agents,
+}
+
+
+def run_checks():
+    """执行所有检查，返回 (是否全部通过, 各项结果)"""
+    results = {}
+    healthy = True
+    for name, check in CHECKS.items():
+        started = time.perf_counter()
+        try:
+            result = {'status': 'ok', **check()}
+        except Exception as e:
+            result = {'status': 'error', 'error': str(e)}
+            healthy = False
+        result['durationMs'] = round((time.perf_counter() - started) * 1000, 1)
+        results[name] = result
+    return healthy, results
@@ -0,0 +1,217 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# 延迟类指标的默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name + _format_labels(self.labelnames, key), value
+
+
+class Gauge:
+    """取值时调用回调函数的指标，回调返回 {标签值元组: 数值}"""
+    type = 'gauge'
+
+    def __init__(self, name, help, callback, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Error collecting {self.name}: {e}")
+            return
+        for key, value in sorted(values.items()):
+            yield self.name + _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # 标签值元组 -> [各分桶计数, 总和, 总数]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield self.name + '_bucket' + _format_labels(self.labelnames, key, ('le', _format_value(bound))), \
+                    cumulative
+            yield self.name + '_sum' + _format_labels(self.labelnames, key), total
+            yield self.name + '_count' + _format_labels(self.labelnames, key), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, callback, labelnames=()):
+        return self.register(Gauge(name, help, callback, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        """Prometheus 文本格式（0.0.4）"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for sample, value in metric.samples():
+                lines.append(f"{sample} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'bmad_http_requests_total', 'HTTP 请求数', ('method', 'endpoint', 'status'))
+http_duration = registry.histogram(
+    'bmad_http_request_duration_seconds', 'HTTP 请求处理时间（流式接口只统计到开始输出）', ('method', 'endpoint'))
+span_duration = registry.histogram(
+    'bmad_span_duration_seconds', '热点路径各阶段耗时', ('span',))
+upstream_tokens = registry.counter(
+    'bmad_upstream_tokens_total', '上游模型消耗的 token 数', ('type',))
+chat_ttft = registry.histogram(
+    'bmad_chat_time_to_first_token_seconds', '流式聊天从收到请求到第一个文本增量的时间')
+tool_iterations = registry.histogram(
+    'bmad_chat_tool_iterations', '每轮对话的模型调用次数', buckets=(1, 2, 3, 4, 5, 6, 8, 10))
+tool_calls = registry.counter(
+    'bmad_tool_calls_total', '工具调用次数', ('tool', 'status'))
+tool_cache_lookups = registry.counter(
+    'bmad_tool_cache_lookups_total', '只读工具结果缓存：hit/miss 为缓存查询，dedup 为以引用代替已在上下文中的内容',
+    ('result',))
+response_cache_lookups = registry.counter(
+    'bmad_response_cache_lookups_total', '回复缓存查询次数', ('result',))
+cli_duration = registry.histogram(
+    'bmad_claude_cli_duration_seconds', 'Claude CLI 处理单条消息的时间', ('status',),
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300))
+scheduler_wait = registry.histogram(
+    'bmad_scheduler_wait_seconds', '对话请求在调度队列中的等待时间', ('priority',))
+scheduler_rejected = registry.counter(
+    'bmad_scheduler_rejected_total', '调度器拒绝的对话请求数', ('priority', 'reason'))
+
+
+# 当前请求的追踪记录：[(span, 秒)]
+_trace = contextvars.ContextVar('bmad_trace', default=None)
+
+
+def start_trace():
+    """开始记录当前请求（或任务）的 span，返回新的追踪记录"""
+    trace = []
+    _trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _trace.get()
+
+
+def use_trace(trace):
+    """在其他线程或事件循环任务中继续记录到同一个追踪记录"""
+    _trace.set(trace)
+
+
+@contextmanager
+def span(name):
+    """记录一段代码的耗时：写入 bmad_span_duration_seconds，并追加到当前请求的追踪记录"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        span_duration.observe(elapsed, span=name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((name, elapsed))
+
+
+def server_timing(trace):
+    """把追踪记录合并为 Server-Timing 头（同名 span 累加耗时并注明次数）"""
+    totals = {}
+    for name, elapsed in trace:
+        total, count = totals.get(name, (0.0, 0))
+        totals[name] = (total + elapsed, count + 1)
+    parts = []
+    for name, (total, count) in totals.items():
+        part = f"{name};dur={total * 1000:.1f}"
+        if count > 1:
+            part += f';desc="x{count}"'
+        parts.append(part)
+    return ", ".join(parts)
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    RESPONSE_CACHE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_DISK, RESPONSE_CACHE_DIR, RESPONSE_CACHE_DISK_MAX_BYTES
+)
+
+
+class ResponseCache:
+    """模型回复的精确匹配缓存
+
+    键为 (角色 id/版本, 模型, system, 消息列表含工具结果, 工具定义) 的哈希；
+    内存层按总字节数做 LRU 淘汰，条目超过 TTL 后失效；开启磁盘层时内存未命中会再查磁盘。
+    """
+
+    def __init__(self, enabled=RESPONSE_CACHE, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 disk_dir=RESPONSE_CACHE_DIR if RESPONSE_CACHE_DISK else None,
+                 disk_max_bytes=RESPONSE_CACHE_DISK_MAX_BYTES):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        # key -> (expires_at, data)
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._disk_puts = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(scope, params):
+        payload = json.dumps({
+            'scope': scope,
+            'model': params.get('model'),
+            'max_tokens': params.get('max_tokens'),
+            'system': params.get('system'),
+            'messages': params.get('messages'),
+            'tools': params.get('tools'),
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """命中时返回 Message，否则返回 None"""
+        from anthropic.types import Message
+
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if item[0] > now:
+                    self._items.move_to_end(key)
+                    return Message.model_validate_json(item[1])
+                self._remove(key)
+
+        data = self._disk_get(key, now)
+        if data is None:
+            return None
+        self._memory_put(key, data, now)
+        return Message.model_validate_json(data)
+
+    def put(self, key, message):
+        data = message.model_dump_json()
+        now = time.time()
+        self._memory_put(key, data, now)
+        self._disk_put(key, data)
+
+    def _memory_put(self, key, data, now):
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (now + self.ttl, data)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._items)))
+
+    def _remove(self, key):
+        _, data = self._items.pop(key)
+        self._bytes -= len(data)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + '.json')
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if os.stat(path).st_mtime + self.ttl <= now:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _disk_put(self, key, data):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing response cache: {e}")
+            return
+        with self._lock:
+            self._disk_puts += 1
+            prune = self._disk_puts % 100 == 1
+        if prune:
+            self.prune_disk()
+
+    def prune_disk(self):
+        """删除磁盘上过期的条目，总大小超限时从最旧的开始删除"""
+        if not self.disk_dir:
+            return
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_mtime + self.ttl <= now:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                else:
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,112 @@
+import gzip
+from flask.json.provider import DefaultJSONProvider
+from config import RESPONSE_COMPRESS_MIN_BYTES
+
+# 可选依赖：未安装时分别退回标准库 json 与 gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/plain', 'text/markdown', 'text/html', 'text/css',
+                      'application/javascript', 'text/javascript', 'application/x-ndjson')
+
+# 按优先顺序排列；压缩级别偏向速度，这些响应在每次请求时现压缩
+ENCODERS = {}
+if zstandard is not None:
+    _zstd = zstandard.ZstdCompressor(level=3)
+    ENCODERS['zstd'] = _zstd.compress
+if brotli is not None:
+    ENCODERS['br'] = lambda data: brotli.compress(data, quality=4)
+ENCODERS['gzip'] = lambda data: gzip.compress(data, compresslevel=5)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """安装了 orjson 时用它序列化 JSON 响应，并直接输出 UTF-8（不转义中文）"""
+
+    ensure_ascii = False
+    sort_keys = False
+
+    def _options(self, indent):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._options(kwargs.get('indent'))).decode('utf-8')
+        except TypeError:
+            # orjson 不支持的值（如超过 64 位的整数）交给标准库
+            return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        try:
+            data = orjson.dumps(obj, default=self.default,
+                                option=self._options(indent) | orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+
+def negotiate_encoding(accept_encoding):
+    """按 Accept-Encoding 的 q 值选择压缩算法，q 相同时按 ENCODERS 的顺序；都不可接受时返回 None"""
+    weights = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in ENCODERS:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress_response(response, accept_encoding, min_size=RESPONSE_COMPRESS_MIN_BYTES):
+    """压缩足够大的文本/JSON 响应；流式响应、send_file 与分段响应保持原样"""
+    if (min_size <= 0 or response.direct_passthrough or response.is_streamed
+            or response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding is None:
+        return response
+
+    response.set_data(ENCODERS[encoding](data))
+    response.headers['Content-Encoding'] = encoding
+    # 同一内容的不同编码共用 ETag，按 RFC 9110 改为弱校验器（If-None-Match 使用弱比较）
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response.headers['ETag'] = 'W/' + etag
+    return response
@@ -0,0 +1,262 @@
+import hashlib
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from config import (
+    SCHEDULER_MAX_ACTIVE, SCHEDULER_PROJECT_MAX_ACTIVE, SCHEDULER_MAX_QUEUE, SCHEDULER_PROJECT_MAX_QUEUE,
+    SCHEDULER_QUEUE_TIMEOUT, SCHEDULER_WEIGHTS, SCHEDULER_LEASE_DIR, SCHEDULER_LEASE_RETRY
+)
+from metrics import scheduler_wait, scheduler_rejected
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 flock，单项目上限只在进程内生效
+    fcntl = None
+
+
+class SchedulerBusyError(Exception):
+    """排队已满或等待超时"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ProjectLeases:
+    """跨进程的单项目名额
+
+    每个项目有 limit 个锁文件，对其中一个加上 flock 即占用一个名额；各进程（以及同一进程内的不同请求）
+    竞争同一组锁文件，因此整个服务中同一项目同时处理的对话数不超过 limit。
+    进程退出时内核自动释放 flock，名额不会因进程崩溃而泄漏。
+    """
+
+    def __init__(self, directory=SCHEDULER_LEASE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def acquire(self, project, limit):
+        """占用项目的一个名额，返回持有锁的文件描述符；名额已满时返回 None"""
+        name = hashlib.sha1(str(project).encode('utf-8')).hexdigest()[:16]
+        for slot in range(limit):
+            fd = os.open(os.path.join(self.directory, f"{name}-{slot}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def release(self, fd):
+        os.close(fd)
+
+
+class Ticket:
+    __slots__ = ('project', 'priority', 'tag', 'seq', 'enqueued', 'started', 'released', 'lease')
+
+    def __init__(self, project, priority, tag, seq):
+        self.project = project
+        self.priority = priority
+        self.tag = tag
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.started = None
+        self.released = False
+        self.lease = None
+
+
+class TurnScheduler:
+    """对话请求的准入控制与加权公平排队
+
+    同时处理的对话数受全局上限与单个项目上限限制，超出的请求排队。
+    排队按起始时间公平排队（SFQ）：每个请求的标签为 max(虚拟时间, 本项目同优先级上一个请求的标签) + 1/权重，
+    名额空出时放行项目未达上限的请求中标签最小的一个。因此各项目轮流获得名额，
+    同一项目的大批请求不会挡住其他项目；interactive 与 batch 各自计算标签且权重更高，
+    新到的 interactive 请求不会排在本项目已积压的 batch 请求之后。
+
+    gunicorn 的每个工作进程各有一个调度器，启动时用 share() 按工作进程数平分全局上限与排队数；
+    单个项目的上限由 ProjectLeases 在各进程间共同遵守：放行前还要取得该项目的一个跨进程名额，
+    名额被其他进程占满时该项目暂时跳过（其他项目照常放行），每隔 SCHEDULER_LEASE_RETRY 秒重试。
+    """
+
+    def __init__(self, max_active=SCHEDULER_MAX_ACTIVE, project_max_active=SCHEDULER_PROJECT_MAX_ACTIVE,
+                 max_queue=SCHEDULER_MAX_QUEUE, project_max_queue=SCHEDULER_PROJECT_MAX_QUEUE,
+                 queue_timeout=SCHEDULER_QUEUE_TIMEOUT, weights=SCHEDULER_WEIGHTS,
+                 leases=ProjectLeases() if fcntl else None):
+        self.max_active = max_active
+        self.project_max_active = project_max_active
+        self.max_queue = max_queue
+        self.project_max_queue = project_max_queue
+        self.queue_timeout = queue_timeout
+        self.weights = weights
+        self.leases = leases
+        self._cond = threading.Condition()
+        self._queue = []
+        self._active = {}
+        self._queued = {}
+        self._last_tag = {}
+        # 跨进程名额已满的项目 -> 重试时刻
+        self._blocked = {}
+        self._vtime = 0.0
+        self._seq = itertools.count()
+        # 对话耗时的滑动平均（秒），用于估算 Retry-After
+        self._service_time = 10.0
+        self._counters = {'admitted': 0, 'rejected': 0, 'timedOut': 0}
+
+    def share(self, processes):
+        """多个进程各运行一个调度器时，把上限按进程数平分（向上取整，至少为 1）
+
+        单个项目的上限由跨进程名额保证，不平分；没有跨进程名额（Windows）时同样平分。
+        返回平分后被向上取整放大的并发上限 {名称: (实际总数, 配置值)}，供调用方提示（排队数的放大不计）。
+        """
+        names = ['max_active', 'max_queue', 'project_max_queue']
+        if self.leases is None:
+            names.append('project_max_active')
+        processes = max(processes, 1)
+        inflated = {}
+        with self._cond:
+            for name in names:
+                configured = getattr(self, name)
+                shared = max(1, math.ceil(configured / processes))
+                setattr(self, name, shared)
+                if name.endswith('max_active') and shared * processes > configured:
+                    inflated[name] = (shared * processes, configured)
+        return inflated
+
+    def priority(self, value):
+        """规范化优先级，未知的值按 interactive 处理"""
+        return value if value in self.weights else 'interactive'
+
+    def acquire(self, project, priority='interactive'):
+        """排队等待名额，返回 Ticket；排队已满或超时抛出 SchedulerBusyError"""
+        priority = self.priority(priority)
+        with self._cond:
+            if len(self._queue) >= self.max_queue or self._queued.get(project, 0) >= self.project_max_queue:
+                return self._reject(priority, 'queue_full')
+
+            chain = (project, priority)
+            tag = max(self._vtime, self._last_tag.get(chain, 0.0)) + 1 / self.weights[priority]
+            ticket = Ticket(project, priority, tag, next(self._seq))
+            self._last_tag[chain] = tag
+            self._queue.append(ticket)
+            self._queued[project] = self._queued.get(project, 0) + 1
+
+            deadline = ticket.enqueued + self.queue_timeout
+            while not (self._next() is ticket and self._lease(ticket)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._dequeue(ticket)
+                    self._counters['timedOut'] += 1
+                    # 自己离开队列后，排在后面的请求可能可以放行
+                    self._cond.notify_all()
+                    return self._reject(priority, 'timeout')
+                # 其他进程释放名额时不会通知本进程，被跨进程名额挡住的项目按间隔重试
+                self._cond.wait(min(remaining, SCHEDULER_LEASE_RETRY) if project in self._blocked else remaining)
+
+            self._dequeue(ticket)
+            self._vtime = max(self._vtime, ticket.tag)
+            self._active[project] = self._active.get(project, 0) + 1
+            ticket.started = time.monotonic()
+            self._counters['admitted'] += 1
+            # 可能还有其他项目的请求可以同时放行
+            self._cond.notify_all()
+
+        scheduler_wait.observe(ticket.started - ticket.enqueued, priority=priority)
+        return ticket
+
+    def release(self, ticket):
+        """归还名额（可重复调用）"""
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            project = ticket.project
+            if ticket.lease is not None:
+                self.leases.release(ticket.lease)
+                self._blocked.pop(project, None)
+            self._active[project] -= 1
+            if not self._active[project]:
+                del self._active[project]
+                if not self._queued.get(project):
+                    self._forget(project)
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - ticket.started)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, project, priority='interactive'):
+        ticket = self.acquire(project, priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def _next(self):
+        """下一个可以放行的请求（调用方需持有 _cond）"""
+        if sum(self._active.values()) >= self.max_active:
+            return None
+        now = time.monotonic()
+        candidates = [t for t in self._queue if self._active.get(t.project, 0) < self.project_max_active
+                      and self._blocked.get(t.project, 0) <= now]
+        return min(candidates, key=lambda t: (t.tag, t.seq), default=None)
+
+    def _lease(self, ticket):
+        """取得项目的跨进程名额；已满时暂时跳过该项目并返回 False（调用方需持有 _cond）"""
+        if self.leases is None:
+            return True
+        ticket.lease = self.leases.acquire(ticket.project, self.project_max_active)
+        if ticket.lease is not None:
+            self._blocked.pop(ticket.project, None)
+            return True
+        self._blocked[ticket.project] = time.monotonic() + SCHEDULER_LEASE_RETRY
+        # 让排在后面的其他项目的请求先放行
+        self._cond.notify_all()
+        return False
+
+    def _dequeue(self, ticket):
+        self._queue.remove(ticket)
+        self._queued[ticket.project] -= 1
+        if not self._queued[ticket.project]:
+            del self._queued[ticket.project]
+            if not self._active.get(ticket.project):
+                self._forget(ticket.project)
+
+    def _forget(self, project):
+        """项目既无处理中也无排队的请求时丢弃其标签"""
+        self._blocked.pop(project, None)
+        for priority in self.weights:
+            self._last_tag.pop((project, priority), None)
+
+    def _reject(self, priority, reason):
+        self._counters['rejected'] += 1
+        scheduler_rejected.inc(priority=priority, reason=reason)
+        raise SchedulerBusyError("当前对话请求过多，请稍后重试", self.retry_after())
+
+    def retry_after(self):
+        """按排队长度与平均对话耗时估算的等待秒数"""
+        waves = (len(self._queue) + 1) / max(self.max_active, 1)
+        return max(1, min(60, math.ceil(waves * self._service_time)))
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            by_priority = {priority: 0 for priority in self.weights}
+            for ticket in self._queue:
+                by_priority[ticket.priority] += 1
+            return {
+                'active': sum(self._active.values()),
+                'queued': len(self._queue),
+                'queuedByPriority': by_priority,
+                'oldestWaitSeconds': round(max((now - t.enqueued for t in self._queue), default=0.0), 3),
+                'projects': {
+                    project: {'active': self._active.get(project, 0), 'queued': self._queued.get(project, 0)}
+                    for project in set(self._active) | set(self._queued)
+                },
+                'maxActive': self.max_active,
+                'projectMaxActive': self.project_max_active,
+                **self._counters
+            }
+
+
+scheduler = TurnScheduler()
@@ -0,0 +1,316 @@
+import os
+import sqlite3
+import threading
+import time
+from config import (
+    SEARCH_REINDEX_INTERVAL, SEARCH_MAX_FILE_SIZE, SEARCH_MAX_FILES, SEARCH_MAX_HITS_PER_FILE,
+    SEARCH_INDEX_BATCH_FILES, SEARCH_INDEX_BATCH_BYTES
+)
+from file_index import IgnoreRules
+from store import store
+
+SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    UNIQUE (root, path)
+);
+CREATE TABLE IF NOT EXISTS search_lines (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_id INTEGER NOT NULL REFERENCES search_files(id) ON DELETE CASCADE,
+    line INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_search_lines_file ON search_lines(file_id);
+"""
+
+# trigram 分词同时适用于中文与英文；不足 3 个字符的搜索词退回 LIKE 匹配
+# （需要 SQLite 3.34+ 且启用 FTS5，否则整个搜索退回 LIKE 匹配）
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS search_lines_fts USING fts5(
+    text, content='search_lines', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS search_lines_ai AFTER INSERT ON search_lines BEGIN
+    INSERT INTO search_lines_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS search_lines_ad AFTER DELETE ON search_lines BEGIN
+    INSERT INTO search_lines_fts (search_lines_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+# 不支持 FTS5 时删除触发器，否则写入文件行与消息时会因找不到 fts5 模块而失败
+DROP_FTS_TRIGGERS = """
+DROP TRIGGER IF EXISTS search_lines_ai;
+DROP TRIGGER IF EXISTS search_lines_ad;
+DROP TRIGGER IF EXISTS messages_fts_ai;
+DROP TRIGGER IF EXISTS messages_fts_ad;
+"""
+
+# 单行匹配结果的最大长度（字符）
+MAX_LINE_LENGTH = 300
+
+
+def parse_query(query):
+    """拆分搜索词，返回 (FTS MATCH 表达式或 None, 需要 LIKE 匹配的短词列表)"""
+    terms = [t for t in query.split() if t]
+    long_terms = [t for t in terms if len(t) >= 3]
+    short_terms = [t for t in terms if len(t) < 3]
+    match = ' AND '.join('"' + t.replace('"', '""') + '"' for t in long_terms) or None
+    return match, short_terms
+
+
+def _like(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _clip(text, limit=MAX_LINE_LENGTH):
+    text = text.strip()
+    return text if len(text) <= limit else text[:limit] + '…'
+
+
+class SearchIndex:
+    """项目文件与对话历史的全文索引（SQLite FTS5）
+
+    文件按行建索引，搜索前按 mtime/size 只重新索引变化的文件（同一项目至多每
+    SEARCH_REINDEX_INTERVAL 秒检查一次）；对话消息由触发器在写入时同步索引。
+    SQLite 不支持 FTS5 trigram 分词时 fts 为 False，搜索全部使用 LIKE 匹配。
+    """
+
+    def __init__(self, store=store):
+        self.store = store
+        self._locks = {}
+        self._checked_at = {}
+        self._guard = threading.Lock()
+        self._init_schema()
+
+    def _init_schema(self):
+        conn = self.store.connection()
+        conn.executescript(SEARCH_SCHEMA)
+        try:
+            conn.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            print(f"SQLite 不支持 FTS5 trigram 分词（{e}），搜索退回 LIKE 匹配")
+            self.fts = False
+            conn.executescript(DROP_FTS_TRIGGERS)
+            # 不支持期间写入的行没有进入 fts 表，之后重新支持时需要重建
+            self.store.delete_meta('messages_fts_built')
+            return
+
+        self.fts = True
+        with conn:
+            # 索引建立之前（或不支持 FTS5 期间）已有的数据需要补建一次
+            if not self.store.get_meta('messages_fts_built'):
+                conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+                conn.execute("INSERT INTO search_lines_fts (search_lines_fts) VALUES ('rebuild')")
+                self.store.set_meta(conn, 'messages_fts_built', '1')
+
+    def _lock_for(self, root):
+        with self._guard:
+            return self._locks.setdefault(root, threading.Lock())
+
+    def invalidate(self, path):
+        """文件被工具修改后，下次搜索时立即重新检查所在项目"""
+        path = os.path.abspath(path)
+        for root in list(self._checked_at):
+            if path == root or path.startswith(root + os.sep):
+                self._checked_at.pop(root, None)
+
+    def refresh(self, root, force=False):
+        """按 mtime/size 增量更新项目文件索引，返回 {'indexed', 'removed', 'files'}"""
+        root = os.path.abspath(root)
+        checked_at = self._checked_at.get(root)
+        if not force and checked_at is not None and time.monotonic() - checked_at < SEARCH_REINDEX_INTERVAL:
+            return None
+        with self._lock_for(root):
+            checked_at = self._checked_at.get(root)
+            if not force and checked_at is not None and time.monotonic() - checked_at < SEARCH_REINDEX_INTERVAL:
+                return None
+            stats = self._reindex(root)
+            self._checked_at[root] = time.monotonic()
+            return stats
+
+    def _scan(self, root):
+        """遍历项目文件（应用与文件树相同的忽略规则），返回 {path: stat}"""
+        ignore = IgnoreRules(root)
+        ignore.reload_if_changed()
+        found = {}
+        stack = [root]
+        while stack and len(found) < SEARCH_MAX_FILES:
+            path = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if ignore.is_ignored(entry.path, entry.name, is_dir):
+                        continue
+                    if is_dir:
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        if stat.st_size <= SEARCH_MAX_FILE_SIZE:
+                            found[entry.path] = stat
+                except OSError:
+                    continue
+        return found
+
+    def _reindex(self, root):
+        """增量重新索引：文件在事务之外读取，按批提交，避免长时间占用数据库写锁"""
+        found = self._scan(root)
+        conn = self.store.connection()
+        known = {
+            row['path']: row
+            for row in conn.execute('SELECT id, path, mtime_ns, size FROM search_files WHERE root = ?', (root,))
+        }
+
+        stale = [row['id'] for path, row in known.items() if path not in found]
+        for start in range(0, len(stale), SEARCH_INDEX_BATCH_FILES):
+            with conn:
+                conn.executemany('DELETE FROM search_files WHERE id = ?',
+                                 [(file_id,) for file_id in stale[start:start + SEARCH_INDEX_BATCH_FILES]])
+
+        changed = [
+            (path, stat) for path, stat in found.items()
+            if path not in known or known[path]['mtime_ns'] != stat.st_mtime_ns or known[path]['size'] != stat.st_size
+        ]
+        batch, size = [], 0
+        for path, stat in changed:
+            batch.append((path, stat, self._read_lines(path)))
+            size += stat.st_size
+            if len(batch) >= SEARCH_INDEX_BATCH_FILES or size >= SEARCH_INDEX_BATCH_BYTES:
+                self._write_batch(conn, root, batch)
+                batch, size = [], 0
+        if batch:
+            self._write_batch(conn, root, batch)
+        return {'indexed': len(changed), 'removed': len(stale), 'files': len(found)}
+
+    def _write_batch(self, conn, root, batch):
+        """在一个事务中写入一批已读取的文件 [(path, stat, lines)]"""
+        with conn:
+            for path, stat, lines in batch:
+                # 在事务内查询文件记录：其他进程可能已在两批之间写入同一文件
+                row = conn.execute('SELECT id FROM search_files WHERE root = ? AND path = ?',
+                                   (root, path)).fetchone()
+                if row is not None:
+                    conn.execute('DELETE FROM search_lines WHERE file_id = ?', (row['id'],))
+                    conn.execute('UPDATE search_files SET mtime_ns = ?, size = ? WHERE id = ?',
+                                 (stat.st_mtime_ns, stat.st_size, row['id']))
+                    file_id = row['id']
+                else:
+                    file_id = conn.execute(
+                        'INSERT INTO search_files (root, path, mtime_ns, size) VALUES (?, ?, ?, ?)',
+                        (root, path, stat.st_mtime_ns, stat.st_size)
+                    ).lastrowid
+                conn.executemany(
+                    'INSERT INTO search_lines (file_id, line, text) VALUES (?, ?, ?)',
+                    [(file_id, number, text) for number, text in lines]
+                )
+
+    @staticmethod
+    def _read_lines(path):
+        """读取文本文件的非空行 [(行号, 内容)]；二进制或非 UTF-8 文件返回空列表"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return []
+        if b'\0' in data[:8192]:
+            return []
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            return []
+        # 与 file_reader 一样只按 \n 分行，行号与按行读取文件时一致
+        return [(number, line.rstrip('\r')) for number, line in enumerate(text.split('\n'), 1) if line.strip()]
+
+    def _parse(self, query):
+        """不支持 FTS5 时所有搜索词都用 LIKE 匹配"""
+        if self.fts:
+            return parse_query(query)
+        return None, [t for t in query.split() if t]
+
+    def search_files(self, root, query, path=None, limit=20):
+        """在项目文件中搜索，返回按相关度排序的匹配行 [{path, line, text}]"""
+        root = os.path.abspath(root)
+        self.refresh(root)
+        match, short_terms = self._parse(query)
+        if not match and not short_terms:
+            return []
+
+        if match:
+            sql = ['SELECT f.path, l.line, l.text FROM search_lines_fts',
+                   'JOIN search_lines l ON l.id = search_lines_fts.rowid']
+        else:
+            sql = ['SELECT f.path, l.line, l.text FROM search_lines l']
+        sql += ['JOIN search_files f ON f.id = l.file_id', 'WHERE f.root = ?']
+        params = [root]
+        if match:
+            sql.append('AND search_lines_fts MATCH ?')
+            params.append(match)
+        for term in short_terms:
+            sql.append("AND l.text LIKE ? ESCAPE '\\'")
+            params.append(_like(term))
+        if path:
+            prefix = os.path.abspath(path).rstrip(os.sep) + os.sep
+            sql.append("AND f.path LIKE ? ESCAPE '\\'")
+            params.append(_like(prefix)[1:])
+        sql.append('ORDER BY rank' if match else 'ORDER BY f.path, l.line')
+        # 多取一些，以便限制每个文件的结果数
+        sql.append('LIMIT ?')
+        params.append(limit * SEARCH_MAX_HITS_PER_FILE)
+
+        hits, per_file = [], {}
+        for row in self.store.connection().execute(' '.join(sql), params):
+            count = per_file.get(row['path'], 0)
+            if count >= SEARCH_MAX_HITS_PER_FILE:
+                continue
+            per_file[row['path']] = count + 1
+            hits.append({'path': row['path'], 'line': row['line'], 'text': _clip(row['text'])})
+            if len(hits) >= limit:
+                break
+        return hits
+
+    def search_conversations(self, project_id, query, limit=20):
+        """在项目对话历史中搜索，返回 [{id, role, snippet, createdAt}]"""
+        match, short_terms = self._parse(query)
+        if not match and not short_terms:
+            return []
+
+        if match:
+            sql = ["SELECT m.id, m.role, m.created_at,",
+                   "snippet(messages_fts, 0, '**', '**', '…', 48) AS snippet",
+                   "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid",
+                   "WHERE messages_fts MATCH ? AND m.project_id = ?"]
+            params = [match, project_id]
+        else:
+            sql = ["SELECT m.id, m.role, m.created_at, substr(m.content, 1, 200) AS snippet",
+                   "FROM messages m WHERE m.project_id = ?"]
+            params = [project_id]
+        for term in short_terms:
+            sql.append("AND m.content LIKE ? ESCAPE '\\'")
+            params.append(_like(term))
+        sql.append('ORDER BY rank LIMIT ?' if match else 'ORDER BY m.id DESC LIMIT ?')
+        params.append(limit)
+
+        return [
+            {'id': row['id'], 'role': row['role'], 'snippet': row['snippet'], 'createdAt': row['created_at']}
+            for row in self.store.connection().execute(' '.join(sql), params)
+        ]
+
+
+search_index = SearchIndex()
@@ -1,56 +1,354 @@
 import json
 import os
+import sqlite3
+import sys
+import threading
+import time
 import uuid
-from config import PROJECTS_FILE
+from config import PROJECTS_FILE, DATABASE_FILE
+from metrics import span
+
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project_id TEXT NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_project ON messages(project_id, id);
+CREATE TABLE IF NOT EXISTS digests (
+    project_id TEXT PRIMARY KEY REFERENCES projects(id) ON DELETE CASCADE,
+    upto_id INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS claude_sessions (
+    session_id TEXT NOT NULL,
+    working_dir TEXT NOT NULL,
+    cli_session_id TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (session_id, working_dir)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+PROJECT_SUMMARY_SQL = """
+SELECT p.id, p.name, p.path, COUNT(m.id) AS message_count, MAX(m.created_at) AS last_activity
+FROM projects p LEFT JOIN messages m ON m.project_id = p.id
+"""
+
 
 class Store:
-    def __init__(self):
-        self.projects = []
-        self.load()
+    """基于 SQLite（WAL 模式）的项目与对话存储"""
+
+    def __init__(self, db_path=DATABASE_FILE, json_path=PROJECTS_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        # fork 出的子进程（多进程部署）不能沿用父进程的连接
+        os.register_at_fork(after_in_child=self._reset_connections)
+        self._init_schema()
+        # 首次启动时从旧的 projects.json 迁移数据
+        if not self.get_meta('json_migrated'):
+            self.migrate_from_json(json_path)
+
+    def _conn(self):
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    def _reset_connections(self):
+        self._local = threading.local()
+
+    def connection(self):
+        """当前线程的数据库连接（供使用同一数据库的其他模块使用）"""
+        return self._conn()
+
+    def _init_schema(self):
+        conn = self._conn()
+        with conn:
+            conn.executescript(SCHEMA)
+            conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
 
-    def load(self):
-        if os.path.exists(PROJECTS_FILE):
-            with open(PROJECTS_FILE, 'r', encoding='utf-8') as f:
-                self.projects = json.load(f)
-        else:
-            self.projects = []
+    def get_meta(self, key):
+        row = self._conn().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
 
-    def save(self):
-        with open(PROJECTS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(self.projects, f, ensure_ascii=False, indent=2)
+    def set_meta(self, conn, key, value):
+        conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def migrate_from_json(self, json_path):
+        """一次性导入 projects.json，已存在的项目会被跳过；返回导入的项目数"""
+        imported = 0
+        conn = self._conn()
+        with conn:
+            if os.path.exists(json_path):
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    projects = json.load(f)
+                now = time.time()
+                for p in projects:
+                    cursor = conn.execute(
+                        'INSERT OR IGNORE INTO projects (id, name, path, created_at) VALUES (?, ?, ?, ?)',
+                        (p['id'], p.get('name', ''), p.get('path', ''), now)
+                    )
+                    if cursor.rowcount == 0:
+                        continue
+                    conn.executemany(
+                        'INSERT INTO messages (project_id, role, content, created_at) VALUES (?, ?, ?, ?)',
+                        [(p['id'], c.get('role', 'user'), _encode_content(c.get('content', '')), now)
+                         for c in p.get('conversations', [])]
+                    )
+                    imported += 1
+            self.set_meta(conn, 'json_migrated', json_path)
+        return imported
+
+    def _project_row_to_dict(self, row):
+        return {
+            'id': row['id'],
+            'name': row['name'],
+            'path': row['path'],
+            'messageCount': row['message_count'],
+            'lastActivity': row['last_activity'],
+        }
 
     def get_projects(self):
-        return self.projects
+        """获取项目摘要列表（不含对话内容）"""
+        rows = self._conn().execute(PROJECT_SUMMARY_SQL + ' GROUP BY p.id ORDER BY p.rowid')
+        return [self._project_row_to_dict(row) for row in rows]
 
     def get_project(self, project_id):
-        for p in self.projects:
-            if p['id'] == project_id:
-                return p
-        return None
+        """获取单个项目摘要（不含对话内容）"""
+        row = self._conn().execute(
+            PROJECT_SUMMARY_SQL + ' WHERE p.id = ? GROUP BY p.id', (project_id,)
+        ).fetchone()
+        return self._project_row_to_dict(row) if row else None
 
     def create_project(self, name, path):
         project = {
             'id': str(uuid.uuid4()),
             'name': name,
             'path': path,
-            'conversations': []
+            'messageCount': 0,
+            'lastActivity': None
         }
-        self.projects.append(project)
-        self.save()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                'INSERT INTO projects (id, name, path, created_at) VALUES (?, ?, ?, ?)',
+                (project['id'], name, path, time.time())
+            )
         return project
 
     def delete_project(self, project_id):
-        self.projects = [p for p in self.projects if p['id'] != project_id]
-        self.save()
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM projects WHERE id = ?', (project_id,))
 
     def add_conversation(self, project_id, conversation):
-        project = self.get_project(project_id)
-        if project:
-            project['conversations'].append(conversation)
-            self.save()
+        """追加一条对话消息（仅插入一行）"""
+        conn = self._conn()
+        with span('store_write'), conn:
+            conn.execute(
+                'INSERT INTO messages (project_id, role, content, created_at) '
+                'SELECT id, ?, ?, ? FROM projects WHERE id = ?',
+                (conversation.get('role', 'user'), _encode_content(conversation.get('content', '')),
+                 time.time(), project_id)
+            )
+
+    def add_conversations(self, rows, meta=None):
+        """在一个事务中批量追加消息，rows 为 (project_id, role, content, created_at)
+
+        meta 中的键值在同一事务中写入，用于记录写入进度。
+        """
+        conn = self._conn()
+        with span('store_write'), conn:
+            conn.executemany(
+                'INSERT INTO messages (project_id, role, content, created_at) '
+                'SELECT id, ?, ?, ? FROM projects WHERE id = ?',
+                [(role, _encode_content(content), created_at, project_id)
+                 for project_id, role, content, created_at in rows]
+            )
+            for key, value in (meta or {}).items():
+                self.set_meta(conn, key, value)
+
+    def delete_meta(self, key):
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM meta WHERE key = ?', (key,))
+
+    def iter_projects(self, project_ids=None):
+        """按创建顺序遍历项目（含 created_at），可只取指定的项目"""
+        sql = 'SELECT id, name, path, created_at FROM projects'
+        params = []
+        if project_ids:
+            sql += f" WHERE id IN ({','.join('?' * len(project_ids))})"
+            params = list(project_ids)
+        for row in self._conn().execute(sql + ' ORDER BY rowid', params):
+            yield {'id': row['id'], 'name': row['name'], 'path': row['path'], 'createdAt': row['created_at']}
+
+    def iter_messages(self, project_id, since=None, until=None, batch=1000):
+        """按时间正序逐批遍历项目的消息，可按 created_at 区间 [since, until) 过滤"""
+        sql = 'SELECT id, role, content, created_at FROM messages WHERE project_id = ? AND id > ?'
+        params = []
+        if since is not None:
+            sql += ' AND created_at >= ?'
+            params.append(since)
+        if until is not None:
+            sql += ' AND created_at < ?'
+            params.append(until)
+        sql += ' ORDER BY id LIMIT ?'
+        after = 0
+        while True:
+            rows = self._conn().execute(sql, [project_id, after, *params, batch]).fetchall()
+            for row in rows:
+                yield {'id': row['id'], 'role': row['role'], 'content': row['content'], 'createdAt': row['created_at']}
+            if len(rows) < batch:
+                return
+            after = rows[-1]['id']
+
+    def import_batch(self, projects, rows, meta=None):
+        """在一个事务中导入一批项目（已存在的跳过）与消息，meta 记录导入进度"""
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO projects (id, name, path, created_at) VALUES (?, ?, ?, ?)',
+                [(p['id'], p.get('name', ''), p.get('path', ''), p.get('createdAt') or time.time()) for p in projects]
+            )
+            conn.executemany(
+                'INSERT INTO messages (project_id, role, content, created_at) '
+                'SELECT id, ?, ?, ? FROM projects WHERE id = ?',
+                [(role, _encode_content(content), created_at, project_id)
+                 for project_id, role, content, created_at in rows]
+            )
+            for key, value in (meta or {}).items():
+                self.set_meta(conn, key, value)
 
     def get_conversations(self, project_id):
-        project = self.get_project(project_id)
-        return project['conversations'] if project else []
+        rows = self._conn().execute(
+            'SELECT role, content FROM messages WHERE project_id = ? ORDER BY id',
+            (project_id,)
+        )
+        return [{'role': row['role'], 'content': row['content']} for row in rows]
+
+    def get_conversations_page(self, project_id, before=None, limit=50):
+        """按游标分页获取对话，从最新向更早翻页；返回的 items 按时间正序"""
+        sql = 'SELECT id, role, content, created_at FROM messages WHERE project_id = ?'
+        params = [project_id]
+        if before is not None:
+            sql += ' AND id < ?'
+            params.append(before)
+        sql += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self._conn().execute(sql, params).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+
+        return {
+            'items': [{
+                'id': row['id'],
+                'role': row['role'],
+                'content': row['content'],
+                'createdAt': row['created_at']
+            } for row in rows],
+            'nextCursor': str(rows[0]['id']) if has_more else None,
+            'hasMore': has_more
+        }
+
+    def iter_recent_messages(self, project_id, batch=50):
+        """从最新到最早逐批遍历对话消息"""
+        before = None
+        while True:
+            rows = self._conn().execute(
+                'SELECT id, role, content FROM messages WHERE project_id = ? AND id < ? '
+                'ORDER BY id DESC LIMIT ?',
+                (project_id, before if before is not None else sys.maxsize, batch)
+            ).fetchall()
+            for row in rows:
+                yield {'id': row['id'], 'role': row['role'], 'content': row['content']}
+            if len(rows) < batch:
+                return
+            before = rows[-1]['id']
+
+    def get_messages_range(self, project_id, after_id, upto_id):
+        """获取 (after_id, upto_id] 区间内的消息"""
+        rows = self._conn().execute(
+            'SELECT id, role, content FROM messages WHERE project_id = ? AND id > ? AND id <= ? ORDER BY id',
+            (project_id, after_id, upto_id)
+        )
+        return [{'id': row['id'], 'role': row['role'], 'content': row['content']} for row in rows]
+
+    def get_digest(self, project_id):
+        """获取项目早期对话的摘要，upto_id 为摘要覆盖的最后一条消息"""
+        row = self._conn().execute(
+            'SELECT upto_id, content FROM digests WHERE project_id = ?', (project_id,)
+        ).fetchone()
+        return {'upto_id': row['upto_id'], 'content': row['content']} if row else None
+
+    def set_digest(self, project_id, upto_id, content):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO digests (project_id, upto_id, content, created_at) VALUES (?, ?, ?, ?)',
+                (project_id, upto_id, content, time.time())
+            )
+
+    def get_claude_session(self, session_id, working_dir):
+        """获取会话对应的 Claude CLI 会话 ID（所有工作进程共享）"""
+        row = self._conn().execute(
+            'SELECT cli_session_id FROM claude_sessions WHERE session_id = ? AND working_dir = ?',
+            (session_id, working_dir or '')
+        ).fetchone()
+        return row['cli_session_id'] if row else None
+
+    def set_claude_session(self, session_id, working_dir, cli_session_id):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO claude_sessions (session_id, working_dir, cli_session_id, updated_at) '
+                'VALUES (?, ?, ?, ?)',
+                (session_id, working_dir or '', cli_session_id, time.time())
+            )
+
+    def delete_claude_sessions(self, session_id):
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM claude_sessions WHERE session_id = ?', (session_id,))
+
+
+def _encode_content(content):
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, ensure_ascii=False)
+
 
 store = Store()
+
+
+if __name__ == '__main__':
+    # 用法: python store.py migrate [projects.json 路径]
+    if len(sys.argv) >= 2 and sys.argv[1] == 'migrate':
+        json_path = sys.argv[2] if len(sys.argv) > 2 else PROJECTS_FILE
+        count = store.migrate_from_json(json_path)
+        print(f"已导入 {count} 个项目到 {store.db_path}")
+    else:
+        print("用法: python store.py migrate [projects.json 路径]")
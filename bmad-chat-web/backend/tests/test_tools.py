@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+import threading
+
+# 配置在导入时读取，须在导入后端模块之前设置
+os.environ.setdefault('BMAD_DATA_DIR', tempfile.mkdtemp(prefix='bmad-test-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import execute_tool  # noqa: E402
+
+
+def test_concurrent_edits_to_one_file_are_not_lost(tmp_path):
+    path = tmp_path / 'story.md'
+    lines = [f'line {i}' for i in range(16)]
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+    barrier = threading.Barrier(len(lines))
+    results = []
+
+    def edit(i):
+        barrier.wait()
+        results.append(execute_tool('edit_file', {
+            'file_path': str(path),
+            'edits': [{'old_string': f'line {i}\n', 'new_string': f'edited {i}\n'}]
+        }))
+
+    threads = [threading.Thread(target=edit, args=(i,)) for i in range(len(lines))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(result.get('success') for result in results), results
+    assert path.read_text(encoding='utf-8') == ''.join(f'edited {i}\n' for i in range(len(lines)))
@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from tools import execute_tool, read_entry, check_batch
+from config import TOOL_RESULT_MAX_CHARS, TOOL_RESULT_MAX_ITEMS, TOOL_CACHE_MAX_BYTES
+from metrics import tool_cache_lookups
+
+
+def cap_result(result, max_chars=TOOL_RESULT_MAX_CHARS):
+    """限制工具结果的大小：文件内容截断到整行并给出 nextOffset，列表只保留前 TOOL_RESULT_MAX_ITEMS 项"""
+    if not isinstance(result, dict):
+        return result
+    content = result.get('content')
+    if isinstance(content, str) and len(content) > max_chars:
+        cut = content.rfind('\n', 0, max_chars) + 1 or max_chars
+        lines = content.count('\n', 0, cut)
+        result = dict(result, content=content[:cut], truncated=True, hasMore=True, lines=lines,
+                      nextOffset=(result.get('offset') or 0) + lines)
+    for field in ('items', 'results'):
+        items = result.get(field)
+        if isinstance(items, list) and len(items) > TOOL_RESULT_MAX_ITEMS:
+            result = dict(result, truncated=True, totalItems=len(items))
+            result[field] = items[:TOOL_RESULT_MAX_ITEMS]
+    return result
+
+
+class ToolResultCache:
+    """只读工具结果的 LRU 缓存，按会话（项目）区分
+
+    键包含文件/目录的 mtime_ns 与大小，文件变化后旧条目自然失效；总大小按结果的内容长度估算。
+    """
+
+    def __init__(self, max_bytes=TOOL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # (conversation, fingerprint) -> (result, size)
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, result, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = (result, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old_size) = self._items.popitem(last=False)
+                self._bytes -= old_size
+
+    def turn(self, conversation):
+        return TurnTools(self, conversation)
+
+
+class TurnTools:
+    """一轮对话（一次 ChatEngine.run）内的工具执行
+
+    execute() 在工具线程中运行：只读工具先查缓存，所有结果都经过 cap_result。
+    dedupe() 在事件循环中按结果进入上下文的顺序调用：同一轮中已经完整返回过的文件内容
+    （同一文件、同一行范围且未修改）改为引用先前的 tool_use_id。
+    """
+
+    def __init__(self, cache, conversation):
+        self.cache = cache
+        self.conversation = conversation
+        # 文件指纹 -> 首次返回该内容的 tool_use_id
+        self._seen = {}
+
+    def execute(self, tool_name, tool_input, project_path=None):
+        if tool_name == 'read_file':
+            return self._read(tool_input.get('file_path'), tool_input.get('offset'), tool_input.get('limit'))
+        if tool_name == 'read_files':
+            files, error = check_batch(tool_input.get('files'))
+            if error:
+                return error
+            cap = max(TOOL_RESULT_MAX_CHARS // len(files), 4000)
+            return {'files': [self._read(item.get('file_path'), item.get('offset'), item.get('limit'), cap, True)
+                              for item in files]}
+        if tool_name == 'list_directory':
+            return self._list(tool_input.get('directory_path'), tool_input, project_path)
+        return cap_result(execute_tool(tool_name, tool_input, project_path))
+
+    def _read(self, file_path, offset=None, limit=None, max_chars=TOOL_RESULT_MAX_CHARS, entry=False):
+        try:
+            stat = os.stat(file_path)
+            fingerprint = ('file', os.path.realpath(file_path), stat.st_mtime_ns, stat.st_size,
+                           offset or 0, limit, max_chars, entry)
+        except (OSError, TypeError, ValueError):
+            fingerprint = None
+
+        def load():
+            if entry:
+                return read_entry(file_path, offset, limit)
+            return execute_tool('read_file', {'file_path': file_path, 'offset': offset, 'limit': limit})
+
+        result = self._cached(fingerprint, load, max_chars)
+        if fingerprint is not None and isinstance(result.get('content'), str):
+            # 同一未修改文件、同一起始行、同样长度的内容必然相同，与 limit 和截断上限无关
+            result['_fingerprint'] = fingerprint[:5] + (len(result['content']),)
+        if entry:
+            result['file_path'] = file_path
+        return result
+
+    def _list(self, dir_path, tool_input, project_path):
+        try:
+            fingerprint = ('dir', os.path.realpath(dir_path), os.stat(dir_path).st_mtime_ns)
+        except (OSError, TypeError, ValueError):
+            fingerprint = None
+        return self._cached(fingerprint, lambda: execute_tool('list_directory', tool_input, project_path))
+
+    def _cached(self, fingerprint, load, max_chars=TOOL_RESULT_MAX_CHARS):
+        """返回结果的副本，_fingerprint 字段供 dedupe() 判断内容是否已在上下文中"""
+        if fingerprint is None:
+            return cap_result(load(), max_chars)
+        key = (self.conversation, fingerprint)
+        result = self.cache.get(key)
+        if result is not None:
+            tool_cache_lookups.inc(result='hit')
+        else:
+            tool_cache_lookups.inc(result='miss')
+            result = cap_result(load(), max_chars)
+            if 'error' not in result:
+                self.cache.put(key, result, len(json.dumps(result, ensure_ascii=False)))
+        # 指纹只在本模块内部使用，不会发送给模型
+        return dict(result, _fingerprint=fingerprint)
+
+    def dedupe(self, tool_use_id, result):
+        """把本轮已在上下文中的相同内容替换为引用，并去掉内部字段"""
+        if not isinstance(result, dict):
+            return result
+        if isinstance(result.get('files'), list):
+            return dict(result, files=[self._dedupe_one(tool_use_id, item) for item in result['files']])
+        return self._dedupe_one(tool_use_id, result)
+
+    def _dedupe_one(self, tool_use_id, result):
+        if not isinstance(result, dict) or '_fingerprint' not in result:
+            return result
+        result = dict(result)
+        fingerprint = result.pop('_fingerprint')
+        if fingerprint is None or 'error' in result:
+            return result
+        first = self._seen.setdefault(fingerprint, tool_use_id)
+        if first == tool_use_id:
+            return result
+        tool_cache_lookups.inc(result='dedup')
+        reference = {
+            'unchanged': True,
+            'sameAs': first,
+            'message': f"内容未变化，与 tool_use_id={first} 的结果相同，请直接参考该结果"
+        }
+        if 'file_path' in result:
+            reference = {'file_path': result['file_path'], **reference}
+        return reference
+
+
+tool_cache = ToolResultCache()
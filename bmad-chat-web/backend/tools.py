@@ -0,0 +1,303 @@
+import os
+import file_index
+from file_reader import read_text
+from search_index import search_index
+from file_edit import PatchError, atomic_write, file_lock, read_for_edit, apply_replacements, apply_unified_diff
+from config import SEARCH_RESULT_LIMIT, SEARCH_MAX_RESULT_LIMIT, TOOL_MAX_BATCH_FILES
+
+# 定义工具列表
+TOOLS = [
+    {
+        "name": "write_file",
+        "description": "写入内容到指定文件。如果文件不存在则创建，如果文件已存在则覆盖内容。",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "file_path": {"type": "string", "description": "文件路径，例如: /Users/apple/project/test.md"},
+                "content": {"type": "string", "description": "要写入的文件内容"}
+            },
+            "required": ["file_path", "content"]
+        }
+    },
+    {
+        "name": "read_file",
+        "description": "读取指定文件的内容并返回。大文件会按行分段返回，hasMore 为 true 时可用 offset/limit 继续读取。",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "file_path": {"type": "string", "description": "文件路径，例如: /Users/apple/project/test.md"},
+                "offset": {"type": "integer", "description": "可选，从第几行开始读取（从 0 开始）"},
+                "limit": {"type": "integer", "description": "可选，最多读取的行数；大文件必须分段读取"}
+            },
+            "required": ["file_path"]
+        }
+    },
+    {
+        "name": "read_files",
+        "description": f"一次读取多个文件（最多 {TOOL_MAX_BATCH_FILES} 个），每个文件可指定行范围。需要查看多个文件时优先使用。",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "files": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "file_path": {"type": "string", "description": "文件路径"},
+                            "offset": {"type": "integer", "description": "可选，从第几行开始读取（从 0 开始）"},
+                            "limit": {"type": "integer", "description": "可选，最多读取的行数"}
+                        },
+                        "required": ["file_path"]
+                    }
+                }
+            },
+            "required": ["files"]
+        }
+    },
+    {
+        "name": "edit_file",
+        "description": "修改已有文件的一部分，不需要输出整个文件。edits 为一组查找替换"
+                       "（old_string 必须与文件内容完全一致且唯一，可设置 replace_all），"
+                       "或者用 patch 提供 unified diff；二者选一。全部修改成功后才会写入文件。",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "file_path": {"type": "string", "description": "文件路径"},
+                "edits": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "old_string": {"type": "string", "description": "要替换的原文"},
+                            "new_string": {"type": "string", "description": "替换后的内容"},
+                            "replace_all": {"type": "boolean", "description": "可选，替换所有出现的位置"}
+                        },
+                        "required": ["old_string", "new_string"]
+                    }
+                },
+                "patch": {"type": "string", "description": "unified diff 格式的补丁（包含 @@ 块）"}
+            },
+            "required": ["file_path"]
+        }
+    },
+    {
+        "name": "write_files",
+        "description": f"一次写入多个文件（最多 {TOOL_MAX_BATCH_FILES} 个），每个文件整体覆盖。只修改部分内容时请使用 edit_file。",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "files": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "file_path": {"type": "string", "description": "文件路径"},
+                            "content": {"type": "string", "description": "要写入的文件内容"}
+                        },
+                        "required": ["file_path", "content"]
+                    }
+                }
+            },
+            "required": ["files"]
+        }
+    },
+    {
+        "name": "list_directory",
+        "description": "列出指定目录下的所有文件和子目录。",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "directory_path": {"type": "string", "description": "目录路径"}
+            },
+            "required": ["directory_path"]
+        }
+    },
+    {
+        "name": "search_files",
+        "description": "在当前项目的文件中全文搜索，返回按相关度排序的匹配行（文件路径、行号与该行内容）。"
+                       "查找内容时优先使用，比逐个列目录、读文件更快；多个词之间为“与”关系。",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "搜索词，多个词用空格分隔"},
+                "path": {"type": "string", "description": "可选，只搜索该目录下的文件"},
+                "limit": {"type": "integer", "description": f"可选，最多返回的结果数（默认 {SEARCH_RESULT_LIMIT}）"}
+            },
+            "required": ["query"]
+        }
+    },
+    {
+        "name": "get_working_directory",
+        "description": "获取当前工作目录的路径。",
+        "input_schema": {
+            "type": "object",
+            "properties": {},
+            "required": []
+        }
+    }
+]
+
+# 会修改文件的工具：本轮调用过这些工具后不再使用回复缓存
+WRITE_TOOLS = {"write_file", "write_files", "edit_file"}
+
+
+def _write(file_path, content, newline=None):
+    """原子写入文件并通知文件树与搜索索引"""
+    with file_lock(file_path):
+        atomic_write(file_path, content, newline)
+    file_index.invalidate(file_path)
+    search_index.invalidate(file_path)
+
+
+def _read(file_path, offset=0, limit=None):
+    if not file_path or ".." in file_path:
+        return {"error": "无效的路径"}
+    if not os.path.exists(file_path):
+        return {"error": "文件不存在"}
+    if os.path.isdir(file_path):
+        return {"error": "不能读取目录"}
+    result = read_text(file_path, offset or 0, limit)
+    result.pop("etag")
+    return result
+
+
+def read_entry(file_path, offset=None, limit=None):
+    """read_files 中单个文件的结果，出错时只影响该文件"""
+    try:
+        result = _read(file_path, offset, limit)
+    except UnicodeDecodeError:
+        result = {"error": "无法读取二进制文件"}
+    except Exception as e:
+        result = {"error": str(e)}
+    return {"file_path": file_path, **result}
+
+
+def check_batch(files):
+    """校验批量工具的 files 参数，返回 (files, error)"""
+    if not isinstance(files, list) or not files:
+        return None, {"error": "files 不能为空"}
+    if len(files) > TOOL_MAX_BATCH_FILES:
+        return None, {"error": f"一次最多处理 {TOOL_MAX_BATCH_FILES} 个文件"}
+    return files, None
+
+
+def _edit(file_path, edits=None, patch=None):
+    if ".." in file_path:
+        return {"error": "无效的路径"}
+    if not os.path.isfile(file_path):
+        return {"error": "文件不存在"}
+    if bool(edits) == bool(patch):
+        return {"error": "edits 与 patch 必须且只能提供一个"}
+
+    # 从读取到写回持有文件锁，同一文件的并发修改不会互相覆盖
+    with file_lock(file_path):
+        return _edit_locked(file_path, edits, patch)
+
+
+def _edit_locked(file_path, edits, patch):
+    content, newline = read_for_edit(file_path)
+    try:
+        if edits:
+            updated, count = apply_replacements(content, edits, newline)
+            message = f"已替换 {count} 处"
+        else:
+            updated, count = apply_unified_diff(content, patch, newline)
+            message = f"已应用 {count} 个补丁块"
+    except PatchError as e:
+        return {"error": str(e)}
+
+    if updated == content:
+        return {"success": True, "message": "文件内容没有变化", "changed": False}
+    _write(file_path, updated, newline='')
+    return {
+        "success": True,
+        "message": f"{message}: {file_path}",
+        "changed": True,
+        "totalLines": updated.count('\n') + (0 if updated.endswith('\n') else 1)
+    }
+
+
+def execute_tool(tool_name, tool_input, project_path=None):
+    """执行工具调用"""
+    try:
+        if tool_name == "write_file":
+            file_path = tool_input.get("file_path")
+            content = tool_input.get("content", "")
+
+            # 安全检查：防止路径遍历
+            if ".." in file_path:
+                return {"error": "无效的路径"}
+
+            # 写入文件（目录不存在时自动创建）
+            _write(file_path, content)
+
+            return {"success": True, "message": f"文件已写入: {file_path}"}
+
+        elif tool_name == "read_file":
+            return _read(tool_input.get("file_path"), tool_input.get("offset"), tool_input.get("limit"))
+
+        elif tool_name == "read_files":
+            files, error = check_batch(tool_input.get("files"))
+            if error:
+                return error
+            return {"files": [read_entry(item.get("file_path"), item.get("offset"), item.get("limit"))
+                              for item in files]}
+
+        elif tool_name == "edit_file":
+            return _edit(tool_input.get("file_path"), tool_input.get("edits"), tool_input.get("patch"))
+
+        elif tool_name == "write_files":
+            files, error = check_batch(tool_input.get("files"))
+            if error:
+                return error
+            results = []
+            for item in files:
+                file_path = item.get("file_path")
+                if not file_path or ".." in file_path:
+                    results.append({"file_path": file_path, "error": "无效的路径"})
+                    continue
+                try:
+                    _write(file_path, item.get("content", ""))
+                    results.append({"file_path": file_path, "success": True})
+                except Exception as e:
+                    results.append({"file_path": file_path, "error": str(e)})
+            written = sum(1 for r in results if r.get("success"))
+            return {"success": written == len(results), "written": written, "files": results}
+
+        elif tool_name == "list_directory":
+            dir_path = tool_input.get("directory_path")
+
+            if not os.path.exists(dir_path):
+                return {"error": "目录不存在"}
+
+            if not os.path.isdir(dir_path):
+                return {"error": "不是有效的目录"}
+
+            items = []
+            for item in os.listdir(dir_path):
+                item_path = os.path.join(dir_path, item)
+                items.append({
+                    "name": item,
+                    "type": "directory" if os.path.isdir(item_path) else "file"
+                })
+
+            return {"items": items}
+
+        elif tool_name == "search_files":
+            if not project_path:
+                return {"error": "当前项目没有工作目录，无法搜索"}
+            query = (tool_input.get("query") or "").strip()
+            if not query:
+                return {"error": "搜索词不能为空"}
+            limit = min(max(int(tool_input.get("limit") or SEARCH_RESULT_LIMIT), 1), SEARCH_MAX_RESULT_LIMIT)
+            hits = search_index.search_files(project_path, query, tool_input.get("path"), limit)
+            return {"results": hits, "count": len(hits)}
+
+        elif tool_name == "get_working_directory":
+            return {"path": project_path or os.getcwd()}
+
+        else:
+            return {"error": f"未知工具: {tool_name}"}
+
+    except Exception as e:
+        return {"error": str(e)}
@@ -0,0 +1,242 @@
+"""项目与对话的流式导出/导入（NDJSON，每行一条记录）
+
+    python transfer.py export -o backup.ndjson.gz [--project ID ...] [--since 2026-01-01] [--until ...]
+    python transfer.py import backup.ndjson.gz [--import-id ID] [--project ID ...] [--since ...] [--until ...]
+
+记录格式：第一行为 {"type": "header", ...}，之后每个项目一行 {"type": "project", ...}，
+紧跟该项目的消息 {"type": "message", "projectId", "role", "content", "createdAt"}。
+导出与导入都是逐条处理的生成器，内存占用与数据量无关；文件可用 gzip 或 zstd 压缩（导入时按文件头自动识别）。
+导入按批提交，已提交的行数记录在数据库中：中断后用同一个 import id 重新导入同一文件会从中断处继续。
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+import zlib
+from datetime import datetime
+from store import store
+from conversation_writer import conversation_writer
+from config import TRANSFER_BATCH_SIZE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMAT_VERSION = 1
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+COMPRESSIONS = ('gzip', 'zstd') if zstandard is not None else ('gzip',)
+
+
+class TransferError(Exception):
+    """导入数据格式错误"""
+
+
+def parse_time(value):
+    """解析时间参数：Unix 时间戳（秒）或 ISO 8601 日期/时间（无时区时按本地时间），空值返回 None"""
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"无效的时间: {value}") from None
+
+
+def export_records(project_ids=None, since=None, until=None):
+    """逐条产出导出记录；消息按 created_at 区间 [since, until) 过滤"""
+    yield {'type': 'header', 'version': FORMAT_VERSION, 'exportedAt': time.time(),
+           'filters': {'projects': project_ids or None, 'since': since, 'until': until}}
+    for project in store.iter_projects(project_ids):
+        # 先等后台写入队列中该项目的消息落库
+        conversation_writer.sync(project['id'])
+        yield {'type': 'project', **project}
+        for message in store.iter_messages(project['id'], since, until):
+            yield {
+                'type': 'message',
+                'projectId': project['id'],
+                'role': message['role'],
+                'content': message['content'],
+                'createdAt': message['createdAt']
+            }
+
+
+def encode_ndjson(records):
+    for record in records:
+        yield (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def compress_stream(chunks, compression=None):
+    """流式压缩字节块；compression 为 None 时原样输出"""
+    if compression is None:
+        yield from chunks
+        return
+    if compression == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    elif compression == 'zstd' and zstandard is not None:
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    else:
+        raise ValueError(f"不支持的压缩格式: {compression}")
+
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            buffer.append(data)
+            size += len(data)
+        # 攒到一定大小再输出，避免大量很小的写入
+        if size >= 64 * 1024:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    buffer.append(compressor.flush())
+    yield b''.join(buffer)
+
+
+def export_stream(project_ids=None, since=None, until=None, compression=None):
+    return compress_stream(encode_ndjson(export_records(project_ids, since, until)), compression)
+
+
+def open_import_stream(raw):
+    """包装二进制输入流：按文件头识别 gzip/zstd 并解压，返回可按行读取的流"""
+    reader = raw if hasattr(raw, 'peek') else io.BufferedReader(raw)
+    head = reader.peek(4)[:4]
+    if head.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=reader, mode='rb')
+    if head.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise TransferError("导入文件为 zstd 压缩，需要安装 zstandard")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(reader))
+    return reader
+
+
+def import_records(lines, import_id, project_ids=None, since=None, until=None, batch_size=TRANSFER_BATCH_SIZE):
+    """逐行导入 NDJSON，返回统计信息
+
+    导入前已存在的项目及其消息会被跳过，不会重复写入。每批记录与进度（已处理的行数、本次导入新建的项目）
+    在同一个事务中提交；同一 import_id 再次导入时跳过已提交的行。
+    """
+    key = f'import:{import_id}'
+    state = json.loads(store.get_meta(key) or '{"line": 0, "projects": []}')
+    resumed_from = state['line']
+    # 本次导入新建的项目：它们的消息需要导入；其余项目的消息跳过
+    accepted = set(state['projects'])
+    wanted = set(project_ids) if project_ids else None
+    stats = {'importId': import_id, 'resumedFromLine': resumed_from, 'lines': resumed_from,
+             'projects': 0, 'messages': 0, 'skipped': 0}
+
+    projects, rows = [], []
+    skipped = 0
+
+    def commit(line):
+        state['line'] = line
+        state['projects'] = sorted(accepted)
+        store.import_batch(projects, rows, meta={key: json.dumps(state)})
+        stats['lines'] = line
+        stats['projects'] += len(projects)
+        stats['messages'] += len(rows)
+        stats['skipped'] += skipped
+
+    line_no = 0
+    for line_no, line in enumerate(lines, 1):
+        if line_no <= resumed_from or not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise TransferError(f"第 {line_no} 行不是有效的 JSON") from None
+
+        kind = record.get('type')
+        if kind == 'header':
+            if record.get('version', FORMAT_VERSION) > FORMAT_VERSION:
+                raise TransferError(f"不支持的导出格式版本: {record.get('version')}")
+        elif kind == 'project':
+            project_id = record.get('id')
+            if not project_id:
+                raise TransferError(f"第 {line_no} 行缺少项目 id")
+            if (wanted is None or project_id in wanted) and project_id not in accepted \
+                    and not store.get_project(project_id):
+                accepted.add(project_id)
+                projects.append(record)
+            else:
+                skipped += 1
+        elif kind == 'message':
+            created_at = record.get('createdAt') or 0
+            if record.get('projectId') in accepted and (since is None or created_at >= since) \
+                    and (until is None or created_at < until):
+                rows.append((record['projectId'], record.get('role', 'user'), record.get('content', ''), created_at))
+            else:
+                skipped += 1
+        else:
+            raise TransferError(f"第 {line_no} 行的记录类型未知: {kind}")
+
+        if len(projects) + len(rows) + skipped >= batch_size:
+            commit(line_no)
+            projects, rows, skipped = [], [], 0
+
+    commit(max(line_no, resumed_from))
+    # 导入完成后不再需要断点
+    store.delete_meta(key)
+    return stats
+
+
+def file_import_id(path):
+    """CLI 默认的 import id：由文件的绝对路径、大小与修改时间确定，同一文件重新导入时自动续传"""
+    stat = os.stat(path)
+    ident = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(ident.encode('utf-8')).hexdigest()[:16]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='项目与对话的 NDJSON 导出/导入')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='导出到文件或标准输出')
+    export_parser.add_argument('-o', '--output', help='输出文件（默认标准输出）；以 .gz/.zst 结尾时自动压缩')
+    export_parser.add_argument('--compress', choices=COMPRESSIONS)
+
+    import_parser = commands.add_parser('import', help='从文件导入（- 为标准输入）')
+    import_parser.add_argument('input')
+    import_parser.add_argument('--import-id', help='断点续传标识（默认由文件路径、大小与修改时间生成）')
+
+    for sub in (export_parser, import_parser):
+        sub.add_argument('--project', action='append', help='只处理指定项目（可重复）')
+        sub.add_argument('--since', help='只处理该时间之后的消息（时间戳或 ISO 日期）')
+        sub.add_argument('--until', help='只处理该时间之前的消息')
+
+    args = parser.parse_args(argv)
+    since, until = parse_time(args.since), parse_time(args.until)
+
+    if args.command == 'export':
+        compression = args.compress
+        if compression is None and args.output:
+            compression = {'.gz': 'gzip', '.zst': 'zstd'}.get(os.path.splitext(args.output)[1])
+        out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        try:
+            for chunk in export_stream(args.project, since, until, compression):
+                out.write(chunk)
+        finally:
+            if args.output:
+                out.close()
+        return
+
+    if args.input == '-':
+        import_id = args.import_id or f"stdin-{int(time.time())}"
+        stats = import_records(open_import_stream(sys.stdin.buffer), import_id, args.project, since, until)
+    else:
+        import_id = args.import_id or file_import_id(args.input)
+        with open(args.input, 'rb') as f:
+            stats = import_records(open_import_stream(f), import_id, args.project, since, until)
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
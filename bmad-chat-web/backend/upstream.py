@@ -0,0 +1,328 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from config import (
+    ANTHROPIC_BASE_URL, ANTHROPIC_API_KEY, MODEL_NAME, FALLBACK_MODEL,
+    UPSTREAM_MAX_CONNECTIONS, UPSTREAM_MAX_KEEPALIVE, UPSTREAM_KEEPALIVE_EXPIRY,
+    UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT,
+    UPSTREAM_MAX_RETRIES, UPSTREAM_RETRY_BASE_DELAY, UPSTREAM_RETRY_MAX_DELAY,
+    UPSTREAM_MAX_CONCURRENCY, UPSTREAM_MAX_QUEUE, UPSTREAM_QUEUE_TIMEOUT
+)
+# anthropic（连同 httpx、pydantic）导入较慢，只在首次用到时于函数内导入
+
+# 可以重试的 HTTP 状态码（529 为上游过载）
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class UpstreamBusyError(Exception):
+    """上游并发已满，排队超过上限或等待超时"""
+
+
+def is_retryable(error):
+    from anthropic import APIStatusError, APIConnectionError
+
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        should_retry = error.response.headers.get('x-should-retry')
+        if should_retry in ('true', 'false'):
+            return should_retry == 'true'
+        return error.status_code in RETRY_STATUS
+    return False
+
+
+def retry_after(error):
+    """从响应头中读取 Retry-After（秒），没有时返回 None"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt, error):
+    """第 attempt 次重试前的等待时间：优先遵循 Retry-After，否则为带抖动的指数退避"""
+    delay = retry_after(error)
+    if delay is not None:
+        return min(delay, UPSTREAM_RETRY_MAX_DELAY)
+    return random.uniform(0, min(UPSTREAM_RETRY_MAX_DELAY, UPSTREAM_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def error_status(error):
+    """把上游错误映射为返回给前端的 (状态码, Retry-After 秒数)"""
+    if isinstance(error, UpstreamBusyError):
+        return 503, 5
+    from anthropic import APIStatusError, APIConnectionError, APITimeoutError
+
+    if isinstance(error, APITimeoutError):
+        return 504, None
+    if isinstance(error, APIConnectionError):
+        return 502, None
+    if isinstance(error, APIStatusError):
+        delay = retry_after(error)
+        delay = int(delay) + 1 if delay is not None else None
+        if error.status_code == 429:
+            return 429, delay or 5
+        if error.status_code in (503, 529):
+            return 503, delay or 5
+        if error.status_code >= 500:
+            return 502, delay
+        return error.status_code, None
+    return 500, None
+
+
+class SharedStream:
+    """一次上游流式请求，由参数相同的多个调用方共享
+
+    收到的事件依次保存，每个订阅者从第一个事件开始读取，因此中途加入的调用方也能得到完整的输出。
+    """
+
+    def __init__(self):
+        self.events = []
+        self.final = None
+        self.error = None
+        self.done = False
+        self.subscribers = 0
+        self.task = None
+        self._update = asyncio.Event()
+
+    def push(self, event):
+        self.events.append(event)
+        self._notify()
+
+    def finish(self, final=None, error=None):
+        self.final, self.error, self.done = final, error, True
+        self._notify()
+
+    def _notify(self):
+        update, self._update = self._update, asyncio.Event()
+        update.set()
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        index = 0
+        while True:
+            update = self._update
+            if index < len(self.events):
+                yield self.events[index]
+                index += 1
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await update.wait()
+
+    async def get_final_message(self):
+        while not self.done:
+            await self._update.wait()
+        if self.error is not None:
+            raise self.error
+        return self.final
+
+
+class UpstreamClient:
+    """上游模型接口的统一入口
+
+    所有请求共用一个后台事件循环和一个 keep-alive 连接池；
+    同时进行的请求数受全局上限限制，超出的请求排队等待；
+    429/5xx/连接错误按 Retry-After 或带抖动的指数退避重试，仍失败时可改用备用模型。
+    相同参数的请求同时进行时只发送一次：非流式请求共享结果，流式请求共享同一个上游流（见 SharedStream）。
+    """
+
+    def __init__(self, max_concurrency=UPSTREAM_MAX_CONCURRENCY, max_queue=UPSTREAM_MAX_QUEUE,
+                 queue_timeout=UPSTREAM_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._loop = None
+        self._client = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._streams = {}
+        self._active = 0
+        self._waiting = 0
+        self._counters = {'requests': 0, 'retries': 0, 'fallbacks': 0, 'rejected': 0, 'coalesced': 0}
+
+    def loop(self):
+        """后台事件循环（首次使用时启动）"""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    import httpx
+                    from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever, name='upstream', daemon=True)
+                    thread.start()
+                    self._client = AsyncAnthropic(
+                        base_url=ANTHROPIC_BASE_URL,
+                        api_key=ANTHROPIC_API_KEY,
+                        # 重试由本模块负责
+                        max_retries=0,
+                        timeout=httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+                        http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                            max_connections=UPSTREAM_MAX_CONNECTIONS,
+                            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+                            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY
+                        ))
+                    )
+                    self._slots = asyncio.Semaphore(self.max_concurrency)
+                    self._loop = loop
+        return self._loop
+
+    @asynccontextmanager
+    async def _slot(self):
+        """占用一个并发名额，排队已满或等待超时抛出 UpstreamBusyError"""
+        if self._slots.locked() and self._waiting >= self.max_queue:
+            self._counters['rejected'] += 1
+            raise UpstreamBusyError("模型服务繁忙，请稍后重试")
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._counters['rejected'] += 1
+            raise UpstreamBusyError("模型服务繁忙，请稍后重试") from None
+        finally:
+            self._waiting -= 1
+        self._active += 1
+        try:
+            yield
+        finally:
+            self._active -= 1
+            self._slots.release()
+
+    async def _call(self, send, params):
+        """按重试与备用模型策略调用 send(params)"""
+        from anthropic import APIStatusError, APIConnectionError
+
+        models = [params.get('model') or MODEL_NAME]
+        if FALLBACK_MODEL and FALLBACK_MODEL not in models:
+            models.append(FALLBACK_MODEL)
+
+        for index, model in enumerate(models):
+            if index:
+                self._counters['fallbacks'] += 1
+            attempt = 0
+            while True:
+                self._counters['requests'] += 1
+                try:
+                    return await send(dict(params, model=model))
+                except (APIStatusError, APIConnectionError) as e:
+                    if not is_retryable(e):
+                        raise
+                    if attempt >= UPSTREAM_MAX_RETRIES:
+                        if index == len(models) - 1:
+                            raise
+                        print(f"Model {model} failed after {attempt + 1} attempts, falling back: {e}")
+                        break
+                    delay = retry_delay(attempt, e)
+                    attempt += 1
+                    self._counters['retries'] += 1
+                    await asyncio.sleep(delay)
+
+    @staticmethod
+    def _key(params):
+        return json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+
+    @asynccontextmanager
+    async def stream(self, **params):
+        """流式请求，相同参数的并发请求共享一次上游请求
+
+        只在收到响应前重试，开始输出后出错直接抛出（出错时所有共享的调用方都会收到该错误）；
+        全部调用方都退出时取消上游请求。
+        """
+        self.loop()
+        key = self._key(params)
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = SharedStream()
+            shared.task = asyncio.ensure_future(self._pump_stream(shared, params))
+            self._streams[key] = shared
+            shared.task.add_done_callback(lambda _: self._drop_stream(key, shared))
+        else:
+            self._counters['coalesced'] += 1
+        shared.subscribers += 1
+        try:
+            yield shared
+        finally:
+            shared.subscribers -= 1
+            if not shared.subscribers and not shared.done:
+                self._drop_stream(key, shared)
+                shared.task.cancel()
+
+    def _drop_stream(self, key, shared):
+        if self._streams.get(key) is shared:
+            del self._streams[key]
+
+    async def _pump_stream(self, shared, params):
+        """发送流式请求，把事件与最终消息交给 shared"""
+        async def open_stream(params):
+            manager = self._client.messages.stream(**params)
+            return manager, await manager.__aenter__()
+
+        try:
+            async with self._slot():
+                manager, stream = await self._call(open_stream, params)
+                try:
+                    async for event in stream:
+                        shared.push(event)
+                    final = await stream.get_final_message()
+                finally:
+                    await manager.__aexit__(None, None, None)
+        except Exception as e:
+            shared.finish(error=e)
+        else:
+            shared.finish(final)
+
+    async def acreate(self, **params):
+        """非流式请求，相同参数的并发请求合并为一次"""
+        self.loop()
+        key = self._key(params)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self._counters['coalesced'] += 1
+            return await asyncio.shield(pending)
+
+        async def send():
+            async with self._slot():
+                return await self._call(lambda p: self._client.messages.create(**p), params)
+
+        task = asyncio.ensure_future(send())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def create(self, **params):
+        """在请求线程中同步调用 acreate()（不能在后台事件循环内调用）"""
+        future = asyncio.run_coroutine_threadsafe(self.acreate(**params), self.loop())
+        return future.result()
+
+    def stats(self):
+        return {
+            'active': self._active,
+            'waiting': self._waiting,
+            'maxConcurrency': self.max_concurrency,
+            **self._counters
+        }
+
+
+upstream = UpstreamClient()
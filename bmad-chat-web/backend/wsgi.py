@@ -0,0 +1,4 @@
+"""WSGI 入口：BMAD_SERVER_MODE=wsgi gunicorn -c gunicorn.conf.py（默认的 ASGI 入口见 asgi.py）"""
+from app import app
+
+application = app
@@ -1,5 +1,5 @@
-import { useState, useEffect } from 'react'
-import { fetchAgents, fetchProjects, createProject, fetchProjectFiles, readFile, startClaude, sendClaudeChat, getClaudeStatus } from './api'
+import { useState, useEffect, useRef } from 'react'
+import { fetchAgents, fetchProjects, createProject, fetchConversations, readFile, startClaude, sendClaudeChatStream, readEventStream, getClaudeStatus } from './api'
 import FileExplorer from './components/FileExplorer'
 import ChatWindow from './components/ChatWindow'
 import NewProjectModal from './components/NewProjectModal'
@@ -10,8 +10,12 @@ function App() {
   const [agents, setAgents] = useState([])
   const [projects, setProjects] = useState([])
   const [currentProject, setCurrentProject] = useState(null)
-  const [files, setFiles] = useState([])
+  const [filesVersion, setFilesVersion] = useState(0)
   const [messages, setMessages] = useState([])
+  // 更早一页对话历史的游标，为 null 时已没有更早的消息
+  const [historyCursor, setHistoryCursor] = useState(null)
+  const [historyLoading, setHistoryLoading] = useState(false)
+  const historyProjectId = useRef(null)
   const [showNewProject, setShowNewProject] = useState(false)
   const [loading, setLoading] = useState(false)
   const [previewFile, setPreviewFile] = useState(null)
@@ -27,12 +31,39 @@ function App() {
     initClaude()
   }, [])
 
-  // 当项目变化时加载文件
+  // 切换项目时加载最近一页对话历史
   useEffect(() => {
-    if (currentProject) {
-      loadFiles(currentProject.id)
+    historyProjectId.current = currentProject?.id ?? null
+    setMessages([])
+    setHistoryCursor(null)
+    if (!currentProject) return
+    let cancelled = false
+    fetchConversations(currentProject.id)
+      .then(page => {
+        if (cancelled) return
+        setMessages(prev => [...page.items, ...prev])
+        setHistoryCursor(page.nextCursor)
+      })
+      .catch(error => console.error('加载对话历史失败:', error))
+    return () => { cancelled = true }
+  }, [currentProject?.id])
+
+  async function loadOlderMessages() {
+    if (!currentProject || !historyCursor || historyLoading) return
+    const projectId = currentProject.id
+    setHistoryLoading(true)
+    try {
+      const page = await fetchConversations(projectId, historyCursor)
+      // 加载期间切换了项目
+      if (projectId !== historyProjectId.current) return
+      setMessages(prev => [...page.items, ...prev])
+      setHistoryCursor(page.nextCursor)
+    } catch (error) {
+      console.error('加载对话历史失败:', error)
+    } finally {
+      setHistoryLoading(false)
     }
-  }, [currentProject])
+  }
 
   async function initClaude() {
     try {
@@ -57,9 +88,9 @@ function App() {
     }
   }
 
-  async function loadFiles(projectId) {
-    const data = await fetchProjectFiles(projectId)
-    setFiles(data)
+  // 文件浏览器按目录懒加载，这里只通知它刷新
+  function loadFiles() {
+    setFilesVersion(v => v + 1)
   }
 
   async function handleFileClick(file) {
@@ -84,10 +115,8 @@ function App() {
   async function handleCreateProject(name, path) {
     try {
       const project = await createProject(name, path)
-      project.conversations = []
       setProjects([...projects, project])
       setCurrentProject(project)
-      setMessages([])
       setShowNewProject(false)
     } catch (error) {
       console.error('Error creating project:', error)
@@ -107,13 +136,31 @@ function App() {
       const userMsg = { role: 'user', content }
       setMessages(prev => [...prev, userMsg])
 
-      const response = await sendClaudeChat(content, currentProject?.path)
+      const body = await sendClaudeChatStream(content, currentProject?.path, claudeStatus?.sessionId)
+
+      // 先放入空的助手消息，随着 CLI 输出逐步追加内容
+      setMessages(prev => [...prev, { role: 'assistant', content: '' }])
+      const appendToReply = (text) => {
+        setMessages(prev => {
+          const last = prev[prev.length - 1]
+          return [...prev.slice(0, -1), { ...last, content: last.content + text }]
+        })
+      }
 
-      const aiMsg = { role: 'assistant', content: response.reply }
-      setMessages(prev => [...prev, aiMsg])
+      let streamError = null
+      await readEventStream(body, (event) => {
+        if (event.type === 'text') {
+          appendToReply(event.text)
+        } else if (event.error) {
+          streamError = event.error
+        }
+      })
+      if (streamError) {
+        throw new Error(streamError)
+      }
 
       if (currentProject) {
-        loadFiles(currentProject.id)
+        loadFiles()
       }
     } catch (error) {
       console.error('Error sending message:', error)
@@ -138,7 +185,6 @@ function App() {
             onChange={(e) => {
               const p = projects.find(p => p.id === e.target.value)
               setCurrentProject(p)
-              setMessages([])
             }}
           >
             {projects.map(p => (
@@ -163,8 +209,9 @@ function App() {
         {/* 左侧：文件浏览器 */}
         <aside className="sidebar">
           <FileExplorer
-            files={files}
-            onRefresh={() => currentProject && loadFiles(currentProject.id)}
+            projectId={currentProject?.id}
+            refreshKey={filesVersion}
+            onRefresh={() => currentProject && loadFiles()}
             onFileClick={handleFileClick}
           />
         </aside>
@@ -175,6 +222,9 @@ function App() {
             messages={messages}
             onSendMessage={handleSendMessage}
             loading={loading}
+            hasOlder={!!historyCursor}
+            loadingOlder={historyLoading}
+            onLoadOlder={loadOlderMessages}
           />
         </section>
       </main>
@@ -192,7 +242,10 @@ function App() {
         <div className="modal-overlay" onClick={closePreview}>
           <div className="modal file-preview-modal" onClick={(e) => e.stopPropagation()}>
             <div className="preview-header">
-              <h3>{previewFile.name}</h3>
+              <h3>
+                {previewFile.name}
+                {previewContent?.hasMore && ` （文件较大，仅显示前 ${previewContent.lines} 行）`}
+              </h3>
               <button className="close-btn" onClick={closePreview}>×</button>
             </div>
             <div className="preview-content">
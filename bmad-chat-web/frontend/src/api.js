@@ -23,6 +23,17 @@ export async function createProject(name, path) {
   return res.json();
 }
 
+export async function fetchConversations(projectId, before = null, limit = 50) {
+  const params = new URLSearchParams({ limit });
+  if (before) params.set('before', before);
+  const res = await fetch(`${API_BASE}/projects/${projectId}/conversations?${params}`);
+  if (!res.ok) {
+    const error = await res.json();
+    throw new Error(error.error || '获取对话历史失败');
+  }
+  return res.json();
+}
+
 export async function deleteProject(projectId) {
   const res = await fetch(`${API_BASE}/projects/${projectId}`, {
     method: 'DELETE'
@@ -30,16 +41,36 @@ export async function deleteProject(projectId) {
   return res.json();
 }
 
-export async function fetchProjectFiles(projectId, recursive = true) {
-  const res = await fetch(`${API_BASE}/projects/${projectId}/files?recursive=${recursive}`);
+export async function fetchProjectFiles(projectId, recursive = true, refresh = false) {
+  const res = await fetch(`${API_BASE}/projects/${projectId}/files?recursive=${recursive}&refresh=${refresh}`);
   return res.json();
 }
 
-export async function sendChat(projectId, agentId, message, history) {
+export async function listProjectFiles(projectId, path = null, offset = 0, limit = 200) {
+  const params = new URLSearchParams({ offset, limit });
+  if (path) params.set('path', path);
+  const res = await fetch(`${API_BASE}/projects/${projectId}/files/list?${params}`);
+  if (!res.ok) {
+    const error = await res.json();
+    throw new Error(error.error || '获取文件列表失败');
+  }
+  return res.json();
+}
+
+export async function fetchFileChanges(projectId, since) {
+  const res = await fetch(`${API_BASE}/projects/${projectId}/files/changes?since=${encodeURIComponent(since)}`);
+  if (!res.ok) {
+    const error = await res.json();
+    throw new Error(error.error || '获取文件变化失败');
+  }
+  return res.json();
+}
+
+export async function sendChat(projectId, agentId, message) {
   const res = await fetch(`${API_BASE}/chat`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ projectId, agentId, message, history })
+    body: JSON.stringify({ projectId, agentId, message })
   });
   if (!res.ok) {
     const error = await res.json();
@@ -48,18 +79,19 @@ export async function sendChat(projectId, agentId, message, history) {
   return res.json();
 }
 
-export async function sendChatStream(projectId, agentId, message, history) {
+export async function sendChatStream(projectId, agentId, message) {
   const res = await fetch(`${API_BASE}/chat/stream`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ projectId, agentId, message, history })
+    body: JSON.stringify({ projectId, agentId, message })
   });
   return res.body;
 }
 
-export async function readFile(filePath) {
-  const encodedPath = encodeURIComponent(filePath);
-  const res = await fetch(`${API_BASE}/files/read?path=${encodedPath}`);
+export async function readFile(filePath, offset = 0, limit = null) {
+  const params = new URLSearchParams({ path: filePath, offset });
+  if (limit) params.set('limit', limit);
+  const res = await fetch(`${API_BASE}/files/read?${params}`);
   if (!res.ok) {
     const error = await res.json();
     throw new Error(error.error || '读取文件失败');
@@ -80,11 +112,11 @@ export async function startClaude(mode = 'local', workingDir = null) {
   return res.json();
 }
 
-export async function sendClaudeChat(message, workingDir = null) {
+export async function sendClaudeChat(message, workingDir = null, sessionId = null) {
   const res = await fetch(`${API_BASE}/claude/chat`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ message, workingDir })
+    body: JSON.stringify({ message, workingDir, sessionId })
   });
   if (!res.ok) {
     const error = await res.json();
@@ -93,9 +125,44 @@ export async function sendClaudeChat(message, workingDir = null) {
   return res.json();
 }
 
-export async function stopClaude() {
+export async function sendClaudeChatStream(message, workingDir = null, sessionId = null, signal = null) {
+  const res = await fetch(`${API_BASE}/claude/chat/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ message, workingDir, sessionId }),
+    signal
+  });
+  if (!res.ok) {
+    const error = await res.json();
+    throw new Error(error.error || '发送消息失败');
+  }
+  return res.body;
+}
+
+// 逐个解析 SSE 响应中的 data 事件
+export async function readEventStream(body, onEvent) {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const frames = buffer.split('\n\n');
+    buffer = frames.pop();
+    for (const frame of frames) {
+      if (frame.startsWith('data: ')) {
+        onEvent(JSON.parse(frame.slice(6)));
+      }
+    }
+  }
+}
+
+export async function stopClaude(sessionId = null) {
   const res = await fetch(`${API_BASE}/claude/stop`, {
-    method: 'POST'
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ sessionId })
   });
   if (!res.ok) {
     const error = await res.json();
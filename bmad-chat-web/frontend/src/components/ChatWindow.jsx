@@ -1,13 +1,14 @@
 import { useState, useRef, useEffect } from 'react'
 
-function ChatWindow({ messages, onSendMessage, loading }) {
+function ChatWindow({ messages, onSendMessage, loading, hasOlder, loadingOlder, onLoadOlder }) {
   const [input, setInput] = useState('')
   const messagesEndRef = useRef(null)
 
-  // 自动滚动到底部
+  // 最新一条消息变化时自动滚动到底部（加载更早的历史时不滚动）
+  const lastMessage = messages[messages.length - 1]
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' })
-  }, [messages])
+  }, [lastMessage])
 
   const handleSubmit = (e) => {
     e.preventDefault()
@@ -26,6 +27,12 @@ function ChatWindow({ messages, onSendMessage, loading }) {
   return (
     <div className="chat-window">
       <div className="messages">
+        {hasOlder && (
+          <button className="load-older-btn" onClick={onLoadOlder} disabled={loadingOlder}>
+            {loadingOlder ? '加载中...' : '加载更早的消息'}
+          </button>
+        )}
+
         {/* 欢迎消息 */}
         {messages.length === 0 && (
           <div className="message assistant">
@@ -39,7 +46,7 @@ function ChatWindow({ messages, onSendMessage, loading }) {
 
         {/* 历史消息 */}
         {messages.map((msg, index) => (
-          <div key={index} className={`message ${msg.role}`}>
+          <div key={msg.id ?? `new-${index}`} className={`message ${msg.role}`}>
             {msg.role === 'assistant' && (
               <div className="message-header">
                 <span>🤖</span>
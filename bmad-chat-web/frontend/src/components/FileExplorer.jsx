@@ -1,7 +1,92 @@
-import { useState } from 'react'
+import { useState, useEffect, useRef } from 'react'
+import { listProjectFiles, fetchFileChanges } from '../api'
 
-function FileExplorer({ files, onRefresh, onFileClick }) {
+// 根目录在 listings 中的键
+const ROOT = ''
+// 轮询文件变化的间隔（毫秒），页面不可见时跳过
+const POLL_INTERVAL = 5000
+
+function parentDir(path) {
+  return path.slice(0, Math.max(path.lastIndexOf('/'), path.lastIndexOf('\\')))
+}
+
+function FileExplorer({ projectId, refreshKey, onRefresh, onFileClick }) {
   const [expandedDirs, setExpandedDirs] = useState({})
+  // 目录路径 -> { items, hasMore, total }
+  const [listings, setListings] = useState({})
+  const lastProjectId = useRef(null)
+  // 已加载内容对应的文件树版本（epoch:version，只在返回它的后端工作进程内有效）与项目根目录的绝对路径，用于增量同步
+  const version = useRef(null)
+  const rootPath = useRef(null)
+  const listingsRef = useRef(listings)
+  listingsRef.current = listings
+
+  // 切换项目时重置；刷新时重新加载根目录和已展开的目录
+  useEffect(() => {
+    if (!projectId) return
+    let expanded = expandedDirs
+    if (lastProjectId.current !== projectId) {
+      lastProjectId.current = projectId
+      expanded = {}
+      rootPath.current = null
+      setExpandedDirs({})
+      setListings({})
+    }
+    // 全部重新加载，版本以根目录的结果为准
+    version.current = null
+    loadDir(ROOT)
+    Object.keys(expanded).filter(path => expanded[path]).forEach(path => loadDir(path))
+  }, [projectId, refreshKey])
+
+  // 定期拉取文件树变更，只重新加载发生变化的已加载目录
+  useEffect(() => {
+    if (!projectId) return
+    const timer = setInterval(pollChanges, POLL_INTERVAL)
+    return () => clearInterval(timer)
+  }, [projectId])
+
+  async function pollChanges() {
+    if (document.hidden || version.current === null) return
+    try {
+      const data = await fetchFileChanges(projectId, version.current)
+      const loaded = Object.keys(listingsRef.current)
+      let dirs
+      if (data.reset) {
+        // 变更日志已不完整或版本来自其他工作进程，重新加载全部已加载的目录
+        dirs = loaded
+      } else {
+        const changed = new Set(data.changes.map(change => {
+          const dir = parentDir(change.path)
+          return dir === rootPath.current ? ROOT : dir
+        }))
+        dirs = loaded.filter(dir => changed.has(dir))
+      }
+      version.current = data.version
+      dirs.forEach(dir => loadDir(dir))
+    } catch (error) {
+      console.error('获取文件变化失败:', error)
+    }
+  }
+
+  async function loadDir(path, offset = 0) {
+    try {
+      const data = await listProjectFiles(projectId, path || null, offset)
+      if (path === ROOT) {
+        rootPath.current = data.path
+        if (version.current === null) version.current = data.version
+      }
+      setListings(prev => ({
+        ...prev,
+        [path]: {
+          items: offset > 0 && prev[path] ? [...prev[path].items, ...data.items] : data.items,
+          hasMore: data.hasMore,
+          total: data.total
+        }
+      }))
+    } catch (error) {
+      console.error('加载目录失败:', error)
+    }
+  }
 
   const getFileIcon = (filename) => {
     const ext = filename.split('.').pop()?.toLowerCase()
@@ -97,15 +182,27 @@ function FileExplorer({ files, onRefresh, onFileClick }) {
     return parseFloat((bytes / Math.pow(k, i)).toFixed(1)) + ' ' + sizes[i]
   }
 
+  const formatTime = (timestamp) => {
+    if (!timestamp) return ''
+    const date = new Date(timestamp * 1000)
+    const pad = (n) => String(n).padStart(2, '0')
+    return `${date.getFullYear()}-${pad(date.getMonth() + 1)}-${pad(date.getDate())} ${pad(date.getHours())}:${pad(date.getMinutes())}`
+  }
+
   const toggleDir = (path) => {
+    if (!expandedDirs[path] && !listings[path]) {
+      loadDir(path)
+    }
     setExpandedDirs(prev => ({
       ...prev,
       [path]: !prev[path]
     }))
   }
 
-  const renderFileTree = (items, level = 0) => {
-    return items.map((file, index) => (
+  const renderFileTree = (dirPath, level = 0) => {
+    const listing = listings[dirPath]
+    if (!listing) return null
+    const rows = listing.items.map((file, index) => (
       <div key={file.path + index} style={{ marginLeft: level * 12 }}>
         <div
           className={`file-item ${file.type === 'directory' ? 'directory' : ''}`}
@@ -124,7 +221,7 @@ function FileExplorer({ files, onRefresh, onFileClick }) {
               </span>
               <span className="file-name">{file.name}</span>
               <span className="file-meta">
-                {file.modified && `· ${file.modified}`}
+                {file.modified && `· ${formatTime(file.modified)}`}
               </span>
             </>
           ) : (
@@ -137,13 +234,23 @@ function FileExplorer({ files, onRefresh, onFileClick }) {
             </>
           )}
         </div>
-        {file.type === 'directory' && expandedDirs[file.path] && file.children && (
+        {file.type === 'directory' && expandedDirs[file.path] && (
           <div className="file-children">
-            {renderFileTree(file.children, level + 1)}
+            {renderFileTree(file.path, level + 1)}
           </div>
         )}
       </div>
     ))
+    if (listing.hasMore) {
+      rows.push(
+        <div key={dirPath + ':more'} style={{ marginLeft: level * 12 }}>
+          <div className="file-item" onClick={() => loadDir(dirPath, listing.items.length)}>
+            <span className="file-name">加载更多（{listing.items.length}/{listing.total}）</span>
+          </div>
+        </div>
+      )
+    }
+    return rows
   }
 
   return (
@@ -153,12 +260,12 @@ function FileExplorer({ files, onRefresh, onFileClick }) {
         <button className="refresh-btn" onClick={onRefresh}>🔄</button>
       </h3>
       <div className="file-tree">
-        {files.length === 0 ? (
+        {!listings[ROOT] || listings[ROOT].items.length === 0 ? (
           <p style={{ color: '#999', fontSize: '13px', padding: '8px' }}>
             暂无文件，请先创建项目
           </p>
         ) : (
-          renderFileTree(files)
+          renderFileTree(ROOT)
         )}
       </div>
     </div>